@@ -1,6 +1,8 @@
 import json
+from typing import Callable, Optional
 
 from earthquake_data_layer import Storage, definitions, helpers, settings
+from earthquake_data_layer.leases import Claims
 
 LOG_MESSAGE_INIT_DATASET = "initiating the dataset"
 LOG_MESSAGE_INIT_DATASET_COMPLETE = "the dataset was successfully downloaded"
@@ -11,10 +13,16 @@ LOG_MESSAGE_INIT_DATASET_PATCHING = (
 )
 
 
-def collect_dataset() -> dict:
+def collect_dataset(
+    claims: Optional[Claims] = None, fence: Optional[Callable[[], bool]] = None
+) -> dict:
     """
     Collect earthquake dataset for the specified date range.
 
+    Args:
+        claims (Claims): the claims of a distributed collection, optional.
+        fence (Callable[[], bool]): returns False once this process may not write the dataset anymore, optional.
+
     Returns:
         dict: Metadata of the collected dataset.
     """
@@ -29,75 +37,163 @@ def collect_dataset() -> dict:
     }
 
     metadata = helpers.fetch_months_data(
-        helpers.DatasetMonths(first_date=first_date, last_date=last_date), metadata
+        helpers.DatasetMonths(first_date=first_date, last_date=last_date),
+        metadata,
+        claims=claims,
+        fence=fence,
     )
 
     return metadata
 
 
-def patch_dataset(metadata: dict) -> dict:
+def incomplete_months(metadata: dict) -> list[tuple[int, int]]:
     """
-    Patch incomplete dates in the dataset.
+    The months of the collection that didn't succeed: the months that failed, and those without a status when the
+    collection stopped midway (or other processes are still collecting them).
 
     Args:
         metadata (dict): Metadata of the dataset.
 
     Returns:
-        dict: Updated metadata after patching.
+        list[tuple[int, int]]: the (year, month) to fetch again.
     """
-    incomplete_dates = [
-        (year, month)
+    statuses = {
+        helpers.month_label(year, month): status
         for year, months in metadata.get("details", {}).items()
         for month, status in months.items()
-        if status != definitions.STATUS_PIPELINE_SUCCESS
+    }
+    if metadata.get("first_date") and metadata.get("last_date"):
+        months = helpers.DatasetMonths(
+            first_date=metadata["first_date"], last_date=metadata["last_date"]
+        )
+    else:
+        months = [(int(label[:4]), int(label[5:])) for label in statuses]
+
+    return [
+        (year, month)
+        for year, month in months
+        if statuses.get(helpers.month_label(year, month))
+        != definitions.STATUS_PIPELINE_SUCCESS
     ]
 
-    metadata = helpers.fetch_months_data(incomplete_dates, metadata)
+
+def patch_dataset(
+    metadata: dict,
+    claims: Optional[Claims] = None,
+    fence: Optional[Callable[[], bool]] = None,
+) -> dict:
+    """
+    Patch incomplete dates in the dataset.
+
+    Args:
+        metadata (dict): Metadata of the dataset.
+        claims (Claims): the claims of a distributed collection, optional.
+        fence (Callable[[], bool]): returns False once this process may not write the dataset anymore, optional.
+
+    Returns:
+        dict: Updated metadata after patching.
+    """
+    metadata = helpers.fetch_months_data(
+        incomplete_months(metadata), metadata, claims=claims, fence=fence
+    )
 
     return metadata
 
 
-def verify_initial_dataset() -> bool:
+def initial_dataset_complete(storage: Optional[Storage] = None) -> bool:
     """
-    Verify if the initial earthquake dataset was collected.
+    Checks if the initial dataset was completely collected, without collecting or patching it.
 
     Returns:
-        bool: True if the dataset was successfully collected, False otherwise.
+        bool: True if the collection metadata is complete, False otherwise.
     """
-    settings.logger.info(LOG_MESSAGE_VERIFY_DATASET)
-
-    storage = Storage()
-    if storage.list_objects(prefix=definitions.COLLECTION_METADATA_KEY):
-        settings.logger.info("the initial dataset was initiated")
+    if storage is None:
+        storage = Storage()
 
+    try:
         collection_metadata = json.loads(
             storage.load_object(definitions.COLLECTION_METADATA_KEY)
             .read()
             .decode("utf-8")
         )
-        # pylint: disable=no-else-return
-        if (
-            collection_metadata.get("status")
-            == definitions.STATUS_COLLECTION_METADATA_COMPLETE
-        ):
-            settings.logger.info(LOG_MESSAGE_INIT_DATASET_COMPLETE)
-            return True
-        elif (
-            collection_metadata.get("status")
-            == definitions.STATUS_COLLECTION_METADATA_INCOMPLETE
-        ):
-            settings.logger.info(LOG_MESSAGE_INIT_DATASET_PATCHING)
-            collection_metadata = patch_dataset(collection_metadata)
+    except FileNotFoundError:
+        return False
 
-    else:
-        settings.logger.info(LOG_MESSAGE_INIT_DATASET)
-        collection_metadata = collect_dataset()
-
-    storage.save_object(
-        json.dumps(collection_metadata).encode("utf-8"),
-        definitions.COLLECTION_METADATA_KEY,
+    return (
+        collection_metadata.get("status")
+        == definitions.STATUS_COLLECTION_METADATA_COMPLETE
     )
 
+
+def verify_initial_dataset(fence: Optional[Callable[[], bool]] = None) -> bool:
+    """
+    Verify if the initial earthquake dataset was collected.
+    With settings.DISTRIBUTED_COLLECTION the dataset is collected with the other processes sharing the bucket, each
+    fetches the months it claims and the metadata is saved merged with theirs. The claims need a storage that
+    enforces conditional writes, nothing is collected otherwise.
+
+    Args:
+        fence (Callable[[], bool]): returns False once this process may not write the dataset anymore, e.g. it lost
+            the leader lease, optional.
+
+    Returns:
+        bool: True if the dataset was successfully collected, False otherwise.
+    """
+    settings.logger.info(LOG_MESSAGE_VERIFY_DATASET)
+
+    storage = Storage()
+    if settings.DISTRIBUTED_COLLECTION and not storage.enforces_conditional_writes():
+        settings.logger.critical(
+            "DISTRIBUTED_COLLECTION needs a storage that enforces conditional writes, not collecting"
+        )
+        return False
+
+    claims = Claims(storage=storage) if settings.DISTRIBUTED_COLLECTION else None
+    try:
+        if storage.list_objects(prefix=definitions.COLLECTION_METADATA_KEY):
+            settings.logger.info("the initial dataset was initiated")
+
+            collection_metadata = json.loads(
+                storage.load_object(definitions.COLLECTION_METADATA_KEY)
+                .read()
+                .decode("utf-8")
+            )
+            # pylint: disable=no-else-return
+            if (
+                collection_metadata.get("status")
+                == definitions.STATUS_COLLECTION_METADATA_COMPLETE
+            ):
+                settings.logger.info(LOG_MESSAGE_INIT_DATASET_COMPLETE)
+                return True
+            elif (
+                collection_metadata.get("status")
+                == definitions.STATUS_COLLECTION_METADATA_INCOMPLETE
+            ):
+                settings.logger.info(LOG_MESSAGE_INIT_DATASET_PATCHING)
+                collection_metadata = patch_dataset(collection_metadata, claims, fence)
+
+        else:
+            settings.logger.info(LOG_MESSAGE_INIT_DATASET)
+            collection_metadata = collect_dataset(claims, fence)
+    finally:
+        if claims is not None:
+            claims.close()
+
+    if claims is not None:
+        # other processes saved the months they collected
+        collection_metadata = (
+            helpers.save_merged_metadata(collection_metadata, storage)
+            or collection_metadata
+        )
+    elif fence is not None and not fence():
+        settings.logger.critical("lost the lease, not saving the collection metadata")
+        return False
+    else:
+        storage.save_object(
+            json.dumps(collection_metadata).encode("utf-8"),
+            definitions.COLLECTION_METADATA_KEY,
+        )
+
     if (
         collection_metadata.get("status")
         == definitions.STATUS_COLLECTION_METADATA_COMPLETE
@@ -0,0 +1,281 @@
+import datetime
+import io
+import math
+from typing import Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from earthquake_data_layer import Storage, compaction, definitions, helpers, settings
+from earthquake_data_layer.catalog import update_dataset_summary
+from earthquake_data_layer.concurrency import partition_locks
+from earthquake_data_layer.schema import RAW_DATA_SCHEMA, conform_table
+
+LOG_MESSAGE_COMPACTION_START = "compacting {} period(s)"
+LOG_MESSAGE_PERIOD_SKIPPED = "{}-{}: nothing to compact"
+LOG_MESSAGE_PERIOD_DONE = "{}-{}: compacted {} month(s) into {} file(s)"
+
+
+class PeriodWriter:
+    """
+    Writes the months of a compaction period, in order, to parquet files of about
+    settings.COMPACTION_TARGET_FILE_SIZE bytes. Every month gets its own row groups, so a month can be read
+    alone and the row groups statistics keep their time and bbox pruning.
+    """
+
+    def __init__(self, first_year: int, last_year: int, storage: Storage):
+        self.storage = storage
+        self.prefix = (
+            f"{definitions.COMPACTED_DATA_PREFIX}/{first_year}_{last_year}/"
+            f"part-{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}"
+            f"-{helpers.random_string(settings.RANDOM_STRING_LENGTH_KEY)}"
+        )
+        self.files = dict()
+        self.entries = dict()
+        self.sink = None
+        self.writer = None
+        self.key = None
+        self.num_row_groups = 0
+
+    def _open(self):
+        self.key = f"{self.prefix}-{len(self.files)}.parquet"
+        self.sink = pa.BufferOutputStream()
+        self.writer = pq.ParquetWriter(self.sink, RAW_DATA_SCHEMA)
+        self.num_row_groups = 0
+
+    def _close(self) -> bool:
+        self.writer.close()
+        self.files[self.key] = pq.read_metadata(pa.BufferReader(self.sink.getvalue()))
+        saved = self.storage.save_object(bytes(self.sink.getvalue()), self.key)
+        self.writer = None
+        return saved
+
+    def write_month(self, year: int, month: int, table: pa.Table) -> bool:
+        """appends a month to the current file, returns False if a full file failed to upload"""
+        if self.writer is None:
+            self._open()
+
+        num_row_groups = math.ceil(table.num_rows / settings.RAW_DATA_ROW_GROUP_SIZE)
+        if num_row_groups:
+            self.writer.write_table(
+                table, row_group_size=settings.RAW_DATA_ROW_GROUP_SIZE
+            )
+        self.entries[compaction.month_label(year, month)] = {
+            "key": self.key,
+            "row_groups": list(
+                range(self.num_row_groups, self.num_row_groups + num_row_groups)
+            ),
+        }
+        self.num_row_groups += num_row_groups
+
+        if self.sink.tell() >= settings.COMPACTION_TARGET_FILE_SIZE:
+            return self._close()
+        return True
+
+    def close(self) -> bool:
+        """uploads the last file, returns False if it failed"""
+        if self.writer is None:
+            return True
+        return self._close()
+
+
+def load_month(
+    year: int,
+    month: int,
+    monthly_keys: dict[tuple[int, int], str],
+    index: dict,
+    compacted_files: dict[str, pq.ParquetFile],
+    storage: Storage,
+) -> tuple[Optional[pa.Table], Optional[str]]:
+    """
+    Loads the rows of a month, from its monthly file if there is one (it is newer than the compacted rows),
+    otherwise from the compacted file of a previous compaction.
+
+    Returns:
+    tuple[Optional[pa.Table], Optional[str]]: the rows, None if the month has no data, and the ETag of the monthly
+    file they were read from (None if they were read from a compacted file).
+    """
+    if (year, month) in monthly_keys:
+        content, etag = storage.load_object_with_etag(monthly_keys[(year, month)])
+        if content is None:
+            return None, None
+        df = pd.read_parquet(io.BytesIO(content))
+        sort_columns = [
+            column for column in definitions.RAW_DATA_SORT_COLUMNS if column in df
+        ]
+        if sort_columns:
+            df = df.sort_values(sort_columns, kind="stable", ignore_index=True)
+        return conform_table(df), etag
+
+    entry = index["months"].get(compaction.month_label(year, month))
+    if entry is None:
+        return None, None
+    if not entry["row_groups"]:
+        return RAW_DATA_SCHEMA.empty_table(), None
+
+    if entry["key"] not in compacted_files:
+        compacted_files[entry["key"]] = pq.ParquetFile(
+            storage.load_object(entry["key"])
+        )
+    return compacted_files[entry["key"]].read_row_groups(entry["row_groups"]), None
+
+
+def compact_period(
+    first_year: int,
+    last_year: int,
+    monthly_keys: dict[tuple[int, int], str],
+    storage: Storage,
+) -> Optional[dict]:
+    """
+    Compacts the months of a period into new files and commits them to the compaction index.
+    A month is committed only if it is unchanged since it was read: its monthly file has the same ETag and its
+    index entry is the same, otherwise it was rewritten or released meanwhile and is left as it is, for the next
+    compaction. The monthly and compacted files whose rows were committed to the new files are removed after the
+    index points to the new files, a monthly file only if it is still unchanged (see
+    Storage.remove_object_conditional).
+
+    Returns:
+    Optional[dict]: {"months": num months compacted, "files": [new keys]}, None if the period was skipped or failed.
+    """
+    months = [
+        (year, month)
+        for year in range(first_year, last_year + 1)
+        for month in range(1, 13)
+    ]
+    if not any(month in monthly_keys for month in months):
+        settings.logger.info(LOG_MESSAGE_PERIOD_SKIPPED.format(first_year, last_year))
+        return None
+
+    index = compaction.load_compaction_index(storage)
+    previous_keys = {
+        index["months"][compaction.month_label(year, month)]["key"]
+        for year, month in months
+        if compaction.month_label(year, month) in index["months"]
+    }
+
+    writer = PeriodWriter(first_year, last_year, storage)
+    compacted_files = dict()
+    # {"YYYY-MM": (its index entry, the ETag of its monthly file)} when it was read
+    read_versions = dict()
+    for year, month in months:
+        table, etag = load_month(
+            year, month, monthly_keys, index, compacted_files, storage
+        )
+        if table is None:
+            continue
+        label = compaction.month_label(year, month)
+        read_versions[label] = (index["months"].get(label), etag)
+        if not writer.write_month(year, month, table):
+            settings.logger.error(f"{first_year}-{last_year}: failed to upload a file")
+            return None
+    if not writer.close():
+        settings.logger.error(f"{first_year}-{last_year}: failed to upload a file")
+        return None
+
+    def unchanged_monthly_file(year: int, month: int) -> bool:
+        etag = read_versions[compaction.month_label(year, month)][1]
+        return storage.object_etag(monthly_keys[(year, month)]) == etag
+
+    # the months whose monthly files were rewritten after they were read keep them
+    rewritten = {
+        compaction.month_label(year, month)
+        for year, month in months
+        if (year, month) in monthly_keys
+        and compaction.month_label(year, month) in read_versions
+        and not unchanged_monthly_file(year, month)
+    }
+    committed = dict()
+
+    def commit(current_index: dict) -> bool:
+        committed.clear()
+        for label, entry in writer.entries.items():
+            # released or compacted again since it was read
+            if (
+                label in rewritten
+                or current_index["months"].get(label) != read_versions[label][0]
+            ):
+                continue
+            committed[label] = entry
+        current_index["months"].update(committed)
+        return bool(committed)
+
+    index = compaction.update_compaction_index(commit, storage)
+    if index is None:
+        settings.logger.error(f"{first_year}-{last_year}: failed to commit")
+        return None
+    skipped = set(writer.entries) - set(committed)
+    if skipped:
+        settings.logger.warning(
+            f"{first_year}-{last_year}: {sorted(skipped)} changed while compacted, left for the next compaction"
+        )
+
+    # the new files without a committed month are unreferenced
+    new_files = {
+        key: file_metadata
+        for key, file_metadata in writer.files.items()
+        if any(entry["key"] == key for entry in committed.values())
+    }
+    referenced_keys = {entry["key"] for entry in index["months"].values()}
+    replaced_keys = list()
+    for year, month in months:
+        label = compaction.month_label(year, month)
+        if label not in committed or (year, month) not in monthly_keys:
+            continue
+        # a month may be rewritten until its file is removed, then it keeps its monthly file and is read from it
+        # until the next compaction
+        key = monthly_keys[(year, month)]
+        with partition_locks(key):
+            if storage.remove_object_conditional(key, read_versions[label][1]):
+                replaced_keys.append(key)
+    stale_keys = sorted(previous_keys - referenced_keys)
+    if settings.RAW_DATA_LAYOUT == definitions.RAW_DATA_LAYOUT_HIVE:
+        update_dataset_summary(
+            new_files, storage, removed_keys=replaced_keys + stale_keys
+        )
+    for key in stale_keys + sorted(set(writer.files) - set(new_files)):
+        storage.remove_object(key)
+
+    settings.logger.info(
+        LOG_MESSAGE_PERIOD_DONE.format(
+            first_year, last_year, len(committed), len(new_files)
+        )
+    )
+    if not committed:
+        return None
+    return {"months": len(committed), "files": list(new_files)}
+
+
+def compact_dataset(storage: Optional[Storage] = None) -> dict:
+    """
+    Compacts the closed history (the months before settings.COMPACTION_CUTOFF_YEAR) into files of
+    settings.COMPACTION_PERIOD_YEARS years each. Periods without new monthly files are skipped, so the job can
+    run after every collection or patch.
+
+    Returns:
+    dict: {"{first_year}-{last_year}": the result of compact_period} for every compacted period.
+    """
+    if storage is None:
+        storage = Storage()
+
+    monthly_keys = dict()
+    for key in storage.list_objects(prefix=f"{definitions.RAW_DATA_PREFIX}/"):
+        month = helpers.parse_raw_data_key(key)
+        if month and compaction.is_compactable(month[0]):
+            monthly_keys[month] = key
+
+    first_year = int(settings.EARLIEST_EARTHQUAKE_DATE[:4])
+    periods = compaction.compaction_periods(first_year)
+    settings.logger.info(LOG_MESSAGE_COMPACTION_START.format(len(periods)))
+
+    results = dict()
+    for first_year, last_year in periods:
+        result = compact_period(first_year, last_year, monthly_keys, storage)
+        if result:
+            results[f"{first_year}-{last_year}"] = result
+
+    return results
+
+
+if __name__ == "__main__":
+    compact_dataset()
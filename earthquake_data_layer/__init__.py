@@ -1,4 +1,16 @@
 # pylint: disable=missing-module-docstring
+import importlib
+
 from earthquake_data_layer.exceptions import *
-from earthquake_data_layer.fetcher import Fetcher
-from earthquake_data_layer.storage import Storage
+
+# Fetcher and Storage pull in pandas, pyarrow and boto3, they are imported on first use
+LAZY_ATTRIBUTES = {
+    "Fetcher": "earthquake_data_layer.fetcher",
+    "Storage": "earthquake_data_layer.storage",
+}
+
+
+def __getattr__(name):
+    if name in LAZY_ATTRIBUTES:
+        return getattr(importlib.import_module(LAZY_ATTRIBUTES[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,429 @@
+import datetime
+import threading
+from collections.abc import Iterable
+from typing import Optional, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from earthquake_data_layer import definitions, settings
+from earthquake_data_layer.helpers import (
+    get_month_start_end_dates,
+    month_label,
+    sort_df,
+    upload_df,
+)
+from earthquake_data_layer.reader import (
+    read_events,
+    scan_events,
+    time_range_of,
+    to_epoch_ms,
+)
+from earthquake_data_layer.spatial import BBox
+from earthquake_data_layer.storage import Storage
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+# a row per (week, cell, month): the partial aggregates of the events of a month that fall in a week and cell.
+# a week that spans two months has a row from each, so a rewritten month only replaces its own rows.
+WEEKLY_AGGREGATES_SCHEMA = pa.schema(
+    [
+        ("week_start", pa.int64()),
+        ("cell", pa.int64()),
+        ("month", pa.string()),
+        ("count", pa.int64()),
+        ("mag_max", pa.float64()),
+        ("mag_sum", pa.float64()),
+        ("mag_count", pa.int64()),
+        ("energy_sum", pa.float64()),
+        ("depth_min", pa.float64()),
+        ("depth_max", pa.float64()),
+        ("depth_sum", pa.float64()),
+        ("depth_count", pa.int64()),
+    ]
+)
+
+# the columns of the combined weekly aggregates
+WEEKLY_AGGREGATES_COLUMNS = [
+    "week_start",
+    "cell",
+    "count",
+    "mag_max",
+    "mag_mean",
+    "energy_sum",
+    "depth_min",
+    "depth_max",
+    "depth_mean",
+]
+
+# the columns aggregate_tables reads
+AGGREGATE_INPUT_COLUMNS = ["time", "cell", "mag"]
+EMPTY_AGGREGATE_INPUT = pa.schema(
+    [("time", pa.int64()), ("cell", pa.int64()), ("mag", pa.float64())]
+).empty_table()
+
+# the partial aggregates of every group, combined across row groups by sum and max
+AGGREGATE_PARTIALS = [
+    ("time", "count", "count"),
+    ("mag", "max", "mag_max"),
+    ("mag", "sum", "mag_sum"),
+    ("mag", "count", "mag_count"),
+]
+
+# the aggregates file is read-modified-written, serialize the updates made by this process
+aggregates_lock = threading.Lock()
+
+
+def week_start(time: pd.Series) -> pd.Series:
+    """returns the start (monday 00:00 UTC) of the week of each epoch milliseconds time, in epoch milliseconds"""
+    days = time // DAY_MS
+    # 1970-01-01 was a thursday
+    return (days - (days + 3) % 7) * DAY_MS
+
+
+def radiated_energy(mag: pd.Series) -> pd.Series:
+    """the energy (joules) radiated by earthquakes of the given magnitudes, log10(E) = 1.5M + 4.8"""
+    return np.power(10.0, 1.5 * mag + 4.8)
+
+
+def month_partials(
+    rows: Union[list[dict], pd.DataFrame, pa.Table], label: str
+) -> pd.DataFrame:
+    """
+    Aggregates the events of a month by week and spatial cell.
+
+    Parameters:
+    - rows (Union[list[dict], pd.DataFrame, pa.Table]): the events of the month.
+    - label (str): the month, "YYYY-MM".
+
+    Returns:
+    pd.DataFrame: the month's rows of the weekly aggregates, in WEEKLY_AGGREGATES_SCHEMA columns.
+    """
+    if isinstance(rows, pa.Table):
+        df = rows.to_pandas()
+    elif isinstance(rows, pd.DataFrame):
+        df = rows
+    else:
+        df = pd.DataFrame.from_records(rows)
+    for column in ("time", "mag", "depth", "cell"):
+        if column not in df.columns:
+            df[column] = np.nan
+    if "id" in df.columns:
+        df = df.drop_duplicates(subset="id", keep="last")
+
+    df = df.dropna(subset=["time"])
+    df = df.assign(
+        week_start=week_start(df["time"].astype("int64")),
+        mag=df["mag"].astype("float64"),
+        depth=df["depth"].astype("float64"),
+        energy=radiated_energy(df["mag"].astype("float64")),
+    )
+
+    partials = (
+        df.groupby(["week_start", "cell"], dropna=False)
+        .agg(
+            count=("time", "size"),
+            mag_max=("mag", "max"),
+            mag_sum=("mag", "sum"),
+            mag_count=("mag", "count"),
+            energy_sum=("energy", "sum"),
+            depth_min=("depth", "min"),
+            depth_max=("depth", "max"),
+            depth_sum=("depth", "sum"),
+            depth_count=("depth", "count"),
+        )
+        .reset_index()
+    )
+    partials["month"] = label
+
+    return partials[WEEKLY_AGGREGATES_SCHEMA.names]
+
+
+def load_partials(storage: Optional[Storage] = None) -> Optional[pd.DataFrame]:
+    """loads the stored partial aggregates, None if there are none"""
+    if storage is None:
+        storage = Storage()
+
+    try:
+        return pd.read_parquet(storage.load_object(definitions.WEEKLY_AGGREGATES_KEY))
+    except FileNotFoundError:
+        return None
+
+
+def update_weekly_aggregates(
+    partials: dict[str, pd.DataFrame], storage: Optional[Storage] = None
+) -> bool:
+    """
+    Replaces the rows of the given months in the weekly aggregates, the other months are not recomputed.
+
+    Parameters:
+    - partials (dict[str, pd.DataFrame]): {"YYYY-MM": the result of month_partials} of the rewritten months.
+    - storage (Storage): a Storage object, optional.
+
+    Returns:
+    bool: True if the aggregates were saved, False otherwise.
+    """
+    if not partials:
+        return True
+    if storage is None:
+        storage = Storage()
+
+    with aggregates_lock:
+        current = load_partials(storage)
+        frames = [partial for partial in partials.values() if not partial.empty]
+        if current is not None:
+            frames.insert(0, current[~current["month"].isin(list(partials))])
+
+        df = (
+            pd.concat(frames, ignore_index=True)
+            if frames
+            else WEEKLY_AGGREGATES_SCHEMA.empty_table().to_pandas()
+        )
+        saved = upload_df(
+            sort_df(df, ["week_start", "cell", "month"]),
+            definitions.WEEKLY_AGGREGATES_KEY,
+            storage,
+            schema=WEEKLY_AGGREGATES_SCHEMA,
+        )
+
+    if saved:
+        settings.logger.info(
+            f"updated the weekly aggregates of {len(partials)} month(s)"
+        )
+    else:
+        settings.logger.error("couldn't save the weekly aggregates")
+    return saved
+
+
+def combine_partials(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Combines the partial aggregates of each (week_start, cell), e.g. the two months of a week that spans them.
+
+    Returns:
+    pd.DataFrame: one row per (week_start, cell), with WEEKLY_AGGREGATES_COLUMNS.
+    """
+    weekly = (
+        df.groupby(["week_start", "cell"], dropna=False)
+        .agg(
+            count=("count", "sum"),
+            mag_max=("mag_max", "max"),
+            mag_sum=("mag_sum", "sum"),
+            mag_count=("mag_count", "sum"),
+            energy_sum=("energy_sum", "sum"),
+            depth_min=("depth_min", "min"),
+            depth_max=("depth_max", "max"),
+            depth_sum=("depth_sum", "sum"),
+            depth_count=("depth_count", "sum"),
+        )
+        .reset_index()
+    )
+    weekly["mag_mean"] = weekly["mag_sum"] / weekly["mag_count"].replace(0, np.nan)
+    weekly["depth_mean"] = weekly["depth_sum"] / weekly["depth_count"].replace(
+        0, np.nan
+    )
+
+    return weekly[WEEKLY_AGGREGATES_COLUMNS]
+
+
+def load_weekly_aggregates(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    cells: Optional[list[int]] = None,
+    storage: Optional[Storage] = None,
+) -> pd.DataFrame:
+    """
+    Loads the weekly aggregates, one row per (week_start, cell) with the columns count, mag_max, mag_mean,
+    energy_sum, depth_min, depth_max and depth_mean (see combine_partials).
+
+    Parameters:
+    - start_date (str): only weeks that end after this {definitions.DATE_FORMAT} date, optional.
+    - end_date (str): only weeks that start before or on this date, optional.
+    - cells (list[int]): only these spatial cells, optional.
+    - storage (Storage): a Storage object, optional.
+
+    Returns:
+    pd.DataFrame: the aggregates, sorted by week_start and cell.
+    """
+    df = load_partials(storage)
+    if df is None:
+        df = WEEKLY_AGGREGATES_SCHEMA.empty_table().to_pandas()
+
+    if start_date:
+        df = df[df["week_start"] + 7 * DAY_MS > to_epoch_ms(start_date)]
+    if end_date:
+        df = df[df["week_start"] <= to_epoch_ms(end_date)]
+    if cells is not None:
+        df = df[df["cell"].isin(cells)]
+
+    return combine_partials(df)
+
+
+def rebuild_weekly_aggregates(
+    months: list[tuple[int, int]], storage: Optional[Storage] = None
+) -> bool:
+    """recomputes the weekly aggregates of the given months from the stored events, e.g. to backfill a dataset"""
+    if storage is None:
+        storage = Storage()
+
+    partials = dict()
+    for year, month in months:
+        start_date, end_date = get_month_start_end_dates(year, month)
+        label = month_label(year, month)
+        partials[label] = month_partials(
+            read_events(start_date, end_date, storage=storage), label
+        )
+
+    return update_weekly_aggregates(partials, storage)
+
+
+def group_keys(
+    table: pa.Table,
+    bucket: str,
+    cell_bits: Optional[int] = None,
+    mag_bin: Optional[float] = None,
+) -> pa.Table:
+    """
+    Computes the group by keys of the events, vectorized:
+    - time_bucket: the start of the day, week (monday) or month of the event, in epoch milliseconds.
+    - cell (when cell_bits is set): the spatial cell coarsened to cell_bits bits per axis.
+    - mag_bin (when mag_bin is set): the magnitude rounded down to a multiple of mag_bin.
+
+    Returns:
+    pa.Table: the keys, followed by the time and mag columns.
+    """
+    columns = {
+        "time_bucket": pc.floor_temporal(
+            table.column("time").cast(pa.timestamp("ms")),
+            unit=bucket,
+            week_starts_monday=True,
+        ).cast(pa.int64())
+    }
+    if cell_bits is not None:
+        columns["cell"] = pc.shift_right(
+            table.column("cell"), 2 * (settings.SPATIAL_CELL_BITS - cell_bits)
+        )
+    if mag_bin is not None:
+        # the epsilon keeps magnitudes that are multiples of the bin in their own bin despite float division
+        columns["mag_bin"] = pc.multiply(
+            pc.floor(pc.add(pc.divide(table.column("mag"), mag_bin), 1e-9)), mag_bin
+        )
+    columns["time"] = table.column("time")
+    columns["mag"] = table.column("mag")
+
+    return pa.table(columns)
+
+
+def aggregate_tables(
+    tables: Iterable[pa.Table],
+    bucket: str = "day",
+    cell_bits: Optional[int] = None,
+    mag_bin: Optional[float] = None,
+) -> pa.Table:
+    """
+    Counts the events by time bucket, and optionally spatial cell and magnitude bin, with pyarrow compute.
+    Every table (e.g. a row group) is reduced to its groups as it arrives, then the partial groups are combined,
+    so only the groups are held in memory.
+
+    Parameters:
+    - tables (Iterable[pa.Table]): the events, with at least the time, cell and mag columns.
+    - bucket (str): one of definitions.AGGREGATE_TIME_BUCKETS, default to "day".
+    - cell_bits (int): group by the spatial cell at this precision (bits per axis), optional.
+    - mag_bin (float): group by magnitude bins of this width, optional.
+
+    Returns:
+    pa.Table: a row per group, sorted by the keys: the keys, count, mag_max and mag_mean.
+    """
+    keys = ["time_bucket"]
+    if cell_bits is not None:
+        keys.append("cell")
+    if mag_bin is not None:
+        keys.append("mag_bin")
+
+    def reduce(table: pa.Table) -> pa.Table:
+        table = table.filter(pc.is_valid(table.column("time")))
+        grouped = (
+            group_keys(table, bucket, cell_bits, mag_bin)
+            .group_by(keys)
+            .aggregate(
+                [(column, function) for column, function, _ in AGGREGATE_PARTIALS]
+            )
+        )
+        return grouped.rename_columns(
+            keys + [name for _, _, name in AGGREGATE_PARTIALS]
+        )
+
+    partials = [reduce(table) for table in tables if table.num_rows]
+    if not partials:
+        partials.append(reduce(EMPTY_AGGREGATE_INPUT))
+
+    combined = (
+        pa.concat_tables(partials)
+        .group_by(keys)
+        .aggregate(
+            [
+                ("count", "sum"),
+                ("mag_max", "max"),
+                ("mag_sum", "sum"),
+                ("mag_count", "sum"),
+            ]
+        )
+        .rename_columns(keys + ["count", "mag_max", "mag_sum", "mag_count"])
+    )
+    mag_mean = pc.divide(
+        combined.column("mag_sum"),
+        pc.if_else(
+            pc.equal(combined.column("mag_count"), 0),
+            None,
+            combined.column("mag_count").cast(pa.float64()),
+        ),
+    )
+
+    return (
+        combined.select(keys + ["count", "mag_max"])
+        .append_column("mag_mean", mag_mean)
+        .sort_by([(key, "ascending") for key in keys])
+    )
+
+
+def aggregate_events(
+    start_date: Union[datetime.date, str],
+    end_date: Union[datetime.date, str],
+    bucket: str = "day",
+    cell_bits: Optional[int] = None,
+    mag_bin: Optional[float] = None,
+    bbox: Optional[BBox] = None,
+    mag_range: Optional[tuple[float, float]] = None,
+    storage: Optional[Storage] = None,
+) -> pa.Table:
+    """
+    Aggregates the stored events between two dates (both included) with aggregate_tables. Recent time frames are
+    aggregated from the hot store when reading the default bucket, otherwise only the time, cell and mag columns of
+    the row groups that may match the time frame, bbox and magnitude range are read.
+    """
+    # pylint: disable=import-outside-toplevel
+    from earthquake_data_layer.hot_store import hot_store
+
+    tables = None
+    if storage is None:
+        tables = hot_store.query(
+            time_range_of(start_date, end_date),
+            bbox,
+            mag_range,
+            AGGREGATE_INPUT_COLUMNS,
+        )
+    tables = (
+        [tables]
+        if tables is not None
+        else scan_events(
+            start_date,
+            end_date,
+            bbox=bbox,
+            columns=AGGREGATE_INPUT_COLUMNS,
+            storage=storage,
+            mag_range=mag_range,
+        )
+    )
+
+    return aggregate_tables(tables, bucket, cell_bits, mag_bin)
@@ -0,0 +1,85 @@
+import json
+import re
+from typing import Optional, Union
+
+import pyarrow as pa
+
+from earthquake_data_layer import definitions, settings
+from earthquake_data_layer.storage import Storage
+
+# the responses are stored as zstd compressed json lines, a response per line
+ARCHIVE_CODEC = "zstd"
+# newlines are only whitespace between the tokens of a json body (in strings they are escaped)
+JSON_LINE_BREAKS = bytes.maketrans(b"\r\n", b"  ")
+
+ARCHIVE_KEY_PATTERN = re.compile(
+    rf"^{re.escape(definitions.RAW_RESPONSES_PREFIX)}/\d{{4}}/(\d{{4}})_(\d{{2}})_responses\.ndjson\.zst$"
+)
+
+
+def archive_key(year: Union[str, int], month: Union[str, int]) -> str:
+    """the key of the archived responses of a month"""
+    month = str(month).zfill(2)
+    return (
+        f"{definitions.RAW_RESPONSES_PREFIX}/{year}/{year}_{month}_responses.ndjson.zst"
+    )
+
+
+def write_archive(
+    responses: list[Union[bytes, dict]],
+    year: Union[str, int],
+    month: Union[str, int],
+    storage: Optional[Storage] = None,
+) -> Optional[str]:
+    """
+    Archives the API responses of a month, replacing the previous archive. Responses that weren't decoded are
+    written as they are, on a single line.
+
+    Returns:
+    Optional[str]: the key of the archive, None if the upload failed.
+    """
+    if storage is None:
+        storage = Storage()
+
+    sink = pa.BufferOutputStream()
+    with pa.CompressedOutputStream(sink, ARCHIVE_CODEC) as stream:
+        for response in responses:
+            line = (
+                response.translate(JSON_LINE_BREAKS)
+                if isinstance(response, bytes)
+                else json.dumps(response).encode("utf-8")
+            )
+            stream.write(line + b"\n")
+
+    key = archive_key(year, month)
+    if not storage.save_object(bytes(sink.getvalue()), key):
+        return None
+    return key
+
+
+def read_archive(
+    year: Union[str, int], month: Union[str, int], storage: Optional[Storage] = None
+) -> list[dict]:
+    """loads the archived API responses of a month, raises FileNotFoundError if it wasn't archived"""
+    if storage is None:
+        storage = Storage()
+
+    data = storage.load_object(archive_key(year, month)).read()
+    stream = pa.CompressedInputStream(pa.BufferReader(data), ARCHIVE_CODEC)
+    # split on newlines only, the raw bodies may hold other unicode line separators in their strings
+    return [json.loads(line) for line in stream.read().split(b"\n") if line.strip()]
+
+
+def archived_months(storage: Optional[Storage] = None) -> list[tuple[int, int]]:
+    """lists the (year, month) of every archived month, sorted"""
+    if storage is None:
+        storage = Storage()
+
+    months = set()
+    for key in storage.list_objects(prefix=f"{definitions.RAW_RESPONSES_PREFIX}/"):
+        match = ARCHIVE_KEY_PATTERN.match(key)
+        if match:
+            months.add((int(match.group(1)), int(match.group(2))))
+
+    settings.logger.debug(f"found {len(months)} archived month(s)")
+    return sorted(months)
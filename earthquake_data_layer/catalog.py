@@ -0,0 +1,208 @@
+import re
+import threading
+from collections import defaultdict
+from typing import Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from earthquake_data_layer import definitions, settings
+from earthquake_data_layer.helpers import upload_df
+from earthquake_data_layer.spatial import BBox, bbox_intersects
+from earthquake_data_layer.storage import Storage
+
+HIVE_PARTITION_PATTERN = re.compile(r"year=(\d{4})/month=(\d{2})/")
+
+# the summary is read-modified-written, serialize the updates made by this process
+summary_lock = threading.Lock()
+
+
+def relative_path(key: str) -> str:
+    """returns the path of a raw data key relative to the dataset root, as stored in _metadata"""
+    return key[len(definitions.RAW_DATA_PREFIX) + 1 :]
+
+
+def partition_of(path: str) -> Optional[tuple[int, int]]:
+    """returns the (year, month) partition of a hive layout path, None if the path is not partitioned"""
+    match = HIVE_PARTITION_PATTERN.search(path)
+    if not match:
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+
+def serialize_file_metadata(file_metadata: pq.FileMetaData) -> bytes:
+    """serializes a parquet footer to bytes"""
+    writer = pa.BufferOutputStream()
+    file_metadata.write_metadata_file(writer)
+    return bytes(writer.getvalue())
+
+
+def deserialize_file_metadata(footer: bytes) -> pq.FileMetaData:
+    """deserializes a parquet footer serialized by serialize_file_metadata"""
+    return pq.read_metadata(pa.BufferReader(footer))
+
+
+def load_footers(storage: Storage) -> dict[str, bytes]:
+    """loads the footers of the files in the dataset, {relative path: serialized footer}"""
+    try:
+        df = pd.read_parquet(storage.load_object(definitions.DATASET_FOOTERS_KEY))
+    except FileNotFoundError:
+        return dict()
+    return dict(zip(df["path"], df["footer"]))
+
+
+def update_dataset_summary(
+    files: dict[str, pq.FileMetaData],
+    storage: Optional[Storage] = None,
+    removed_keys: Optional[list[str]] = None,
+) -> bool:
+    """
+    Registers newly written data files in the dataset level summary files:
+    - _metadata: the footers of all the data files (schema and row groups statistics, with file paths)
+    - _common_metadata: the schema of the dataset
+    The footers of every data file are kept at definitions.DATASET_FOOTERS_KEY, so a rewritten file replaces
+    its previous row groups without reading the other data files.
+
+    Parameters:
+    - files (dict[str, pq.FileMetaData]): {key: the footer of the file written at key}.
+    - storage (Storage): a Storage object, optional.
+    - removed_keys (list[str]): keys of data files that were removed from the dataset, optional.
+
+    Returns:
+    bool: True if the summary files were saved, False otherwise.
+    """
+    if not files and not removed_keys:
+        return True
+
+    if storage is None:
+        storage = Storage()
+
+    with summary_lock:
+        footers = load_footers(storage)
+        for key in removed_keys or []:
+            footers.pop(relative_path(key), None)
+        for key, file_metadata in files.items():
+            path = relative_path(key)
+            file_metadata.set_file_path(path)
+            footers[path] = serialize_file_metadata(file_metadata)
+
+        summary = None
+        for path in sorted(footers):
+            file_metadata = deserialize_file_metadata(footers[path])
+            if summary is None:
+                summary = file_metadata
+                continue
+            try:
+                summary.append_row_groups(file_metadata)
+            except RuntimeError as error:
+                settings.logger.error(
+                    f"{path} does not match the dataset schema: {error}"
+                )
+
+        footers_df = pd.DataFrame(
+            {"path": list(footers.keys()), "footer": list(footers.values())}
+        )
+        if summary is None:
+            settings.logger.info("the dataset is empty, removing the summary")
+            storage.remove_object(definitions.DATASET_METADATA_KEY)
+            storage.remove_object(definitions.DATASET_COMMON_METADATA_KEY)
+            return upload_df(footers_df, definitions.DATASET_FOOTERS_KEY, storage)
+
+        metadata_writer = pa.BufferOutputStream()
+        summary.write_metadata_file(metadata_writer)
+        common_metadata_writer = pa.BufferOutputStream()
+        pq.write_metadata(summary.schema.to_arrow_schema(), common_metadata_writer)
+
+        saved = upload_df(footers_df, definitions.DATASET_FOOTERS_KEY, storage)
+        saved &= storage.save_object(
+            bytes(common_metadata_writer.getvalue()),
+            definitions.DATASET_COMMON_METADATA_KEY,
+        )
+        saved &= storage.save_object(
+            bytes(metadata_writer.getvalue()), definitions.DATASET_METADATA_KEY
+        )
+
+    settings.logger.info(f"updated the dataset summary with {len(files)} file(s)")
+    return saved
+
+
+def load_dataset_summary(
+    storage: Optional[Storage] = None,
+) -> Optional[pq.FileMetaData]:
+    """loads the _metadata summary of the dataset, None if it doesn't exist"""
+    if storage is None:
+        storage = Storage()
+
+    try:
+        return pq.read_metadata(storage.load_object(definitions.DATASET_METADATA_KEY))
+    except FileNotFoundError:
+        return None
+
+
+def summary_row_groups(summary: pq.FileMetaData) -> dict[str, list[int]]:
+    """
+    Groups the row groups of a summary by their data file.
+
+    Returns:
+    dict[str, list[int]]: {relative path: [(index in the summary), ...]}, in file order.
+    """
+    row_groups = defaultdict(list)
+    for index in range(summary.num_row_groups):
+        row_groups[summary.row_group(index).column(0).file_path].append(index)
+    return dict(row_groups)
+
+
+def column_ranges(row_group: pq.RowGroupMetaData, columns: list[str]) -> dict:
+    """returns {column: (min, max)} for the columns in the row group that have statistics"""
+    ranges = dict()
+    for index in range(row_group.num_columns):
+        column = row_group.column(index)
+        if column.path_in_schema not in columns:
+            continue
+        statistics = column.statistics
+        if statistics is not None and statistics.has_min_max:
+            ranges[column.path_in_schema] = (statistics.min, statistics.max)
+    return ranges
+
+
+def ranges_match(
+    ranges: dict,
+    time_range: Optional[tuple[int, int]] = None,
+    bbox: Optional[BBox] = None,
+    mag_range: Optional[tuple[float, float]] = None,
+) -> bool:
+    """
+    Check if a file or row group with the given {column: (min, max)} ranges might contain rows in the time range,
+    bbox and magnitude range. Columns without a range are not used to skip.
+
+    Parameters:
+    - ranges (dict): {column: (min, max)}, as returned by column_ranges.
+    - time_range (tuple[int, int]): [start, end) in epoch milliseconds, optional.
+    - bbox (BBox): (min_longitude, min_latitude, max_longitude, max_latitude), optional.
+    - mag_range (tuple[float, float]): [min, max] magnitude, optional.
+
+    Returns:
+    bool: False if the data can be skipped, True otherwise.
+    """
+    if time_range and "time" in ranges:
+        min_time, max_time = ranges["time"]
+        if max_time < time_range[0] or min_time >= time_range[1]:
+            return False
+
+    if bbox and "longitude" in ranges and "latitude" in ranges:
+        (min_longitude, max_longitude), (min_latitude, max_latitude) = (
+            ranges["longitude"],
+            ranges["latitude"],
+        )
+        if not bbox_intersects(
+            bbox, min_longitude, min_latitude, max_longitude, max_latitude
+        ):
+            return False
+
+    if mag_range and "mag" in ranges:
+        min_mag, max_mag = ranges["mag"]
+        if max_mag < mag_range[0] or min_mag > mag_range[1]:
+            return False
+
+    return True
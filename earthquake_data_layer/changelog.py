@@ -0,0 +1,159 @@
+import re
+from typing import Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from earthquake_data_layer import definitions, settings
+from earthquake_data_layer.schema import RAW_DATA_SCHEMA, conform_table
+from earthquake_data_layer.storage import Storage
+
+# a row per changed event: the event's row after the change (only the id for deleted events)
+CHANGELOG_SCHEMA = pa.schema(
+    [
+        ("sequence", pa.int64()),
+        ("run_id", pa.string()),
+        ("month", pa.string()),
+        ("change", pa.string()),
+        *RAW_DATA_SCHEMA,
+    ]
+)
+
+CHANGE_SET_KEY_PATTERN = re.compile(
+    rf"^{re.escape(definitions.CHANGELOG_PREFIX)}/(\d+)\.parquet$"
+)
+
+
+def change_set_key(sequence: int) -> str:
+    """the key of the change set with the given sequence number"""
+    return f"{definitions.CHANGELOG_PREFIX}/{sequence:012d}.parquet"
+
+
+def latest_rows(df: Optional[pd.DataFrame]) -> pd.DataFrame:
+    """the last version (by the updated column when there is one) of every event, indexed by id"""
+    if df is None or "id" not in df.columns:
+        return pd.DataFrame(columns=["id"]).set_index("id", drop=False)
+
+    df = df.dropna(subset=["id"])
+    if "updated" in df.columns:
+        df = df.sort_values("updated", kind="stable", na_position="first")
+    return df.drop_duplicates(subset="id", keep="last").set_index("id", drop=False)
+
+
+def diff_rows(
+    previous: Optional[pd.DataFrame], current: pd.DataFrame, label: str
+) -> pd.DataFrame:
+    """
+    Compares the events of a month before and after a write, by id.
+
+    Parameters:
+    - previous (pd.DataFrame): the stored events before the write, None if there were none.
+    - current (pd.DataFrame): the stored events after the write.
+    - label (str): the month, "YYYY-MM".
+
+    Returns:
+    pd.DataFrame: the current rows of the inserted and updated events and the ids of the deleted ones, with the
+    columns month and change.
+    """
+    previous = latest_rows(previous)
+    current = latest_rows(current)
+
+    inserted = current.loc[current.index.difference(previous.index)]
+    deleted = previous.loc[previous.index.difference(current.index), ["id"]]
+
+    common_ids = current.index.intersection(previous.index)
+    common_columns = [
+        column for column in current.columns if column in previous.columns
+    ]
+    before = previous.loc[common_ids, common_columns].astype(object)
+    after = current.loc[common_ids, common_columns].astype(object)
+    changed = ((before != after) & ~(before.isna() & after.isna())).any(axis=1)
+    updated = current.loc[changed[changed].index]
+
+    changes = pd.concat(
+        [
+            inserted.assign(change=definitions.CHANGE_INSERT),
+            updated.assign(change=definitions.CHANGE_UPDATE),
+            deleted.assign(change=definitions.CHANGE_DELETE),
+        ],
+        ignore_index=True,
+    )
+    changes["month"] = label
+
+    return changes
+
+
+def list_sequences(storage: Storage) -> list[int]:
+    """the sequence numbers of the stored change sets, sorted"""
+    return sorted(
+        int(match.group(1))
+        for match in map(
+            CHANGE_SET_KEY_PATTERN.match,
+            storage.list_objects(prefix=f"{definitions.CHANGELOG_PREFIX}/"),
+        )
+        if match
+    )
+
+
+def write_change_set(
+    changes: list[pd.DataFrame], run_id: str, storage: Optional[Storage] = None
+) -> Optional[int]:
+    """
+    Writes the changes of a run as the next change set. The sequence number is claimed by creating the file only
+    if it doesn't exist, so concurrent writers get consecutive numbers and a change set is never visible before
+    the ones with smaller numbers. Writers in other processes get distinct numbers only on a storage that enforces
+    conditional writes, see Storage.save_object_conditional.
+
+    Parameters:
+    - changes (list[pd.DataFrame]): the results of diff_rows.
+    - run_id (str): identifies the run, change sets of a run share it.
+    - storage (Storage): a Storage object, optional.
+
+    Returns:
+    Optional[int]: the sequence number of the change set, None if there were no changes or it couldn't be written.
+    """
+    changes = [change for change in changes if not change.empty]
+    if not changes:
+        return None
+    if storage is None:
+        storage = Storage()
+
+    df = pd.concat(changes, ignore_index=True)
+    for _ in range(settings.CHANGELOG_WRITE_RETRIES):
+        sequence = max(list_sequences(storage), default=0) + 1
+        table = conform_table(
+            df.assign(sequence=sequence, run_id=run_id), CHANGELOG_SCHEMA
+        )
+        writer = pa.BufferOutputStream()
+        pq.write_table(table, writer)
+
+        if storage.save_object_conditional(
+            bytes(writer.getvalue()), change_set_key(sequence), if_none_match=True
+        ):
+            settings.logger.info(
+                f"wrote change set {sequence} ({len(df)} change(s), run {run_id})"
+            )
+            return sequence
+
+    settings.logger.error(f"couldn't write the change set of run {run_id}")
+    return None
+
+
+def load_change_sets(
+    after_sequence: int = 0, storage: Optional[Storage] = None
+) -> list[tuple[int, pd.DataFrame]]:
+    """
+    Loads the change sets newer than after_sequence, e.g. the last sequence a consumer applied.
+
+    Returns:
+    list[tuple[int, pd.DataFrame]]: (sequence, changes) in sequence order.
+    """
+    if storage is None:
+        storage = Storage()
+
+    return [
+        (sequence, pd.read_parquet(storage.load_object(change_set_key(sequence))))
+        for sequence in list_sequences(storage)
+        if sequence > after_sequence
+    ]
@@ -0,0 +1,145 @@
+import json
+import threading
+from typing import Callable, Optional, Union
+
+from earthquake_data_layer import definitions, settings
+from earthquake_data_layer.helpers import month_label
+from earthquake_data_layer.storage import Storage
+
+# the index is updated conditionally (see update_compaction_index), the updates of this process are serialized
+index_lock = threading.Lock()
+
+
+def is_compactable(year: Union[str, int]) -> bool:
+    """checks if the months of the year belong to the closed history that is compacted"""
+    return int(year) < settings.COMPACTION_CUTOFF_YEAR
+
+
+def compaction_periods(first_year: int) -> list[tuple[int, int]]:
+    """
+    Splits the years from first_year up to settings.COMPACTION_CUTOFF_YEAR (excluded) into periods of
+    settings.COMPACTION_PERIOD_YEARS years, aligned to multiples of the period (e.g. decades).
+
+    Returns:
+    list[tuple[int, int]]: (first year, last year) of each period, both included.
+    """
+    period = settings.COMPACTION_PERIOD_YEARS
+    periods = list()
+    start = first_year - first_year % period
+    while start + period <= settings.COMPACTION_CUTOFF_YEAR:
+        periods.append((start, start + period - 1))
+        start += period
+    return periods
+
+
+def load_compaction_index_with_etag(
+    storage: Optional[Storage] = None,
+) -> tuple[dict, Optional[str]]:
+    """loads the compaction index and its ETag, ({"months": {}}, None) before the first compaction"""
+    if storage is None:
+        storage = Storage()
+
+    content, etag = storage.load_object_with_etag(definitions.COMPACTION_INDEX_KEY)
+    if content is None:
+        return {"months": {}}, None
+    return json.loads(content.decode("utf-8")), etag
+
+
+def load_compaction_index(storage: Optional[Storage] = None) -> dict:
+    """
+    Loads the compaction index, it maps every compacted month to the file and row groups holding its rows:
+    {"months": {"YYYY-MM": {"key": str, "row_groups": [int, ...]}}}
+    """
+    return load_compaction_index_with_etag(storage)[0]
+
+
+def save_compaction_index(index: dict, storage: Optional[Storage] = None) -> bool:
+    """saves the compaction index"""
+    if storage is None:
+        storage = Storage()
+
+    return storage.save_object(
+        json.dumps(index).encode("utf-8"), definitions.COMPACTION_INDEX_KEY
+    )
+
+
+def update_compaction_index(
+    update: Callable[[dict], bool], storage: Optional[Storage] = None
+) -> Optional[dict]:
+    """
+    Applies update to the compaction index and saves it only if no other process saved it meanwhile. When one did,
+    update is applied again to the newer index, up to settings.COMPACTION_INDEX_RETRIES times.
+
+    Parameters:
+    - update (Callable[[dict], bool]): modifies the index in place, returns False if there is nothing to save.
+    - storage (Storage): a Storage object, optional.
+
+    Returns:
+    Optional[dict]: the updated index, None if it couldn't be saved.
+    """
+    if storage is None:
+        storage = Storage()
+
+    with index_lock:
+        for _ in range(settings.COMPACTION_INDEX_RETRIES):
+            index, etag = load_compaction_index_with_etag(storage)
+            if not update(index):
+                return index
+            if storage.save_object_conditional(
+                json.dumps(index).encode("utf-8"),
+                definitions.COMPACTION_INDEX_KEY,
+                if_match=etag,
+                if_none_match=etag is None,
+            ):
+                return index
+
+    settings.logger.error("couldn't update the compaction index")
+    return None
+
+
+def compacted_months(
+    months: list[tuple[int, int]], storage: Optional[Storage] = None
+) -> dict[tuple[int, int], dict]:
+    """
+    Returns the compaction index entries of the given months that were compacted, the index is only loaded
+    when some of the months are old enough to be compacted.
+
+    Returns:
+    dict[tuple[int, int], dict]: {(year, month): {"key": str, "row_groups": [int, ...]}}
+    """
+    if not any(is_compactable(year) for year, _ in months):
+        return dict()
+
+    index = load_compaction_index(storage)["months"]
+    return {
+        (year, month): index[month_label(year, month)]
+        for year, month in months
+        if month_label(year, month) in index
+    }
+
+
+def release_month(
+    year: Union[str, int], month: Union[str, int], storage: Optional[Storage] = None
+) -> bool:
+    """
+    Removes a month from the compaction index after its monthly file was rewritten, so readers use the monthly
+    file until the next compaction folds it back in.
+
+    Returns:
+    bool: True if the month was compacted and was released, False otherwise.
+    """
+    if not is_compactable(year):
+        return False
+
+    released = list()
+
+    def release(index: dict) -> bool:
+        released[:] = [index["months"].pop(month_label(year, month), None)]
+        return released[0] is not None
+
+    # other processes (e.g. the workers of reprocess_dataset) release months at the same time
+    if update_compaction_index(release, storage) is None or released[0] is None:
+        return False
+
+    settings.logger.info(f"{year}-{month}: released from the compaction index")
+    return True
@@ -0,0 +1,69 @@
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Hashable
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time: a caller that arrives while a call with the same key is in flight
+    waits for it and shares its result (or its exception) instead of running the function again.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls: dict[Hashable, Future] = dict()
+
+    def do(
+        self, key: Hashable, function: Callable, *args, **kwargs
+    ) -> tuple[Any, bool]:
+        """
+        Calls function(*args, **kwargs) unless a call with the same key is in flight.
+
+        Returns:
+        tuple[Any, bool]: the result and whether it was shared from another caller's call.
+        """
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.calls[key] = future
+
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = function(*args, **kwargs)
+            future.set_result(result)
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+        return result, False
+
+    def in_flight(self) -> int:
+        """the number of calls currently running"""
+        with self.lock:
+            return len(self.calls)
+
+
+class KeyedLocks:
+    """A lock per key (e.g. per partition), created on first use and kept for the life of the process"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.locks: dict[Hashable, threading.Lock] = dict()
+
+    def __call__(self, key: Hashable) -> threading.Lock:
+        with self.lock:
+            return self.locks.setdefault(key, threading.Lock())
+
+
+# concurrent fetches of the same month and parameters share one call
+in_flight_fetches = SingleFlight()
+
+# the read-modify-write of a stored file is serialized per key
+partition_locks = KeyedLocks()
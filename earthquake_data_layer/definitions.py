@@ -3,12 +3,57 @@ import datetime
 
 # API
 API_URL = base_url = "https://earthquake.usgs.gov/fdsnws/event/1/query"
+API_COUNT_URL = "https://earthquake.usgs.gov/fdsnws/event/1/count"
 MAX_RESULTS_PER_REQUEST = 20000
 
 # metadata and tables keys
 COLLECTION_METADATA_KEY = "data/collection_metadata.json"
 BATCH_METADATA_KEY = "data/batch_metadata.parquet"
 
+# the API responses of every month, as fetched (bronze)
+RAW_RESPONSES_PREFIX = "data/raw_responses"
+
+# raw data layout
+RAW_DATA_PREFIX = "data/raw_data"
+# data/raw_data/{year}/{year}_{month}_raw_data.parquet
+RAW_DATA_LAYOUT_MONTHLY = "monthly"
+# data/raw_data/year={year}/month={month}/part-0.parquet, discoverable by pyarrow.dataset
+RAW_DATA_LAYOUT_HIVE = "hive"
+# immutable data files listed by snapshot manifests, see table.py
+RAW_DATA_LAYOUT_TABLE = "table"
+RAW_DATA_LAYOUTS = (RAW_DATA_LAYOUT_MONTHLY, RAW_DATA_LAYOUT_HIVE)
+# dataset level summaries of the hive layout
+DATASET_METADATA_KEY = f"{RAW_DATA_PREFIX}/_metadata"
+DATASET_COMMON_METADATA_KEY = f"{RAW_DATA_PREFIX}/_common_metadata"
+DATASET_FOOTERS_KEY = f"{RAW_DATA_PREFIX}/_footers.parquet"
+# compacted historical months
+COMPACTED_DATA_PREFIX = f"{RAW_DATA_PREFIX}/compacted"
+COMPACTION_INDEX_KEY = f"{RAW_DATA_PREFIX}/_compaction.json"
+# snapshot table
+TABLE_PREFIX = "data/table"
+TABLE_DATA_PREFIX = f"{TABLE_PREFIX}/data"
+TABLE_MANIFESTS_PREFIX = f"{TABLE_PREFIX}/manifests"
+TABLE_POINTER_KEY = f"{TABLE_PREFIX}/_current.json"
+# materialized aggregates
+AGGREGATES_PREFIX = "data/aggregates"
+WEEKLY_AGGREGATES_KEY = f"{AGGREGATES_PREFIX}/weekly_cells.parquet"
+# feature tensors, a directory per version
+FEATURES_PREFIX = "data/features"
+FEATURES_MANIFEST_KEY = f"{FEATURES_PREFIX}/_latest.json"
+# change sets, {sequence}.parquet
+CHANGELOG_PREFIX = "data/changelog"
+# leases held by the service processes
+LEASES_PREFIX = "leases"
+LEADER_LEASE_KEY = f"{LEASES_PREFIX}/leader.json"
+# claims of a distributed collection, a lease per month and one to publish the checkpoints
+COLLECTION_CLAIMS_PREFIX = f"{LEASES_PREFIX}/collection"
+COLLECTION_PUBLISH_CLAIM = "publish"
+# written by the probe that checks the storage enforces conditional writes, before any lease is taken
+CONDITIONAL_WRITES_PROBE_KEY = f"{LEASES_PREFIX}/_conditional_writes_probe"
+
+# raw data columns
+RAW_DATA_SORT_COLUMNS = ["cell", "time"]
+
 # fixed time and date format
 TODAY = datetime.datetime.now()
 YESTERDAY = TODAY - datetime.timedelta(days=1)
@@ -20,6 +65,17 @@ EXPECTED_DATA_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S"
 HTTP_COULD_NOT_FETCH_HEALTHY_RESPONSES = 461
 HTTP_COULD_NOT_CONNECT_TO_STORAGE = 462
 HTTP_INVALID_DATE = 463
+HTTP_NOT_LEADER = 464
+
+# /events output formats and their media types
+EVENTS_FORMAT_ARROW = "arrow"
+EVENTS_FORMAT_NDJSON = "ndjson"
+EVENTS_MEDIA_TYPES = {
+    EVENTS_FORMAT_ARROW: "application/vnd.apache.arrow.stream",
+    EVENTS_FORMAT_NDJSON: "application/x-ndjson",
+}
+# /aggregate time buckets
+AGGREGATE_TIME_BUCKETS = ("day", "week", "month")
 
 # pipeline statuses
 STATUS_QUERY_API_SUCCESS = "successfully queried the API"
@@ -30,7 +86,23 @@ STATUS_UPLOAD_DATA_SUCCESS = "successfully uploaded the data"
 STATUS_UPLOAD_DATA_FAIL = "error while uploading the data"
 STATUS_PIPELINE_SUCCESS = "successfully fetched the data for this time frame"
 STATUS_PIPELINE_FAIL = "failed fetching the data for this time frame"
+# progress of a month in a run, before it is fetched or when the probe skipped it
+STATUS_MONTH_PENDING = "pending"
+STATUS_MONTH_SKIPPED = "skipped, unchanged since its last run"
+STATUS_MONTH_CLAIMED = "claimed by another process"
+STATUS_MONTH_RETRYING = "failed, waiting to be fetched again"
+
+# change types in the change sets
+CHANGE_INSERT = "insert"
+CHANGE_UPDATE = "update"
+CHANGE_DELETE = "delete"
 
 # collection_metadata statuses
 STATUS_COLLECTION_METADATA_COMPLETE = "complete"
 STATUS_COLLECTION_METADATA_INCOMPLETE = "incomplete"
+
+# update job statuses
+JOB_STATUS_QUEUED = "queued"
+JOB_STATUS_RUNNING = "running"
+JOB_STATUS_SUCCEEDED = "succeeded"
+JOB_STATUS_FAILED = "failed"
@@ -1,16 +1,40 @@
-from threading import Thread
-from time import sleep
+# pylint: disable=import-outside-toplevel
+import importlib
+from threading import Event, Thread
+from time import monotonic, sleep
 
-from fastapi import FastAPI, status
+from fastapi import FastAPI, HTTPException, status
 from uvicorn import run
 
-import collect_dataset
 from earthquake_data_layer import settings
+from earthquake_data_layer.routes.aggregate import aggregate_router
+from earthquake_data_layer.routes.events import events_router
+from earthquake_data_layer.routes.jobs import jobs_router
+from earthquake_data_layer.routes.metrics import metrics_router
 from earthquake_data_layer.routes.update import update_router
 
+# the modules the pipeline and the data routes need, imported in the background after the app starts
+PIPELINE_MODULES = (
+    "earthquake_data_layer.fetcher",
+    "earthquake_data_layer.hot_store",
+    "earthquake_data_layer.aggregates",
+    "earthquake_data_layer.leases",
+    "update_dataset",
+    "collect_dataset",
+)
+
+# set once the pipeline is imported, the initial dataset verified and the hot store loaded
+ready = Event()
+# set when the app stops
+stopping = Event()
+
 app = FastAPI()
 
 app.include_router(update_router)
+app.include_router(events_router)
+app.include_router(jobs_router)
+app.include_router(metrics_router)
+app.include_router(aggregate_router)
 
 
 @app.get("/", description="healthcheck")
@@ -18,8 +42,31 @@ def read_root():
     return {"message": "Up and running", "status": status.HTTP_200_OK}
 
 
+@app.get(
+    "/ready",
+    description="readiness probe, the service is ready once the initial dataset is verified and loaded.",
+)
+def read_ready():
+    if not ready.is_set():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Starting"
+        )
+    return {"message": "Ready", "status": status.HTTP_200_OK}
+
+
+def import_pipeline():
+    """imports the heavy modules ahead of the first request that needs them"""
+    for module in PIPELINE_MODULES:
+        importlib.import_module(module)
+    settings.logger.info("The pipeline modules were imported")
+
+
 def collect_initial_dataset():
     """verifies the collection dataset was successfully and completely downloaded, retries every {settings.SLEEP_TIME}"""
+    import collect_dataset
+    from earthquake_data_layer.hot_store import hot_store
+    from earthquake_data_layer.leases import leader_election, leading
+
     settings.logger.info("Verifying initial dataset was collected")
     verified = False
     while not verified:
@@ -28,8 +75,14 @@ def collect_initial_dataset():
             verified = True
             continue
 
-        verified = collect_dataset.verify_initial_dataset()
+        # the leader stops collecting once it lost the lease, the claims fence a distributed collection
+        verified = collect_dataset.verify_initial_dataset(
+            fence=None if settings.DISTRIBUTED_COLLECTION else leading
+        )
         if not verified:
+            if not (leader_election.is_leader or settings.DISTRIBUTED_COLLECTION):
+                settings.logger.info("not the leader anymore, leaving the collection")
+                return
             settings.logger.info(
                 f"failed to collect the initial dataset, retrying in {settings.COLLECTION_SLEEP_TIME} seconds"
             )
@@ -37,13 +90,65 @@ def collect_initial_dataset():
 
     settings.logger.info("The initial dataset was collected")
 
+    if not settings.INTEGRATION_TEST:
+        hot_store.refresh()
+
+    ready.set()
+    settings.logger.info("The service is ready")
+
+
+def run_service():
+    """
+    Imports the pipeline, then campaigns for leadership until the app stops. The leader collects (or patches) the
+    initial dataset and runs the updates, the followers wait for the initial dataset (or collect it with the leader,
+    with settings.DISTRIBUTED_COLLECTION) and reload their hot store every settings.HOT_STORE_REFRESH_INTERVAL
+    seconds.
+    """
+    import_pipeline()
+
+    if settings.INTEGRATION_TEST:
+        collect_initial_dataset()
+        return
+
+    import collect_dataset
+    from earthquake_data_layer.hot_store import hot_store
+    from earthquake_data_layer.leases import leader_election
+
+    leading = False
+    refreshed_at = None
+    while not stopping.is_set():
+        if leader_election.try_to_lead():
+            if not leading:
+                leading = True
+                collect_initial_dataset()
+        else:
+            leading = False
+            if settings.DISTRIBUTED_COLLECTION and not ready.is_set():
+                # the followers collect the initial dataset with the leader
+                collect_initial_dataset()
+            elif (
+                refreshed_at is None
+                or monotonic() - refreshed_at >= settings.HOT_STORE_REFRESH_INTERVAL
+            ) and collect_dataset.initial_dataset_complete():
+                hot_store.refresh()
+                refreshed_at = monotonic()
+                ready.set()
+
+        stopping.wait(settings.LEADER_RETRY_INTERVAL)
+
 
 def start():
-    Thread(target=collect_initial_dataset).start()
+    Thread(target=run_service, daemon=True).start()
 
     settings.logger.info("Starting app")
     run(app, host=settings.DATA_LAYER_ENDPOINT, port=int(settings.DATA_LAYER_PORT))
 
+    stopping.set()
+    if not settings.INTEGRATION_TEST:
+        from earthquake_data_layer.leases import leader_election
+
+        leader_election.resign()
+
 
 if __name__ == "__main__":
     start()
@@ -12,3 +12,7 @@ class RemainingRequestsError(Exception):
 
 class NoHealthyRequestsError(Exception):
     pass
+
+
+class ClaimTimeoutError(Exception):
+    pass
@@ -0,0 +1,283 @@
+import datetime
+import io
+import json
+import os
+import re
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from earthquake_data_layer import definitions, settings
+from earthquake_data_layer.aggregates import (
+    DAY_MS,
+    combine_partials,
+    load_partials,
+    week_start,
+)
+from earthquake_data_layer.exceptions import StorageConnectionError
+from earthquake_data_layer.helpers import get_month_start_end_dates
+from earthquake_data_layer.reader import to_epoch_ms
+from earthquake_data_layer.storage import Storage
+
+WEEK_MS = 7 * DAY_MS
+
+# the last axis of the features tensor
+FEATURE_NAMES = ["count", "mag_max", "mag_mean", "log_energy", "depth_mean"]
+
+# the arrays of a version:
+# - features: float32 (weeks, cells, len(FEATURE_NAMES)), zeros where there were no events.
+# - labels: float32 (weeks, cells), the max magnitude of the next week, NaN for the last week.
+# - weeks: int64 (weeks,), the start of each week in epoch milliseconds.
+TENSOR_NAMES = ("features", "labels", "weeks")
+
+VERSION_PATTERN = re.compile(rf"^{definitions.FEATURES_PREFIX}/v(\d+)/")
+
+
+def version_prefix(version: int) -> str:
+    """the prefix of the files of a version"""
+    return f"{definitions.FEATURES_PREFIX}/v{version:06d}"
+
+
+def grid_cell(cell: pd.Series) -> pd.Series:
+    """the cell of the features grid that contains each spatial cell (a prefix of the cell, see spatial.cell_id)"""
+    shift = 2 * (settings.SPATIAL_CELL_BITS - settings.FEATURE_GRID_BITS)
+    return cell.astype("int64") // (1 << shift)
+
+
+def grid_weekly_features(
+    partials: pd.DataFrame, week_starts: Optional[set[int]] = None
+) -> pd.DataFrame:
+    """
+    Combines the partial weekly aggregates into the features of every (week_start, grid cell).
+
+    Parameters:
+    - partials (pd.DataFrame): the partial aggregates, see aggregates.load_partials.
+    - week_starts (set[int]): only compute these weeks, default to all.
+
+    Returns:
+    pd.DataFrame: the columns week_start, cell and FEATURE_NAMES.
+    """
+    df = partials.dropna(subset=["cell"])
+    if week_starts is not None:
+        df = df[df["week_start"].isin(week_starts)]
+
+    weekly = combine_partials(df.assign(cell=grid_cell(df["cell"])))
+    weekly["log_energy"] = np.log10(
+        weekly["energy_sum"].where(weekly["energy_sum"] > 0)
+    )
+
+    return weekly[["week_start", "cell", *FEATURE_NAMES]]
+
+
+def weeks_of_months(months: list[tuple[int, int]]) -> set[int]:
+    """the starts of the weeks that overlap the months"""
+    weeks = set()
+    for year, month in months:
+        start_date, end_date = get_month_start_end_dates(int(year), int(month))
+        first_week = int(week_start(pd.Series([to_epoch_ms(start_date)]))[0])
+        weeks.update(range(first_week, to_epoch_ms(end_date) + 1, WEEK_MS))
+    return weeks
+
+
+def next_week_labels(features: np.ndarray) -> np.ndarray:
+    """the max magnitude of the next week in every cell, NaN for the last week"""
+    labels = np.full(features.shape[:2], np.nan, dtype=np.float32)
+    labels[:-1] = features[1:, :, FEATURE_NAMES.index("mag_max")]
+    return labels
+
+
+def load_feature_manifest(
+    version: Optional[int] = None, storage: Optional[Storage] = None
+) -> Optional[dict]:
+    """loads the manifest of a version (default to the latest), None if there is none"""
+    if storage is None:
+        storage = Storage()
+
+    key = (
+        definitions.FEATURES_MANIFEST_KEY
+        if version is None
+        else f"{version_prefix(version)}/manifest.json"
+    )
+    try:
+        return json.loads(storage.load_object(key).read().decode("utf-8"))
+    except FileNotFoundError:
+        return None
+
+
+def load_array(key: str, storage: Storage) -> np.ndarray:
+    """loads a .npy array from the storage to memory"""
+    return np.load(storage.load_object(key), allow_pickle=False)
+
+
+def save_array(array: np.ndarray, key: str, storage: Storage) -> bool:
+    """saves an array to the storage as .npy"""
+    buffer = io.BytesIO()
+    np.save(buffer, array, allow_pickle=False)
+    return storage.save_object(buffer.getvalue(), key)
+
+
+def remove_old_versions(version: int, storage: Storage):
+    """removes the versions that are settings.FEATURE_VERSIONS_KEPT or more versions older than version"""
+    for key in storage.list_objects(prefix=f"{definitions.FEATURES_PREFIX}/"):
+        match = VERSION_PATTERN.match(key)
+        if match and int(match.group(1)) <= version - settings.FEATURE_VERSIONS_KEPT:
+            storage.remove_object(key)
+
+
+def build_feature_tensors(
+    months: Optional[list[tuple[int, int]]] = None, storage: Optional[Storage] = None
+) -> Optional[dict]:
+    """
+    Builds a new version of the feature tensors from the weekly aggregates.
+    When months are given and the latest version has the same grid and features, its arrays are copied and only
+    the weeks that overlap the months (and the weeks after the latest version) are recomputed, otherwise all the
+    weeks are.
+
+    Parameters:
+    - months (list[tuple[int, int]]): the (year, month) that were written since the latest version, optional.
+    - storage (Storage): a Storage object, optional.
+
+    Returns:
+    Optional[dict]: the manifest of the new version, None if there is no data or the upload failed.
+    """
+    if storage is None:
+        storage = Storage()
+
+    partials = load_partials(storage)
+    if partials is None or partials.empty:
+        settings.logger.info("no weekly aggregates, skipping the feature tensors")
+        return None
+
+    first_week = int(partials["week_start"].min())
+    num_weeks = int(partials["week_start"].max() - first_week) // WEEK_MS + 1
+    num_cells = 4**settings.FEATURE_GRID_BITS
+    features = np.zeros((num_weeks, num_cells, len(FEATURE_NAMES)), dtype=np.float32)
+
+    previous = load_feature_manifest(storage=storage)
+    incremental = (
+        months is not None
+        and previous is not None
+        and previous["grid_bits"] == settings.FEATURE_GRID_BITS
+        and previous["feature_names"] == FEATURE_NAMES
+        and previous["first_week"] == first_week
+    )
+    week_starts = None
+    if incremental:
+        previous_features = load_array(previous["keys"]["features"], storage)
+        num_copied = min(len(previous_features), num_weeks)
+        features[:num_copied] = previous_features[:num_copied]
+
+        week_starts = weeks_of_months(months)
+        week_starts.update(
+            range(
+                first_week + num_copied * WEEK_MS,
+                first_week + num_weeks * WEEK_MS,
+                WEEK_MS,
+            )
+        )
+        week_indexes = [
+            (week - first_week) // WEEK_MS
+            for week in week_starts
+            if 0 <= week - first_week < num_weeks * WEEK_MS
+        ]
+        features[week_indexes] = 0
+
+    weekly = grid_weekly_features(partials, week_starts)
+    features[
+        ((weekly["week_start"] - first_week) // WEEK_MS).to_numpy(),
+        weekly["cell"].to_numpy(),
+    ] = (
+        weekly[FEATURE_NAMES].fillna(0).to_numpy(dtype=np.float32)
+    )
+
+    arrays = {
+        "features": features,
+        "labels": next_week_labels(features),
+        "weeks": np.arange(num_weeks, dtype=np.int64) * WEEK_MS + first_week,
+    }
+
+    version = previous["version"] + 1 if previous else 1
+    manifest = {
+        "version": version,
+        "created_at": datetime.datetime.now().isoformat(),
+        "incremental": incremental,
+        "first_week": first_week,
+        "num_weeks": num_weeks,
+        "num_cells": num_cells,
+        "grid_bits": settings.FEATURE_GRID_BITS,
+        "feature_names": FEATURE_NAMES,
+        "keys": {name: f"{version_prefix(version)}/{name}.npy" for name in arrays},
+    }
+    for name, array in arrays.items():
+        if not save_array(array, manifest["keys"][name], storage):
+            settings.logger.error(f"couldn't save the {name} of version {version}")
+            return None
+
+    # the version's own manifest, then the latest pointer
+    manifest_data = json.dumps(manifest).encode("utf-8")
+    if not storage.save_object(
+        manifest_data, f"{version_prefix(version)}/manifest.json"
+    ) or not storage.save_object(manifest_data, definitions.FEATURES_MANIFEST_KEY):
+        return None
+    remove_old_versions(version, storage)
+
+    settings.logger.info(
+        f"built version {version} of the feature tensors, {num_weeks} weeks x {num_cells} cells"
+        f" ({'incremental' if incremental else 'full'})"
+    )
+    return manifest
+
+
+def open_feature_tensors(
+    directory: str, version: Optional[int] = None, storage: Optional[Storage] = None
+) -> dict:
+    """
+    Downloads a version of the feature tensors (once) to a local directory and opens the arrays memory-mapped,
+    so training jobs read them without copies.
+
+    Parameters:
+    - directory (str): the local directory the versions are downloaded to.
+    - version (int): the version to open, default to the latest.
+    - storage (Storage): a Storage object, optional.
+
+    Returns:
+    dict: {"manifest": dict, **{name: read only memory-mapped np.ndarray for name in TENSOR_NAMES}}.
+
+    Raises:
+    FileNotFoundError: if the version doesn't exist.
+    StorageConnectionError: if a tensor failed to download, its partial file is removed.
+    """
+    if storage is None:
+        storage = Storage()
+
+    manifest = load_feature_manifest(version, storage)
+    if manifest is None:
+        raise FileNotFoundError(f"no feature tensors found (version: {version})")
+
+    version_directory = os.path.join(directory, f"v{manifest['version']:06d}")
+    os.makedirs(version_directory, exist_ok=True)
+
+    tensors = {"manifest": manifest}
+    for name in TENSOR_NAMES:
+        path = os.path.join(version_directory, f"{name}.npy")
+        if not os.path.exists(path):
+            # versions are immutable, a complete file is never downloaded again
+            downloaded = None
+            try:
+                downloaded = storage.load_object(
+                    manifest["keys"][name],
+                    return_as_io=False,
+                    destination_path=f"{path}.part",
+                )
+            finally:
+                if not downloaded and os.path.exists(f"{path}.part"):
+                    os.remove(f"{path}.part")
+            if not downloaded:
+                raise StorageConnectionError(
+                    f"failed to download {manifest['keys'][name]} (version: {manifest['version']})"
+                )
+            os.replace(f"{path}.part", path)
+        tensors[name] = np.load(path, mmap_mode="r")
+
+    return tensors
@@ -1,18 +1,164 @@
+import json
+import re
 import traceback
 from dataclasses import dataclass
 from functools import partial
-from typing import Optional
+from typing import Callable, Optional, Union
 
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import requests
 from fake_headers import Headers
 
-from earthquake_data_layer import definitions, settings
+from earthquake_data_layer import definitions, metrics, settings, table
+from earthquake_data_layer.archive import write_archive
+from earthquake_data_layer.changelog import diff_rows
+from earthquake_data_layer.compaction import compacted_months, release_month
+from earthquake_data_layer.concurrency import in_flight_fetches
 from earthquake_data_layer.helpers import (
     add_rows_to_parquet,
+    data_fingerprint,
     generate_raw_data_key_from_date,
     is_valid_date,
+    merge_rows,
+    month_label,
+    sort_df,
 )
 from earthquake_data_layer.proxy_generator import ProxiesGenerator
+from earthquake_data_layer.schema import RAW_DATA_SCHEMA, conform_table
+from earthquake_data_layer.shared_tables import SharedTable, share_table, take_table
+from earthquake_data_layer.spatial import cell_id
+from earthquake_data_layer.stages import fetch_stages
+from earthquake_data_layer.storage import Storage
+
+# the metadata of a page comes before its features, so its count is read without decoding the page
+PAGE_COUNT_PATTERN = re.compile(rb'"metadata"\s*:\s*\{[^{}]*?"count"\s*:\s*(\d+)')
+PAGE_HEAD_BYTES = 4096
+
+
+def page_count(page: Union[bytes, dict]) -> int:
+    """
+    The number of events in a page of the API. The count of a page that wasn't decoded is read from its head, the
+    page is only decoded if the count isn't found there.
+
+    Args:
+        page (Union[bytes, dict]): the body of the response, or the decoded response.
+
+    Returns:
+        int: the count of the page metadata.
+    """
+    if isinstance(page, bytes):
+        match = PAGE_COUNT_PATTERN.search(page, 0, PAGE_HEAD_BYTES)
+        if match:
+            return int(match.group(1))
+        page = json.loads(page)
+    return page["metadata"]["count"]
+
+
+def rows_from_responses(responses: list[Union[bytes, dict]]) -> tuple[list[dict], int]:
+    """
+    Flattens the features of API responses to rows: the properties, the id and the coordinates with their spatial
+    cell. A module level function, so it can run in a worker process.
+
+    Args:
+        responses (list[Union[bytes, dict]]): the geojson responses of the API, as bodies or decoded.
+
+    Returns:
+        tuple[list[dict], int]: the rows and the sum of the responses counts.
+    """
+    rows = list()
+    total_count = 0
+    for response in responses:
+        if isinstance(response, bytes):
+            response = json.loads(response)
+
+        # sum the number of rows
+        total_count += response["metadata"]["count"]
+
+        # bundle all the data to one list of dictionaries
+        for feature in response["features"]:
+            # get geometric features
+            geometric_features = dict()
+            # verify the coordinates are a list
+            if feature.get("geometry", {}).get("type") == "Point":
+                feature_coordinates = feature.get("geometry").get("coordinates")
+                if isinstance(feature_coordinates, list):
+                    # verify at least two values, the third is an option
+                    if len(feature_coordinates) >= 2:
+                        geometric_features["longitude"] = feature_coordinates[0]
+                        geometric_features["latitude"] = feature_coordinates[1]
+                        geometric_features["cell"] = cell_id(
+                            feature_coordinates[1], feature_coordinates[0]
+                        )
+                    if len(feature_coordinates) == 3:
+                        geometric_features["depth"] = feature_coordinates[2]
+
+            # construct the feature row and append it to the data
+            rows.append(
+                {
+                    **feature.get("properties", {}),
+                    "id": feature.get("id"),
+                    **geometric_features,
+                }
+            )
+
+    return rows, total_count
+
+
+def table_from_rows(rows: list[dict]) -> pa.Table:
+    """
+    Builds an Arrow table with a column for every key of the rows, missing values are null. The types are inferred,
+    a column whose values don't share a type is converted to its RAW_DATA_SCHEMA type, like the upload would, or
+    dropped if it isn't in the schema.
+
+    Args:
+        rows (list[dict]): the rows.
+
+    Returns:
+        pa.Table: the table.
+    """
+    arrays = dict()
+    for column in dict.fromkeys(key for row in rows for key in row):
+        values = [row.get(column) for row in rows]
+        try:
+            arrays[column] = pa.array(values)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            if column not in RAW_DATA_SCHEMA.names:
+                settings.logger.debug(
+                    f"dropping the column {column}, its values have different types"
+                )
+                continue
+            arrays[column] = pa.array(
+                pd.Series(values, dtype=object),
+                type=RAW_DATA_SCHEMA.field(column).type,
+                from_pandas=True,
+            )
+
+    return pa.table(arrays)
+
+
+def decode_responses(responses: list[Union[bytes, dict]]) -> tuple[pa.Table, int]:
+    """
+    Decodes the responses and builds the table of their rows, the work of the process stage.
+
+    Args:
+        responses (list[Union[bytes, dict]]): the geojson responses of the API, as bodies or decoded.
+
+    Returns:
+        tuple[pa.Table, int]: the table of the rows and the sum of the responses counts.
+    """
+    rows, total_count = rows_from_responses(responses)
+    return table_from_rows(rows), total_count
+
+
+def process_responses(responses: list[Union[bytes, dict]]) -> tuple[SharedTable, int]:
+    """
+    decode_responses in a worker process, the table is returned in shared memory so only its handle is pickled back
+    to the fetcher (see shared_tables).
+    """
+    table, total_count = decode_responses(responses)
+    return share_table(table), total_count
 
 
 @dataclass
@@ -25,14 +171,25 @@ class Fetcher:
         end_date (str): The end date of the time frame for data retrieval.
         header: Headers object for managing HTTP headers.
         metadata (dict): Metadata containing information about the execution and status.
-        responses (list): List to store API responses.
-        data (list): List to store processed data.
+        responses (list): List to store API responses, the bodies of the pages (decoded by process).
+        data (pa.Table): The processed rows, a list of rows is accepted as well.
         total_count (int): Total number of rows processed.
+        file_metadata (pq.FileMetaData): The parquet footer of the uploaded file.
+        table_entry (dict): The manifest entry of the written table data file, committed with the batch.
+        changes (pd.DataFrame): The events the upload inserted, updated or deleted, see changelog.diff_rows.
+        previous_fingerprint (str): The fingerprint of the month's last upload, the upload is skipped when the
+            fetched data has the same fingerprint and is still stored where the current layout reads it.
+        fingerprint (str): The fingerprint of the processed data, computed once by process.
+        fence (Callable[[], bool]): Returns False once this process lost the lease or claim it fetches the month
+            under, the data isn't uploaded then.
 
     Methods:
         fetch_data(**kwargs):
             Fetch earthquake data for a given time frame, process, upload to S3, and return metadata.
 
+        run_pipeline(query_params=None, proxy_generator=None):
+            Run the query, process, upload and archive steps, fetch_data shares it between concurrent callers.
+
         query_api(query_params, retries=5):
             Query the API for earthquake data within the specified time frame.
 
@@ -42,9 +199,12 @@ class Fetcher:
         process():
             Process API responses to calculate the total number of rows and extract data.
 
-        upload_data():
+        upload_data(replace=False):
             Upload processed data to S3.
 
+        archive_responses():
+            Archive the raw API responses of the uploaded month.
+
     Properties:
         year:
             Get the year from the start_date.
@@ -58,8 +218,14 @@ class Fetcher:
     header = Headers(headers=True, os="windows")
     metadata: Optional[dict] = None
     responses: Optional[list] = None
-    data: Optional[list] = None
+    data: Optional[Union[pa.Table, list]] = None
     total_count: int = 0
+    file_metadata: Optional[pq.FileMetaData] = None
+    table_entry: Optional[dict] = None
+    changes: Optional[pd.DataFrame] = None
+    previous_fingerprint: Optional[str] = None
+    fingerprint: Optional[str] = None
+    fence: Optional[Callable[[], bool]] = None
 
     def fetch_data(self, **kwargs):
         """
@@ -72,6 +238,10 @@ class Fetcher:
         - count (num of rows, if applicable)
         - data_key (location on s3, if applicable)
 
+        When the same time frame is already being fetched with the same query parameters and fence (e.g. by another
+        run under the same lease), the in flight fetch is awaited until it uploaded, and its outcome is taken over
+        (see adopt): the metadata is returned with "shared": True and this fetcher's batch publishes the month too.
+
         kwargs:
         - query_params: dict. overwrite the default query parameters
         """
@@ -83,6 +253,56 @@ class Fetcher:
                     f"start_date and end_date should be in {definitions.DATE_FORMAT} format"
                 )
 
+        # fetches under different fences (e.g. leases) don't share their uploads
+        key = (
+            self.start_date,
+            self.end_date,
+            json.dumps(kwargs.get("query_params") or {}, sort_keys=True, default=str),
+            self.fence,
+        )
+
+        def run_pipeline(*args) -> "Fetcher":
+            self.run_pipeline(*args)
+            return self
+
+        owner, shared = in_flight_fetches.do(
+            key, run_pipeline, kwargs.get("query_params"), kwargs.get("proxy")
+        )
+        if shared:
+            settings.logger.info(
+                f"{self.year}-{self.month}: shared the result of a fetch in flight"
+            )
+            self.adopt(owner)
+
+        return self.metadata
+
+    def adopt(self, owner: "Fetcher"):
+        """
+        Takes over the outcome of the fetch this one shared: its metadata, with "shared": True, and what it
+        uploaded, so the month is published by this fetcher's batch as well and isn't counted as done unless the
+        owner's upload succeeded. Publishing the same files twice is idempotent, the month's change set may be
+        written by both batches.
+        """
+        for field in (
+            "total_count",
+            "data",
+            "file_metadata",
+            "table_entry",
+            "changes",
+            "fingerprint",
+        ):
+            setattr(self, field, getattr(owner, field))
+        self.metadata = {**owner.metadata, "shared": True}
+
+    def run_pipeline(
+        self,
+        query_params: Optional[dict] = None,
+        proxy_generator: Optional[ProxiesGenerator] = None,
+    ) -> dict:
+        """
+        runs query_api, process, upload_data and archive_responses, stops at the first step that fails.
+        the steps take turns with the other fetchers in the query, process and upload stages of fetch_stages.
+        """
         settings.logger.info(
             f"starting to fetch the data for the time frame {self.start_date} - {self.end_date}"
         )
@@ -93,13 +313,17 @@ class Fetcher:
             "execution_date": definitions.TODAY,
         }
 
-        # run the pipeline, return the metadata upon error
-        for step in (
-            partial(self.query_api, kwargs.get("query_params"), kwargs.get("proxy")),
-            partial(self.process),
-            partial(self.upload_data),
+        # run the pipeline, return the metadata upon error. every step waits for a slot of its stage
+        for stage, step in (
+            ("query", partial(self.query_api, query_params, proxy_generator)),
+            ("process", partial(self.process)),
+            ("upload", partial(self.upload_data)),
+            ("upload", partial(self.archive_responses)),
         ):
-            step_result = step()
+            with fetch_stages.slot(stage), metrics.FETCH_STAGE_SECONDS.time(
+                stage=step.func.__name__
+            ):
+                step_result = step()
             self.metadata.update(step_result)
             if self.metadata.get("error"):
                 settings.logger.critical(
@@ -153,13 +377,14 @@ class Fetcher:
                     else None
                 )
 
-                response = requests.get(
-                    definitions.API_URL,
-                    headers=self.header.generate(),
-                    proxies=proxy,
-                    params=query_params,
-                    timeout=5,
-                )
+                with metrics.API_REQUEST_SECONDS.time(endpoint="query"):
+                    response = requests.get(
+                        definitions.API_URL,
+                        headers=self.header.generate(),
+                        proxies=proxy,
+                        params=query_params,
+                        timeout=5,
+                    )
 
                 settings.logger.debug(
                     f"{self.year}-{self.month} (try {try_}): successfully queried"
@@ -167,11 +392,17 @@ class Fetcher:
                 settings.logger.debug(
                     f"{self.year}-{self.month} (try {try_}): proxy: {proxy}"
                 )
-                response = response.json()
-                self.responses.append(response)
+                # the body is decoded by the process stage, here only the count of the page is read
+                if isinstance(getattr(response, "content", None), bytes):
+                    metrics.API_DOWNLOADED_BYTES.inc(len(response.content))
+                    page = response.content
+                else:
+                    page = response.json()
+                count = page_count(page)
+                self.responses.append(page)
 
                 # check if we're done
-                if response["metadata"]["count"] < definitions.MAX_RESULTS_PER_REQUEST:
+                if count < definitions.MAX_RESULTS_PER_REQUEST:
                     settings.logger.debug(
                         f"{self.year}-{self.month} (try {try_}): setting 'done_fetching' to True"
                     )
@@ -180,7 +411,7 @@ class Fetcher:
 
                 query_params["offset"] += definitions.MAX_RESULTS_PER_REQUEST
 
-            except (requests.RequestException, IndexError) as error:
+            except (requests.RequestException, IndexError, ValueError) as error:
                 last_error = error
                 error_traceback = "".join(
                     traceback.format_exception(None, error, error.__traceback__)
@@ -192,6 +423,7 @@ class Fetcher:
                 try_ += 1
                 if try_ > retries:
                     break
+                metrics.API_RETRIES.inc(endpoint="query")
 
         settings.logger.info(
             f"{self.year}-{self.month}: finished querying the API, num responses: {len(self.responses)}"
@@ -205,6 +437,58 @@ class Fetcher:
 
         return {"status": definitions.STATUS_QUERY_API_SUCCESS}
 
+    def probe_count(
+        self,
+        updated_after: Optional[str] = None,
+        proxy_generator: Optional[ProxiesGenerator] = None,
+        retries: int = 3,
+    ) -> Optional[int]:
+        """
+        Query the API count endpoint for the number of events in the time frame, a cheap request used to decide
+        if the time frame should be fetched.
+
+        Args:
+            updated_after (str): only count events updated after this time, optional.
+            proxy_generator (ProxiesGenerator): an initialized ProxiesGenerator object
+            retries (int): number of allowed API exceptions raised
+
+        Returns:
+            Optional[int]: the number of events, None if the API couldn't be queried.
+        """
+        query_params = {
+            "starttime": self.start_date,
+            "endtime": self.end_date,
+            "format": "geojson",
+        }
+        if updated_after:
+            query_params["updatedafter"] = updated_after
+
+        for try_ in range(retries + 1):
+            try:
+                proxy = (
+                    proxy_generator.gen()
+                    if isinstance(proxy_generator, ProxiesGenerator)
+                    else None
+                )
+                with metrics.API_REQUEST_SECONDS.time(endpoint="count"):
+                    response = requests.get(
+                        definitions.API_COUNT_URL,
+                        headers=self.header.generate(),
+                        proxies=proxy,
+                        params=query_params,
+                        timeout=5,
+                    )
+                return int(response.json()["count"])
+
+            except (requests.RequestException, KeyError, ValueError) as error:
+                settings.logger.error(
+                    f"{self.year}-{self.month} (try {try_}): encountered an error while probing the count: {error}"
+                )
+                if try_ < retries:
+                    metrics.API_RETRIES.inc(endpoint="count")
+
+        return None
+
     def generate_query_params(self, query_params: Optional[dict] = None) -> dict:
         """
         Generate query parameters with default values and update them with provided parameters.
@@ -250,45 +534,45 @@ class Fetcher:
             )
             return {"status": definitions.STATUS_PROCESS_FAIL, "error": True}
 
-        if self.data is None:
-            self.data = list()
-
-        for response in self.responses:
-            # sum the number of rows
-            self.total_count += response["metadata"]["count"]
-
-            # bundle all the data to one list of dictionaries
-            for feature in response["features"]:
-                # get geometric features
-                geometric_features = dict()
-                # verify the coordinates are a list
-                if feature.get("geometry", {}).get("type") == "Point":
-                    feature_coordinates = feature.get("geometry").get("coordinates")
-                    if isinstance(feature_coordinates, list):
-                        # verify at least two values, the third is an option
-                        if len(feature_coordinates) >= 2:
-                            geometric_features["longitude"] = feature_coordinates[0]
-                            geometric_features["latitude"] = feature_coordinates[1]
-                        if len(feature_coordinates) == 3:
-                            geometric_features["depth"] = feature_coordinates[2]
-
-                # construct the feature row and append it to the data
-                feature_row = {
-                    **feature.get("properties", {}),
-                    "id": feature.get("id"),
-                    **geometric_features,
-                }
-                self.data.append(feature_row)
+        # processing is CPU bound, it runs in a worker process of the process stage. the responses are decoded there
+        # and the rows come back as an Arrow table in shared memory, not as pickled dicts. without a worker process
+        # the table is built in this thread and used as is
+        if fetch_stages.runs_inline:
+            data, count = decode_responses(self.responses)
+        else:
+            shared, count = fetch_stages.run_in_process(
+                process_responses, self.responses
+            )
+            data = take_table(shared)
+        if self.data is not None:
+            previous = (
+                self.data
+                if isinstance(self.data, pa.Table)
+                else table_from_rows(self.data)
+            )
+            data = pa.concat_tables([previous, data], promote_options="default")
+        self.data = data
+        self.fingerprint = data_fingerprint(self.data)
+        self.total_count += count
 
         settings.logger.info(
             f"{self.year}-{self.month}: finished processing the responses"
         )
 
-        return {"status": definitions.STATUS_PROCESS_SUCCESS, "count": self.total_count}
+        return {
+            "status": definitions.STATUS_PROCESS_SUCCESS,
+            "count": self.total_count,
+            "fingerprint": self.fingerprint,
+        }
 
-    def upload_data(self) -> dict:
+    def upload_data(self, replace: bool = False) -> dict:
         """
-        Upload processed data to S3.
+        Upload processed data to S3, the rows are sorted by spatial cell so the row groups statistics
+        can be used to skip rows outside a bbox.
+
+        Args:
+            replace (bool): replace the stored rows of the month instead of merging with them, e.g. when the
+                month is reprocessed from its archived responses.
 
         Returns:
             dict: Status of the data upload.
@@ -296,9 +580,45 @@ class Fetcher:
 
         settings.logger.info(f"{self.year}-{self.month}: started to upload the data")
 
+        if self.fence is not None and not self.fence():
+            settings.logger.critical(
+                f"{self.year}-{self.month}: lost the lease to write the month, not uploading"
+            )
+            return {"status": definitions.STATUS_UPLOAD_DATA_FAIL, "error": True}
+
+        if self.previous_fingerprint is not None and self.fingerprint is None:
+            self.fingerprint = data_fingerprint(self.data)
+        if (
+            self.previous_fingerprint is not None
+            and self.fingerprint == self.previous_fingerprint
+            and self.stored_data_exists()
+        ):
+            settings.logger.info(
+                f"{self.year}-{self.month}: the data didn't change, skipping the upload"
+            )
+            return {
+                "status": definitions.STATUS_UPLOAD_DATA_SUCCESS,
+                "unchanged": True,
+                "layout": settings.RAW_DATA_LAYOUT,
+            }
+
+        if settings.RAW_DATA_LAYOUT == definitions.RAW_DATA_LAYOUT_TABLE:
+            return self.write_table_file(replace)
+
         key = generate_raw_data_key_from_date(self.year, self.month)
 
-        data_uploaded = add_rows_to_parquet(self.data, key)
+        metadata_collector = list()
+        previous_collector = list()
+        data_uploaded = add_rows_to_parquet(
+            self.data,
+            key,
+            sort_by=definitions.RAW_DATA_SORT_COLUMNS,
+            row_group_size=settings.RAW_DATA_ROW_GROUP_SIZE,
+            schema=RAW_DATA_SCHEMA,
+            metadata_collector=metadata_collector,
+            previous_collector=previous_collector,
+            replace=replace,
+        )
 
         if not data_uploaded:
             settings.logger.critical(
@@ -306,8 +626,99 @@ class Fetcher:
             )
             return {"status": definitions.STATUS_UPLOAD_DATA_FAIL, "error": True}
 
+        if metadata_collector:
+            self.file_metadata = metadata_collector[0]
+        previous_df = previous_collector[0] if previous_collector else None
+        self.changes = diff_rows(
+            previous_df,
+            merge_rows(None if replace else previous_df, self.data),
+            month_label(self.year, self.month),
+        )
+
+        # a rewritten historical month is read from its monthly file until it is compacted again
+        release_month(self.year, self.month)
+
+        settings.logger.info(f"{self.year}-{self.month}: finished uploading the data")
+        return {
+            "data_key": key,
+            "status": definitions.STATUS_UPLOAD_DATA_SUCCESS,
+            "layout": settings.RAW_DATA_LAYOUT,
+        }
+
+    def stored_data_exists(self) -> bool:
+        """
+        Checks that the month's data is where the current layout reads it from: in the current table snapshot, or
+        in a compacted file or the monthly file. It isn't after a layout switch, a migration or a lost file, then an
+        unchanged month is written again.
+        """
+        if settings.RAW_DATA_LAYOUT == definitions.RAW_DATA_LAYOUT_TABLE:
+            return month_label(self.year, self.month) in table.load_snapshot()["files"]
+        if compacted_months([(int(self.year), int(self.month))]):
+            return True
+        return (
+            Storage().object_etag(
+                generate_raw_data_key_from_date(self.year, self.month)
+            )
+            is not None
+        )
+
+    def write_table_file(self, replace: bool = False) -> dict:
+        """
+        Write the month, merged with its rows in the current snapshot, to a new immutable data file of the table.
+        The file is only visible to readers after the batch commits it (see helpers.fetch_months_data).
+
+        Args:
+            replace (bool): don't merge with the rows in the current snapshot.
+
+        Returns:
+            dict: Status of the data upload.
+        """
+        entry = table.load_snapshot()["files"].get(month_label(self.year, self.month))
+        current_df = (
+            pd.read_parquet(table.load_data_file(entry["key"])) if entry else None
+        )
+
+        df = sort_df(
+            merge_rows(None if replace else current_df, self.data),
+            definitions.RAW_DATA_SORT_COLUMNS,
+        )
+        self.table_entry = table.write_data_file(conform_table(df), self.year)
+
+        if self.table_entry is None:
+            settings.logger.critical(
+                f"{self.year}-{self.month}: encountered an error while uploading the data"
+            )
+            return {"status": definitions.STATUS_UPLOAD_DATA_FAIL, "error": True}
+
+        self.changes = diff_rows(current_df, df, month_label(self.year, self.month))
+
         settings.logger.info(f"{self.year}-{self.month}: finished uploading the data")
-        return {"data_key": key, "status": definitions.STATUS_UPLOAD_DATA_SUCCESS}
+        return {
+            "data_key": self.table_entry["key"],
+            "status": definitions.STATUS_UPLOAD_DATA_SUCCESS,
+            "layout": settings.RAW_DATA_LAYOUT,
+        }
+
+    def archive_responses(self) -> dict:
+        """
+        Archive the raw API responses of the month (when settings.ARCHIVE_RAW_RESPONSES), so the month can be
+        reprocessed without querying the API. Unchanged months aren't archived again, and a failure is logged
+        without failing the month, its data was already uploaded.
+
+        Returns:
+            dict: the archive key, if the responses were archived.
+        """
+        if not settings.ARCHIVE_RAW_RESPONSES or self.metadata.get("unchanged"):
+            return dict()
+
+        key = write_archive(self.responses, self.year, self.month)
+        if key is None:
+            settings.logger.error(
+                f"{self.year}-{self.month}: couldn't archive the responses"
+            )
+            return dict()
+
+        return {"archive_key": key}
 
     @property
     def year(self) -> str:
@@ -1,20 +1,29 @@
+import collections
 import concurrent
+import contextlib
 import datetime
+import hashlib
+import heapq
 import json
-import math
 import random
+import re
 import string
+import time
 import traceback
 from collections.abc import Iterable
-from typing import Optional, Union
+from typing import Callable, Optional, Union
 
 import pandas as pd
 import pyarrow as pa
 import pyarrow.parquet as pq
 from dateutil.relativedelta import relativedelta
 
-from earthquake_data_layer import definitions, settings
+from earthquake_data_layer import definitions, metrics, settings
+from earthquake_data_layer.concurrency import partition_locks
+from earthquake_data_layer.exceptions import ClaimTimeoutError
 from earthquake_data_layer.proxy_generator import ProxiesGenerator
+from earthquake_data_layer.result_cache import query_cache
+from earthquake_data_layer.schema import conform_table
 from earthquake_data_layer.storage import Storage
 
 LOG_MESSAGE_DATASET_MONTHS = "initiated DatasetMonths with time frame {} - {}"
@@ -22,6 +31,15 @@ LOG_MESSAGE_DOWNLOAD_DATA = "starting to download data for dates:"
 LOG_MESSAGE_SUCCESS = "{}-{}: success"
 LOG_MESSAGE_ERROR = "{}-{}: error"
 
+RAW_DATA_KEY_PATTERNS = {
+    definitions.RAW_DATA_LAYOUT_MONTHLY: re.compile(
+        rf"^{definitions.RAW_DATA_PREFIX}/(\d{{4}})/\d{{4}}_(\d{{2}})_raw_data\.parquet$"
+    ),
+    definitions.RAW_DATA_LAYOUT_HIVE: re.compile(
+        rf"^{definitions.RAW_DATA_PREFIX}/year=(\d{{4}})/month=(\d{{2}})/part-0\.parquet$"
+    ),
+}
+
 
 def is_valid_date(
     date: Union[datetime.date, str], str_format: str = definitions.DATE_FORMAT
@@ -59,9 +77,39 @@ def is_valid_date(
     return False
 
 
-def generate_raw_data_key_from_date(year: Union[str, int], month: Union[str, int]):
-    """generates a key for a data file based on a date"""
-    return f"data/raw_data/{year}/{year}_{str(month).zfill(2)}_raw_data.parquet"
+def generate_raw_data_key_from_date(
+    year: Union[str, int], month: Union[str, int], layout: Optional[str] = None
+):
+    """
+    generates a key for a data file based on a date.
+    layout is one of definitions.RAW_DATA_LAYOUTS, default to settings.RAW_DATA_LAYOUT.
+    """
+    layout = layout or settings.RAW_DATA_LAYOUT
+    month = str(month).zfill(2)
+
+    if layout == definitions.RAW_DATA_LAYOUT_HIVE:
+        return f"{definitions.RAW_DATA_PREFIX}/year={year}/month={month}/part-0.parquet"
+    return f"{definitions.RAW_DATA_PREFIX}/{year}/{year}_{month}_raw_data.parquet"
+
+
+def month_label(year: Union[str, int], month: Union[str, int]) -> str:
+    """the label of a month in the indexes and manifests, YYYY-MM"""
+    return f"{year}-{str(month).zfill(2)}"
+
+
+def parse_raw_data_key(
+    key: str, layout: Optional[str] = None
+) -> Optional[tuple[int, int]]:
+    """
+    the inverse of generate_raw_data_key_from_date, returns the (year, month) of a monthly data file key,
+    None if the key is not one. By default, keys of all the layouts are parsed.
+    """
+    layouts = [layout] if layout else definitions.RAW_DATA_LAYOUTS
+    for layout_ in layouts:
+        match = RAW_DATA_KEY_PATTERNS[layout_].match(key)
+        if match:
+            return int(match.group(1)), int(match.group(2))
+    return None
 
 
 def get_month_start_end_dates(year: int, month: int) -> tuple[str, str]:
@@ -82,7 +130,14 @@ def random_string(n: int = 5):
     return "".join(random.choices(string.ascii_lowercase, k=n))
 
 
-def upload_df(df: pd.DataFrame, key: str, storage: Storage) -> bool:
+def upload_df(
+    df: pd.DataFrame,
+    key: str,
+    storage: Storage,
+    row_group_size: Optional[int] = None,
+    schema: Optional[pa.Schema] = None,
+    metadata_collector: Optional[list] = None,
+) -> bool:
     """
     Uploads a DataFrame to the storage.
 
@@ -90,30 +145,277 @@ def upload_df(df: pd.DataFrame, key: str, storage: Storage) -> bool:
     - df (pd.DataFrame): The DataFrame to upload.
     - key (str): The key to use for storage.
     - storage (Storage): The storage instance.
+    - row_group_size (int): max rows per parquet row group, optional.
+    - schema (pa.Schema): conform the data to this schema before writing, optional.
+    - metadata_collector (list): the parquet FileMetaData of the written file is appended to it, optional.
 
     Returns:
     bool: True if the upload is successful, False otherwise.
     """
-    table = pa.Table.from_pandas(df)
+    if schema is not None:
+        table = conform_table(df, schema)
+    else:
+        table = pa.Table.from_pandas(df, preserve_index=False)
     writer = pa.BufferOutputStream()
-    pq.write_table(table, writer)
+    pq.write_table(
+        table,
+        writer,
+        row_group_size=row_group_size,
+        metadata_collector=metadata_collector,
+    )
     return storage.save_object(bytes(writer.getvalue()), key)
 
 
+def data_fingerprint(rows: Union[list[dict], pa.Table]) -> str:
+    """
+    A hash of the sorted (id, updated) pairs of the rows, two fetches of a month that returned the same versions of
+    the same events have the same fingerprint.
+    """
+    if isinstance(rows, pa.Table):
+        ids, updated = (
+            (
+                rows.column(column).to_pylist()
+                if column in rows.column_names
+                else [None] * rows.num_rows
+            )
+            for column in ("id", "updated")
+        )
+        pairs = sorted(zip(map(str, ids), map(str, updated)))
+    else:
+        pairs = sorted((str(row.get("id")), str(row.get("updated"))) for row in rows)
+    return hashlib.sha256(json.dumps(pairs).encode("utf-8")).hexdigest()
+
+
+def load_last_runs(
+    storage: Optional[Storage] = None, runs_key: str = definitions.BATCH_METADATA_KEY
+) -> dict[str, dict]:
+    """
+    Loads the result of the last successful run of every month from the runs metadata.
+
+    Returns:
+    dict[str, dict]: {"YYYY-MM": the row of the run (count, fingerprint, execution_date, etc.)}
+    """
+    if storage is None:
+        storage = Storage()
+
+    try:
+        df = pd.read_parquet(storage.load_object(runs_key))
+    except FileNotFoundError:
+        return dict()
+    if not {"start_date", "status"}.issubset(df.columns):
+        return dict()
+
+    df = df[df["status"] == definitions.STATUS_UPLOAD_DATA_SUCCESS]
+    # the rows are appended in run order, the last one of a month is the latest
+    return {
+        row["start_date"][:7]: row
+        for row in df.to_dict(orient="records")
+        if isinstance(row["start_date"], str)
+    }
+
+
+def load_fingerprints(
+    storage: Optional[Storage] = None,
+    runs_key: str = definitions.BATCH_METADATA_KEY,
+    last_runs: Optional[dict[str, dict]] = None,
+) -> dict[str, str]:
+    """
+    Loads the fingerprint of the last successful upload of every month from the runs metadata, or from last_runs
+    when they were already loaded. The fingerprints of uploads to another layout than settings.RAW_DATA_LAYOUT are
+    left out, those months are written again.
+
+    Returns:
+    dict[str, str]: {"YYYY-MM": fingerprint}
+    """
+    if last_runs is None:
+        last_runs = load_last_runs(storage, runs_key)
+    return {
+        label: run["fingerprint"]
+        for label, run in last_runs.items()
+        if isinstance(run.get("fingerprint"), str)
+        # the runs recorded before the layout was kept have none
+        and (
+            not isinstance(run.get("layout"), str)
+            or run["layout"] == settings.RAW_DATA_LAYOUT
+        )
+    }
+
+
+def probe_months(
+    months: Iterable,
+    storage: Optional[Storage] = None,
+    runs_key: str = definitions.BATCH_METADATA_KEY,
+    proxy_generator: Optional[ProxiesGenerator] = None,
+    today: Optional[datetime.date] = None,
+    counts: Optional[dict[tuple[int, int], int]] = None,
+) -> list[tuple[int, int]]:
+    """
+    Selects the months that should be fetched again. The API count endpoint is queried concurrently for every month,
+    a month is skipped only if it isn't recent (settings.UPDATE_REVISION_MONTHS), its count is the same as in its
+    last successful run and no event was updated since that run.
+
+    Args:
+        months (Iterable): Iterable of tuples representing year and month.
+        storage (Storage): a Storage object, optional.
+        runs_key (str): where the result of each run is saved, default to definitions.BATCH_METADATA_KEY.
+        proxy_generator (ProxiesGenerator): an initialized ProxiesGenerator object, optional.
+        today (date): the date whose month is the newest recent month, default to the current date (a service can
+            run across a month boundary).
+        counts (dict[tuple[int, int], int]): filled with the count of every month the endpoint returned, e.g. to
+            schedule the months to fetch by them (see schedule_months), optional.
+
+    Returns:
+        list[tuple[int, int]]: the months to fetch, in the given order.
+    """
+    # pylint: disable=import-outside-toplevel
+    from earthquake_data_layer.fetcher import Fetcher
+
+    months = list(months)
+    last_runs = load_last_runs(storage, runs_key)
+    today = today or datetime.date.today()
+    first_recent_month = datetime.date(today.year, today.month, 1) - relativedelta(
+        months=settings.UPDATE_REVISION_MONTHS
+    )
+
+    def needs_fetch(year: int, month: int) -> bool:
+        run = last_runs.get(month_label(year, month))
+        if run is None or datetime.date(int(year), int(month), 1) >= first_recent_month:
+            return True
+
+        fetcher = Fetcher(*get_month_start_end_dates(int(year), int(month)))
+        count = fetcher.probe_count(proxy_generator=proxy_generator)
+        if count is not None and counts is not None:
+            counts[(year, month)] = count
+        if count is None or count != run.get("count"):
+            return True
+
+        updated_count = fetcher.probe_count(
+            updated_after=pd.Timestamp(run["execution_date"]).strftime(
+                definitions.EXPECTED_DATA_DATE_FORMAT
+            ),
+            proxy_generator=proxy_generator,
+        )
+        return updated_count != 0
+
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max(min(len(months), settings.COLLECTION_BATCH_SIZE), 1)
+    ) as executor:
+        fetch_flags = list(executor.map(lambda month: needs_fetch(*month), months))
+
+    months_to_fetch = [month for month, fetch in zip(months, fetch_flags) if fetch]
+    settings.logger.info(
+        f"count probe: fetching {len(months_to_fetch)}/{len(months)} month(s)"
+    )
+    return months_to_fetch
+
+
+def schedule_months(
+    months: Iterable,
+    last_runs: dict[str, dict],
+    counts: Optional[dict[tuple[int, int], int]] = None,
+) -> list[tuple[int, int]]:
+    """
+    Orders the months heaviest first (longest processing time first), so the heavy months start while the workers
+    are free and spread across them, and the light months fill the workers as they finish. The cost of a month is its
+    number of events: the count the API returned for it in this run (see probe_months), otherwise the count of its
+    last successful run. Nothing is queried. A month whose count is unknown (e.g. every month of a new collection) may
+    be a heavy one, it is scheduled with the heaviest month, and the unknown months go newest first since the catalog
+    records more events every year. Known months of the same cost keep their order.
+
+    Args:
+        months (Iterable): Iterable of tuples representing year and month.
+        last_runs (dict[str, dict]): the last successful run of every month, see load_last_runs.
+        counts (dict[tuple[int, int], int]): {(year, month): count} obtained in this run, optional.
+
+    Returns:
+        list[tuple[int, int]]: the months, in the order to fetch them.
+    """
+    months = list(months)
+    costs = dict()
+    for year, month in months:
+        count = last_runs.get(month_label(year, month), {}).get("count")
+        if count is not None and not pd.isna(count):
+            costs[(year, month)] = int(count)
+    wanted = set(months)
+    costs.update(
+        {month: count for month, count in (counts or {}).items() if month in wanted}
+    )
+
+    heaviest = max(costs.values(), default=0)
+
+    def cost(month: tuple[int, int]) -> tuple[int, tuple[int, int]]:
+        if month in costs:
+            return costs[month], (0, 0)
+        return heaviest, (int(month[0]), int(month[1]))
+
+    scheduled = sorted(months, key=cost, reverse=True)
+    settings.logger.info(
+        f"scheduled {len(months)} month(s) heaviest first, {len(costs)} by their count, "
+        f"{len(months) - len(costs)} unknown"
+    )
+    return scheduled
+
+
+def merge_rows(
+    df: Optional[pd.DataFrame],
+    rows: Union[dict, list[dict], pa.Table],
+    remove_duplicates: bool = True,
+) -> pd.DataFrame:
+    """appends the row(s) to the DataFrame (if there is one), optionally dropping duplicates"""
+    if isinstance(rows, dict):
+        rows = [rows]
+    new_df = (
+        rows.to_pandas()
+        if isinstance(rows, pa.Table)
+        else pd.DataFrame.from_records(rows)
+    )
+
+    if df is None:
+        return new_df
+
+    df = pd.concat([df, new_df], ignore_index=True)
+    if remove_duplicates:
+        df = df.drop_duplicates()
+    return df
+
+
+def sort_df(df: pd.DataFrame, sort_by: Optional[list[str]] = None) -> pd.DataFrame:
+    """sorts the DataFrame by the columns of sort_by it has, missing values last"""
+    sort_columns = [column for column in sort_by or [] if column in df.columns]
+    if not sort_columns:
+        return df
+    return df.sort_values(
+        sort_columns, kind="stable", na_position="last", ignore_index=True
+    )
+
+
 def add_rows_to_parquet(
-    rows: Union[dict, list[dict]],
+    rows: Union[dict, list[dict], pa.Table],
     key: str,
     storage: Optional[Storage] = None,
     remove_duplicates=True,
+    sort_by: Optional[list[str]] = None,
+    row_group_size: Optional[int] = None,
+    schema: Optional[pa.Schema] = None,
+    metadata_collector: Optional[list] = None,
+    previous_collector: Optional[list] = None,
+    replace: bool = False,
 ) -> bool:
     """
     uploads the row(s) to the parquet file located at {key}. If the file doesn't exist creates it.
 
     Parameters:
-    - rows (dict | list[dict]): The data to append to the file.
+    - rows (dict | list[dict] | pa.Table): The data to append to the file.
     - key (str): The key for the parquet file. Default is the runs metadata key.
     - storage (Storage): A storage instance, optional.
     - remove_duplicates (bool): if to drop duplicates, default to True.
+    - sort_by (list[str]): columns to sort the file by, missing columns are ignored. optional.
+    - row_group_size (int): max rows per parquet row group, optional.
+    - schema (pa.Schema): conform the data to this schema before writing, optional.
+    - metadata_collector (list): the parquet FileMetaData of the written file is appended to it, optional.
+    - previous_collector (list): the DataFrame stored before the update (None if there wasn't a file) is appended
+      to it, optional.
+    - replace (bool): if True the stored rows are replaced by the row(s) instead of appended to, default to False.
 
     Returns:
     bool: True if the update is successful, False otherwise.
@@ -122,23 +424,33 @@ def add_rows_to_parquet(
     if storage is None:
         storage = Storage()
 
-    if isinstance(rows, dict):
-        rows = [rows]
-
-    # load the file from storage and append the new line to it
-    try:
-        df = pd.read_parquet(storage.load_object(key))
-        df = pd.concat([df, pd.DataFrame.from_records(rows)], ignore_index=True)
-        if remove_duplicates:
-            df = df.drop_duplicates()
-
-    # if the file doesn't exist (first run)
-    except FileNotFoundError:
-        settings.logger.error(f"Couldn't find {key}")
-        df = pd.DataFrame.from_records(rows)
-
-    # upload to storage
-    return upload_df(df, key, storage)
+    # writers of the same file in this process wait for each other, so no rows are lost
+    with partition_locks(key):
+        # load the file from storage and append the new line to it
+        try:
+            df = pd.read_parquet(storage.load_object(key))
+
+        # if the file doesn't exist (first run)
+        except FileNotFoundError:
+            settings.logger.error(f"Couldn't find {key}")
+            df = None
+
+        if previous_collector is not None:
+            previous_collector.append(df)
+        if replace:
+            df = None
+
+        df = sort_df(merge_rows(df, rows, remove_duplicates), sort_by)
+
+        # upload to storage
+        return upload_df(
+            df,
+            key,
+            storage,
+            row_group_size=row_group_size,
+            schema=schema,
+            metadata_collector=metadata_collector,
+        )
 
 
 class DatasetMonths:
@@ -209,16 +521,341 @@ class DatasetMonths:
         return self.current_month.year, self.current_month.month
 
 
+def publish_batch(
+    batch_months: list[tuple[int, int]],
+    batch_fetchers: list,
+    results: list[dict],
+    run_id: str,
+    storage: Optional[Storage] = None,
+) -> Optional[int]:
+    """
+    Publishes the months a batch of fetchers wrote: registers the files in the dataset summary (hive layout) or
+    commits them as one snapshot (table layout), replaces their weekly aggregates and writes their change set.
+    The results of months whose commit failed are marked as failed.
+
+    Args:
+        batch_months (list[tuple[int, int]]): the (year, month) of every fetcher.
+        batch_fetchers (list[Fetcher]): the fetchers, after they ran.
+        results (list[dict]): the result of every fetcher.
+        run_id (str): identifies the run in the change sets.
+        storage (Storage): a Storage object, optional.
+
+    Returns:
+        Optional[int]: the sequence number of the batch's change set, None if there were no changes.
+    """
+    # pylint: disable=import-outside-toplevel
+    from earthquake_data_layer.aggregates import (
+        month_partials,
+        update_weekly_aggregates,
+    )
+    from earthquake_data_layer.catalog import update_dataset_summary
+    from earthquake_data_layer.changelog import write_change_set
+    from earthquake_data_layer.table import commit
+
+    # register the new files in the dataset summary
+    if settings.RAW_DATA_LAYOUT == definitions.RAW_DATA_LAYOUT_HIVE:
+        written_files = {
+            result["data_key"]: fetcher.file_metadata
+            for result, fetcher in zip(results, batch_fetchers)
+            if fetcher.file_metadata is not None and "data_key" in result
+        }
+        update_dataset_summary(written_files, storage)
+    # commit the new data files of the batch as one snapshot
+    if settings.RAW_DATA_LAYOUT == definitions.RAW_DATA_LAYOUT_TABLE:
+        written_files = {
+            month_label(year, month): fetcher.table_entry
+            for (year, month), fetcher in zip(batch_months, batch_fetchers)
+            if fetcher.table_entry is not None
+        }
+        if written_files and commit(written_files, storage) is None:
+            settings.logger.error("failed to commit the data of the batch")
+            for result, fetcher in zip(results, batch_fetchers):
+                if fetcher.table_entry is not None:
+                    result["status"] = definitions.STATUS_UPLOAD_DATA_FAIL
+                    result["error"] = True
+
+    written = [
+        (year, month, fetcher)
+        for result, fetcher, (year, month) in zip(results, batch_fetchers, batch_months)
+        if result.get("status") == definitions.STATUS_UPLOAD_DATA_SUCCESS
+        and not result.get("unchanged")
+    ]
+
+    # replace the weekly aggregates of the months that were written
+    update_weekly_aggregates(
+        {
+            month_label(year, month): month_partials(
+                fetcher.data, month_label(year, month)
+            )
+            for year, month, fetcher in written
+            if fetcher.data is not None
+        },
+        storage,
+    )
+
+    # publish what the batch changed
+    sequence = write_change_set(
+        [fetcher.changes for _, _, fetcher in written if fetcher.changes is not None],
+        run_id,
+        storage,
+    )
+
+    # cached query results predate the batch
+    if written:
+        query_cache.bump_version()
+
+    return sequence
+
+
+def retry_delay(attempt: int) -> float:
+    """
+    Seconds to wait before fetching a month again after its attempt-th failed attempt: an exponential backoff from
+    settings.COLLECTION_RETRY_BASE_DELAY up to settings.COLLECTION_RETRY_MAX_DELAY, with a random half of it as
+    jitter so the months that failed together (e.g. with the same proxy) aren't retried together.
+    """
+    delay = min(
+        settings.COLLECTION_RETRY_BASE_DELAY * 2 ** (attempt - 1),
+        settings.COLLECTION_RETRY_MAX_DELAY,
+    )
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def run_fetcher(fetcher, proxy_generator: Optional[ProxiesGenerator] = None) -> dict:
+    """runs a fetcher submitted to the fetch thread pool, it left the pool's queue and is in progress until it returns"""
+    metrics.FETCH_QUEUE_DEPTH.dec()
+    metrics.FETCHES_IN_PROGRESS.inc()
+    try:
+        return fetcher.fetch_data(proxy=proxy_generator)
+    finally:
+        metrics.FETCHES_IN_PROGRESS.dec()
+
+
+def month_fence(
+    label: str,
+    claims: Optional[object] = None,
+    fence: Optional[Callable[[], bool]] = None,
+) -> Optional[Callable[[], bool]]:
+    """
+    the fence of a month's upload: the run's fence and the claim on the month, None if the run has neither. without
+    claims it is the run's fence itself, so the fetches of the runs under the same fence can share (see fetch_data)
+    """
+    if claims is None:
+        return fence
+    return lambda: (fence is None or fence()) and (
+        claims is None or claims.holds(label)
+    )
+
+
+def merge_metadata(metadata: dict, stored: Optional[dict]) -> dict:
+    """
+    Merges the metadata of a run with the collection metadata saved by other processes: a month succeeded if it
+    succeeded in either, the change sets of both are kept, and the collection is complete once either found it
+    complete. The months are keyed by strings, like in the saved json.
+
+    Args:
+        metadata (dict): the run's metadata.
+        stored (dict): the saved metadata, None if there is none.
+
+    Returns:
+        dict: the merged metadata.
+    """
+    stored = stored or dict()
+    merged = {**stored, **metadata}
+
+    details = dict()
+    for source in (stored, metadata):
+        for year, months in source.get("details", {}).items():
+            for month, status in months.items():
+                statuses = details.setdefault(str(year), {})
+                if statuses.get(str(month)) != definitions.STATUS_PIPELINE_SUCCESS:
+                    statuses[str(month)] = status
+    merged["details"] = details
+
+    change_sets = set(stored.get("change_sets", [])) | set(
+        metadata.get("change_sets", [])
+    )
+    if change_sets:
+        merged["change_sets"] = sorted(change_sets)
+    if definitions.STATUS_COLLECTION_METADATA_COMPLETE in (
+        stored.get("status"),
+        metadata.get("status"),
+    ):
+        merged["status"] = definitions.STATUS_COLLECTION_METADATA_COMPLETE
+
+    return merged
+
+
+def save_merged_metadata(
+    metadata: dict,
+    storage: Storage,
+    metadata_key: str = definitions.COLLECTION_METADATA_KEY,
+) -> Optional[dict]:
+    """
+    Saves the metadata of a run merged with the saved metadata (see merge_metadata), only if no other process saved
+    it meanwhile. Otherwise the merge is retried, up to settings.COLLECTION_METADATA_MERGE_RETRIES times.
+
+    Args:
+        metadata (dict): the run's metadata.
+        storage (Storage): a Storage object.
+        metadata_key (str): where to save the metadata, optional.
+
+    Returns:
+        Optional[dict]: the merged metadata, None if it couldn't be saved.
+    """
+    for _ in range(settings.COLLECTION_METADATA_MERGE_RETRIES):
+        content, etag = storage.load_object_with_etag(metadata_key)
+        merged = merge_metadata(
+            metadata, json.loads(content.decode("utf-8")) if content else None
+        )
+        if storage.save_object_conditional(
+            json.dumps(merged).encode("utf-8"),
+            metadata_key,
+            if_match=etag,
+            if_none_match=etag is None,
+        ):
+            return merged
+
+    settings.logger.error(f"couldn't save the metadata merged with {metadata_key}")
+    return None
+
+
+def saved_metadata(
+    storage: Storage, metadata_key: Optional[str] = definitions.COLLECTION_METADATA_KEY
+) -> dict:
+    """loads the saved collection metadata, an empty dict if there is none"""
+    if not metadata_key:
+        return dict()
+    try:
+        return json.loads(storage.load_object(metadata_key).read().decode("utf-8"))
+    except FileNotFoundError:
+        return dict()
+
+
+def unsaved_months(
+    months: list[tuple[int, int]], metadata: dict
+) -> list[tuple[int, int]]:
+    """the months that didn't succeed according to the metadata, e.g. saved by the processes that claimed them"""
+    succeeded = {
+        month_label(year, month)
+        for year, statuses in metadata.get("details", {}).items()
+        for month, status in statuses.items()
+        if status == definitions.STATUS_PIPELINE_SUCCESS
+    }
+    return [month for month in months if month_label(*month) not in succeeded]
+
+
+def checkpoint_months(
+    completed: list[tuple[tuple[int, int], object, dict]],
+    metadata: dict,
+    new_rows: list[dict],
+    run_id: str,
+    storage: Optional[Storage] = None,
+    runs_key: Optional[str] = definitions.BATCH_METADATA_KEY,
+    metadata_key: Optional[str] = definitions.COLLECTION_METADATA_KEY,
+    claims: Optional[object] = None,
+) -> bool:
+    """
+    Publishes the months completed since the last checkpoint, records their statuses in metadata["details"] and
+    saves the run's rows and metadata.
+    With claims the checkpoint is published while holding the publish claim, one process at a time, and the metadata
+    is saved merged with the metadata of the other processes.
+    A checkpoint whose publish claim wasn't taken within settings.COLLECTION_PUBLISH_TIMEOUT seconds isn't published,
+    its months are recorded as failed.
+
+    Args:
+        completed (list[tuple[tuple[int, int], Fetcher, dict]]): the (year, month), fetcher and result of every month.
+        metadata (dict): the run's metadata, updated in place.
+        new_rows (list[dict]): the results of the run so far, the completed results are appended to it.
+        run_id (str): identifies the run in the change sets.
+        storage (Storage): a Storage object, optional.
+        runs_key (str): where to save the result of each month, optional.
+        metadata_key (str): where to save the metadata, optional.
+        claims (leases.Claims): the claims of a distributed collection, optional.
+
+    Returns:
+        bool: True if all the months succeeded, False otherwise.
+    """
+    # other processes publish their checkpoints too, the dataset files are updated by one process at a time
+    with contextlib.ExitStack() as publishing:
+        if claims is not None:
+            try:
+                publishing.enter_context(
+                    claims.hold(definitions.COLLECTION_PUBLISH_CLAIM)
+                )
+            except ClaimTimeoutError as error:
+                # nothing is published, the months are fetched again by a later run
+                settings.logger.critical(f"couldn't publish the checkpoint: {error}")
+                for year, month in (month for month, _, _ in completed):
+                    metadata["details"].setdefault(str(year), {})[
+                        str(month)
+                    ] = definitions.STATUS_PIPELINE_FAIL
+                return False
+
+        batch_months = [month for month, _, _ in completed]
+        batch_fetchers = [fetcher for _, fetcher, _ in completed]
+        results = [result for _, _, result in completed]
+
+        sequence = publish_batch(batch_months, batch_fetchers, results, run_id, storage)
+        if sequence is not None:
+            metadata.setdefault("change_sets", []).append(sequence)
+
+        success = True
+        for result, (year, month) in zip(results, batch_months):
+            new_rows.append(result)
+            statuses = metadata["details"].setdefault(str(year), {})
+
+            if result.get("status") == definitions.STATUS_UPLOAD_DATA_SUCCESS:
+                settings.logger.info(LOG_MESSAGE_SUCCESS.format(year, month))
+                statuses[str(month)] = definitions.STATUS_PIPELINE_SUCCESS
+            else:
+                settings.logger.info(LOG_MESSAGE_ERROR.format(year, month))
+                statuses[str(month)] = definitions.STATUS_PIPELINE_FAIL
+                success = False
+
+        # save if keys are provided
+        if runs_key:
+            settings.logger.debug("saving rows")
+            add_rows_to_parquet(new_rows, runs_key, storage=storage)
+        if metadata_key and claims is not None:
+            settings.logger.debug("saving metadata, merged with the other processes")
+            merged = save_merged_metadata(metadata, storage, metadata_key)
+            if merged is not None:
+                metadata.update(merged)
+        elif metadata_key:
+            settings.logger.debug("saving metadata")
+            storage.save_object(json.dumps(metadata).encode("utf-8"), metadata_key)
+
+        return success
+
+
 def fetch_months_data(
     months: Iterable,
     metadata: Optional[dict] = None,
     storage: Optional[Storage] = None,
     runs_key: str = definitions.BATCH_METADATA_KEY,
     metadata_key: Optional[str] = definitions.COLLECTION_METADATA_KEY,
+    claims: Optional[object] = None,
+    fence: Optional[Callable[[], bool]] = None,
+    counts: Optional[dict[tuple[int, int], int]] = None,
 ) -> dict:
     """
     Fetch earthquake data for a given list of months, saves the return value from fetcher.fetch_data() at {runs_key}
     and returns the updated metadata.
+    The months are fetched heaviest first (see schedule_months) by settings.COLLECTION_WORKERS workers, each starts
+    the next month as soon as it is done with one, so a slow month holds a single worker. The run is checkpointed
+    (published and saved) every settings.COLLECTION_BATCH_SIZE completed months or
+    settings.COLLECTION_CHECKPOINT_SECONDS seconds.
+    A month that failed is fetched again in the same run after an exponential backoff with jitter (see retry_delay),
+    up to settings.COLLECTION_MONTH_ATTEMPTS attempts, only then it is recorded as failed.
+    metadata["progress"] maps every month ("YYYY-MM") to its status and is updated as soon as each month finishes,
+    so a caller holding the metadata can follow the run.
+    With claims, the months are shared with the other processes collecting them: a month is fetched only if this
+    process claims it, and its claim is released once the month was checkpointed. The months claimed by others are
+    checked every settings.COLLECTION_CLAIM_POLL_INTERVAL seconds, until they are saved or their claims expire and
+    this process claims them. The collection is complete when all the months succeeded, whoever fetched them.
+    A month is uploaded and published only while its claim is held, a month whose claim was lost is left to the
+    process that claimed it since. With a fence (e.g. the leader lease) the run stops without publishing anymore once
+    the fence returns False.
 
     Args:
         months (Iterable): Iterable of tuples representing year and month.
@@ -226,6 +863,10 @@ def fetch_months_data(
         storage (Storage): a Storage object, optional.
         runs_key (str): where tho save the result of each run, default to definitions.COLLECTION_RUNS_KEY.
         metadata_key (str): where tho save the metadata, default to definitions.COLLECTION_METADATA_KEY.
+        claims (leases.Claims): the claims of a distributed collection, optional.
+        fence (Callable[[], bool]): returns False once this process may not write the dataset anymore, optional.
+        counts (dict[tuple[int, int], int]): the counts the API returned for the months in this run, e.g. by
+            probe_months, the months are scheduled by them, optional.
 
     Returns:
         dict: Updated metadata.
@@ -234,78 +875,179 @@ def fetch_months_data(
     # pylint: disable=import-outside-toplevel
     from earthquake_data_layer.fetcher import Fetcher
 
-    if not metadata:
+    if metadata is None:
         metadata = dict()
+    months = list(months)
 
     # verify details key exists and is a dict
     metadata.setdefault("details", {})
+    # every month gets its key up front, later only the values change while the run is followed
+    metadata.setdefault("progress", {}).update(
+        {
+            month_label(year, month): definitions.STATUS_MONTH_PENDING
+            for year, month in months
+        }
+    )
 
     if not storage and any((runs_key, metadata_key)):
         storage = Storage()
 
     settings.logger.info(LOG_MESSAGE_DOWNLOAD_DATA)
-
-    num_months = len(list(months))
-    num_batches = math.ceil(num_months / settings.COLLECTION_BATCH_SIZE)
-    settings.logger.info(f"expecting {num_batches} batch(s)")
+    settings.logger.info(
+        f"fetching {len(months)} month(s) with {settings.COLLECTION_WORKERS} workers"
+    )
 
     error_flag = False
     new_rows = list()
-    months = list(months)
+    # the change sets written by this run share it
+    run_id = f"{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}-{random_string(settings.RANDOM_STRING_LENGTH_KEY)}"
     proxy_generator = ProxiesGenerator()
-    for batch in range(num_batches):
-        settings.logger.info(f"starting batch {batch + 1}")
-
-        batch_months = months[
-            batch
-            * settings.COLLECTION_BATCH_SIZE : (batch + 1)
-            * settings.COLLECTION_BATCH_SIZE
-        ]
-        batch_dates = [get_month_start_end_dates(*month) for month in batch_months]
-        batch_fetchers = [Fetcher(*date) for date in batch_dates]
-
-        # run the batch concurrently
-        with concurrent.futures.ThreadPoolExecutor(
-            max_workers=len(batch_fetchers)
-        ) as executor:
-            futures = [
-                executor.submit(fetcher.fetch_data, proxy=proxy_generator)
-                for fetcher in batch_fetchers
-            ]
-            concurrent.futures.wait(futures)
-            thread_results = [future.result() for future in futures]
-
-        # process batch results
-        for thread_result, (year, month) in zip(thread_results, batch_months):
-            new_rows.append(thread_result)
-            metadata["details"].setdefault(str(year), {})
-
-            if thread_result.get("status") == definitions.STATUS_UPLOAD_DATA_SUCCESS:
-                log_msg = LOG_MESSAGE_SUCCESS.format(year, month)
-                settings.logger.info(log_msg)
-                metadata["details"][str(year)][
-                    month
-                ] = definitions.STATUS_PIPELINE_SUCCESS
-            else:
-                log_msg = LOG_MESSAGE_ERROR.format(year, month)
-                settings.logger.info(log_msg)
-                metadata["details"][str(year)][month] = definitions.STATUS_PIPELINE_FAIL
+    last_runs = load_last_runs(storage, runs_key) if runs_key else dict()
+    # months whose fetched events have the same fingerprint as their last upload are not rewritten
+    fingerprints = load_fingerprints(last_runs=last_runs)
+
+    # the heavy months first, so the run doesn't end waiting on a heavy month that started last
+    pending = collections.deque(schedule_months(months, last_runs, counts))
+    in_flight = dict()
+    completed = list()
+    claimed_elsewhere = list()
+    # the failed months waiting for their backoff, (when to retry, month)
+    retrying = list()
+    attempts = collections.Counter()
+    last_checkpoint = time.monotonic()
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=settings.COLLECTION_WORKERS
+    ) as executor:
+        while pending or in_flight or retrying or claimed_elsewhere:
+            # the months whose backoff is over are fetched before the others
+            while retrying and retrying[0][0] <= time.monotonic():
+                pending.appendleft(heapq.heappop(retrying)[1])
+
+            if not (pending or in_flight) and retrying:
+                time.sleep(max(retrying[0][0] - time.monotonic(), 0))
+                continue
+            if not (pending or in_flight):
+                # only months claimed by other processes are left, wait for them to be saved or their claims to expire
+                time.sleep(settings.COLLECTION_CLAIM_POLL_INTERVAL)
+                pending.extend(
+                    unsaved_months(
+                        claimed_elsewhere, saved_metadata(storage, metadata_key)
+                    )
+                )
+                claimed_elsewhere.clear()
+                continue
+
+            # keep every worker busy
+            while pending and len(in_flight) < settings.COLLECTION_WORKERS:
+                year, month = pending.popleft()
+                label = month_label(year, month)
+                if claims is not None and not claims.claim(label):
+                    metadata["progress"][label] = definitions.STATUS_MONTH_CLAIMED
+                    claimed_elsewhere.append((year, month))
+                    continue
+                fetcher = Fetcher(
+                    *get_month_start_end_dates(year, month),
+                    previous_fingerprint=fingerprints.get(label),
+                    fence=month_fence(label, claims, fence),
+                )
+                attempts[(year, month)] += 1
+                metrics.FETCH_QUEUE_DEPTH.inc()
+                future = executor.submit(run_fetcher, fetcher, proxy_generator)
+                in_flight[future] = ((year, month), fetcher)
+
+            # every month left may have been claimed by other processes
+            if in_flight:
+                # or until the next failed month should be retried, or the completed months checkpointed
+                deadlines = [retrying[0][0]] if retrying else []
+                if completed:
+                    deadlines.append(
+                        last_checkpoint + settings.COLLECTION_CHECKPOINT_SECONDS
+                    )
+                done, _ = concurrent.futures.wait(
+                    in_flight,
+                    timeout=(
+                        max(min(deadlines) - time.monotonic(), 0) if deadlines else None
+                    ),
+                    return_when=concurrent.futures.FIRST_COMPLETED,
+                )
+                for future in done:
+                    month, fetcher = in_flight.pop(future)
+                    result = future.result()
+                    label = month_label(*month)
+                    metadata["progress"][label] = result.get("status")
+                    if (
+                        result.get("status") != definitions.STATUS_UPLOAD_DATA_SUCCESS
+                        and attempts[month] < settings.COLLECTION_MONTH_ATTEMPTS
+                    ):
+                        # a transient failure (e.g. of a proxy), the month is fetched again in this run
+                        delay = retry_delay(attempts[month])
+                        settings.logger.warning(
+                            f"{label}: attempt {attempts[month]} failed, retrying in {delay:.1f} seconds"
+                        )
+                        metrics.MONTH_RETRIES.inc()
+                        metadata["progress"][label] = definitions.STATUS_MONTH_RETRYING
+                        heapq.heappush(retrying, (time.monotonic() + delay, month))
+                        continue
+                    completed.append((month, fetcher, result))
+
+            if fence is not None and not fence():
+                settings.logger.critical(
+                    "lost the lease of the run, stopping without publishing"
+                )
                 error_flag = True
-
-        settings.logger.info(f"finished batch {batch + 1}")
-        # save if keys are provided
-        if runs_key:
-            settings.logger.debug("saving rows")
-            add_rows_to_parquet(new_rows, runs_key, storage=storage)
-        if metadata_key:
-            settings.logger.debug("saving metadata")
-            storage.save_object(
-                json.dumps(metadata).encode("utf-8"),
-                metadata_key,
-            )
-
-    settings.logger.info(f"finished all batches, successful: {error_flag}")
-
+                break
+
+            # checkpoint every COLLECTION_BATCH_SIZE months, and what's left when the time is up or the run is over
+            while completed and (
+                len(completed) >= settings.COLLECTION_BATCH_SIZE
+                or not (pending or in_flight)
+                or time.monotonic() - last_checkpoint
+                >= settings.COLLECTION_CHECKPOINT_SECONDS
+            ):
+                checkpoint = completed[: settings.COLLECTION_BATCH_SIZE]
+                completed = completed[settings.COLLECTION_BATCH_SIZE :]
+                if claims is not None:
+                    # a month whose claim was lost is published by the process that claimed it since
+                    held = [
+                        claims.holds(month_label(*month)) for month, _, _ in checkpoint
+                    ]
+                    for (month, _, _), holds in zip(checkpoint, held):
+                        if not holds:
+                            settings.logger.critical(
+                                f"{month_label(*month)}: lost its claim, not publishing it"
+                            )
+                            metadata["progress"][
+                                month_label(*month)
+                            ] = definitions.STATUS_MONTH_CLAIMED
+                            claimed_elsewhere.append(month)
+                    checkpoint = [
+                        entry for entry, holds in zip(checkpoint, held) if holds
+                    ]
+                    if not checkpoint:
+                        continue
+                settings.logger.info(f"checkpoint of {len(checkpoint)} month(s)")
+                if not checkpoint_months(
+                    checkpoint,
+                    metadata,
+                    new_rows,
+                    run_id,
+                    storage,
+                    runs_key,
+                    metadata_key,
+                    claims,
+                ):
+                    error_flag = True
+                if claims is not None:
+                    for month, _, _ in checkpoint:
+                        claims.release(month_label(*month))
+                last_checkpoint = time.monotonic()
+
+    settings.logger.info(f"finished all months, failed: {error_flag}")
+
+    # the months fetched by other processes count as well
+    if claims is not None:
+        metadata.update(merge_metadata(metadata, saved_metadata(storage, metadata_key)))
+        error_flag = bool(unsaved_months(months, metadata))
     if not error_flag:
         metadata["status"] = definitions.STATUS_COLLECTION_METADATA_COMPLETE
 
@@ -0,0 +1,206 @@
+import datetime
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from dateutil.relativedelta import relativedelta
+
+from earthquake_data_layer import settings
+from earthquake_data_layer.helpers import month_label
+from earthquake_data_layer.reader import scan_events, to_epoch_ms
+from earthquake_data_layer.result_cache import query_cache
+from earthquake_data_layer.schema import RAW_DATA_SCHEMA, cast_table
+from earthquake_data_layer.spatial import BBox, bbox_contains
+from earthquake_data_layer.storage import Storage
+
+# the columns kept as numpy arrays next to the table, the queries are evaluated on them
+INDEX_COLUMNS = ["time", "longitude", "latitude", "mag"]
+
+
+@dataclass(frozen=True)
+class HotState:
+    """
+    A loaded set of months: the events sorted by time and the index columns as numpy arrays.
+    The state is never modified, a refresh builds a new one and swaps it in. [start, end) is the loaded time range
+    in epoch milliseconds.
+    """
+
+    table: pa.Table
+    arrays: dict[str, np.ndarray]
+    start: int
+    end: int
+    months: list[str]
+    nbytes: int
+    refreshed_at: str
+
+
+def estimated_size(table: pa.Table) -> int:
+    """the bytes a table takes in the store, its buffers plus a float64 copy of every index column"""
+    return table.nbytes + table.num_rows * len(INDEX_COLUMNS) * 8
+
+
+def hot_months(months: int, today: datetime.date) -> list[tuple[int, int]]:
+    """returns the (year, month) of the current month and the previous n months, newest first"""
+    current_month = datetime.date(today.year, today.month, 1)
+    dates = [
+        current_month - relativedelta(months=offset) for offset in range(months + 1)
+    ]
+    return [(date.year, date.month) for date in dates]
+
+
+class HotStore:
+    """
+    Keeps the events of the last settings.HOT_STORE_MONTHS months in memory as a structure of arrays sorted by
+    time, so recent time range queries are answered with a binary search and vectorized masks instead of reading
+    the bucket. The oldest months are dropped when the events don't fit in settings.HOT_STORE_MEMORY_BUDGET bytes,
+    queries starting before the loaded months are not answered.
+    """
+
+    def __init__(
+        self,
+        months: int = settings.HOT_STORE_MONTHS,
+        memory_budget: int = settings.HOT_STORE_MEMORY_BUDGET,
+    ):
+        self.months = months
+        self.memory_budget = memory_budget
+        self.state: Optional[HotState] = None
+        # refreshes are serialized, queries read whichever state is current
+        self.refresh_lock = threading.Lock()
+
+    def load_month(self, year: int, month: int, storage: Storage) -> pa.Table:
+        """reads a whole month conformed to the raw data schema, events without a time are dropped"""
+        first_day = datetime.date(year, month, 1)
+        last_day = first_day + relativedelta(months=1, days=-1)
+        tables = [
+            cast_table(table, RAW_DATA_SCHEMA)
+            for table in scan_events(first_day, last_day, storage=storage)
+        ]
+        if not tables:
+            return RAW_DATA_SCHEMA.empty_table()
+
+        table = pa.concat_tables(tables)
+        return table.filter(pc.is_valid(table.column("time")))
+
+    def refresh(
+        self,
+        storage: Optional[Storage] = None,
+        today: Optional[datetime.date] = None,
+    ) -> bool:
+        """
+        Reloads the hot months from storage and swaps them in, queries are served from the previous state until
+        the new one is complete.
+
+        Parameters:
+        - storage (Storage): a Storage object, optional.
+        - today (date): the date whose month is the newest hot month, default to the current date.
+
+        Returns:
+        bool: True if the store was refreshed, False otherwise.
+        """
+        if storage is None:
+            storage = Storage()
+        if today is None:
+            today = datetime.date.today()
+        # the hot months end with the month of today
+        end = to_epoch_ms(
+            datetime.date(today.year, today.month, 1) + relativedelta(months=1)
+        )
+
+        with self.refresh_lock:
+            try:
+                tables = list()
+                labels = list()
+                nbytes = 0
+                start = None
+                for year, month in hot_months(self.months, today):
+                    table = self.load_month(year, month, storage)
+                    if nbytes + estimated_size(table) > self.memory_budget:
+                        settings.logger.info(
+                            f"hot store: {year}-{month} and older months exceed the memory budget"
+                        )
+                        break
+                    tables.append(table)
+                    labels.append(month_label(year, month))
+                    nbytes += estimated_size(table)
+                    start = to_epoch_ms(datetime.date(year, month, 1))
+            except Exception as error:
+                settings.logger.error(f"hot store: couldn't refresh: {error}")
+                return False
+
+            if start is None:
+                self.state = None
+                return False
+
+            table = pa.concat_tables(tables).sort_by("time").combine_chunks()
+            arrays = {
+                column: table.column(column).to_numpy(zero_copy_only=False)
+                for column in INDEX_COLUMNS
+            }
+            self.state = HotState(
+                table=table,
+                arrays=arrays,
+                start=start,
+                end=end,
+                months=sorted(labels),
+                nbytes=nbytes,
+                refreshed_at=datetime.datetime.now().isoformat(),
+            )
+
+        # the store may hold data committed by other processes
+        query_cache.bump_version()
+        settings.logger.info(
+            f"hot store: loaded {table.num_rows} events of {len(labels)} month(s), {nbytes} bytes"
+        )
+        return True
+
+    def query(
+        self,
+        time_range: tuple[int, int],
+        bbox: Optional[BBox] = None,
+        mag_range: Optional[tuple[float, float]] = None,
+        columns: Optional[list[str]] = None,
+    ) -> Optional[pa.Table]:
+        """
+        Answers a query from memory: the time range is found with a binary search on the sorted times, then the
+        bbox and magnitude range are applied as masks on that slice only.
+
+        Parameters:
+        - time_range (tuple[int, int]): [start, end) in epoch milliseconds.
+        - bbox (BBox): (min_longitude, min_latitude, max_longitude, max_latitude), optional.
+        - mag_range (tuple[float, float]): [min, max] magnitude, optional.
+        - columns (list[str]): the columns to return, default to all.
+
+        Returns:
+        Optional[pa.Table]: the matching events sorted by time, None if the time range isn't loaded.
+        """
+        state = self.state
+        if state is None or time_range[0] < state.start or time_range[1] > state.end:
+            return None
+
+        times = state.arrays["time"]
+        first, last = np.searchsorted(times, time_range, side="left")
+
+        mask = np.ones(last - first, dtype=bool)
+        if bbox:
+            mask &= bbox_contains(
+                bbox,
+                state.arrays["longitude"][first:last],
+                state.arrays["latitude"][first:last],
+            )
+        if mag_range:
+            magnitudes = state.arrays["mag"][first:last]
+            mask &= (magnitudes >= mag_range[0]) & (magnitudes <= mag_range[1])
+
+        table = state.table.slice(first, last - first)
+        if not mask.all():
+            table = table.filter(pa.array(mask))
+        if columns:
+            table = table.select(columns)
+        return table
+
+
+# the store of the service, refreshed after every update
+hot_store = HotStore()
@@ -0,0 +1,153 @@
+import datetime
+import threading
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Optional
+
+from earthquake_data_layer import definitions, settings
+
+# pylint: disable=import-outside-toplevel
+# the pipeline is imported when a job runs, so the service starts without it
+
+
+@dataclass
+class UpdateJob:
+    """An update run submitted to the job queue, metadata is filled in place by update_dataset while it runs"""
+
+    job_id: str
+    year: int
+    month: int
+    status: str = definitions.JOB_STATUS_QUEUED
+    submitted_at: str = field(
+        default_factory=lambda: datetime.datetime.now().isoformat()
+    )
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+    error: Optional[str] = None
+    metadata: dict = field(default_factory=dict)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (
+            definitions.JOB_STATUS_SUCCEEDED,
+            definitions.JOB_STATUS_FAILED,
+        )
+
+    def report(self) -> dict:
+        """
+        Describes the job: its status, timestamps and the status of every month of the run. The whole run metadata
+        is included once the job finished.
+        """
+        from earthquake_data_layer.helpers import month_label
+
+        # the months are known before the run starts, while it runs only their statuses change
+        months = dict(self.metadata.get("progress", {}))
+        done = [
+            status
+            for status in months.values()
+            if status != definitions.STATUS_MONTH_PENDING
+        ]
+
+        report = {
+            "job_id": self.job_id,
+            "date": month_label(self.year, self.month),
+            "status": self.status,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "months": months,
+            "completed_months": len(done),
+            "total_months": len(months),
+        }
+        if self.finished:
+            report["result"] = self.metadata
+            report["error"] = self.error
+        return report
+
+
+class UpdateJobQueue:
+    """
+    Runs update_dataset in the background on settings.UPDATE_JOB_WORKERS threads, so the request that submits an
+    update returns at once. A date that is already queued or running is not submitted twice, and the last
+    settings.UPDATE_JOBS_KEPT jobs are kept for their reports.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = settings.UPDATE_JOB_WORKERS,
+        jobs_kept: int = settings.UPDATE_JOBS_KEPT,
+    ):
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="update-job"
+        )
+        self.jobs_kept = jobs_kept
+        self.jobs: OrderedDict[str, UpdateJob] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def submit(self, year: int, month: int) -> UpdateJob:
+        """queues an update of the 12 months up to year-month, returns the pending job of that date if there is one"""
+        from earthquake_data_layer.helpers import random_string
+
+        with self.lock:
+            for job in self.jobs.values():
+                if (job.year, job.month) == (year, month) and not job.finished:
+                    settings.logger.info(
+                        f"update of {year}-{month} is already {job.status}"
+                    )
+                    return job
+
+            job = UpdateJob(
+                job_id=f"{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}-"
+                f"{random_string(settings.RANDOM_STRING_LENGTH_KEY)}",
+                year=year,
+                month=month,
+            )
+            self.jobs[job.job_id] = job
+            self._drop_old_jobs()
+
+        self.executor.submit(self._run, job)
+        settings.logger.info(f"submitted job {job.job_id}: update of {year}-{month}")
+        return job
+
+    def get(self, job_id: str) -> Optional[UpdateJob]:
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def _drop_old_jobs(self):
+        """forgets the oldest finished jobs beyond jobs_kept, pending jobs are always kept"""
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[: max(len(self.jobs) - self.jobs_kept, 0)]:
+            del self.jobs[job_id]
+
+    @staticmethod
+    def _run(job: UpdateJob):
+        from earthquake_data_layer.hot_store import hot_store
+        from earthquake_data_layer.leases import leading
+        from update_dataset import update_dataset
+
+        job.status = definitions.JOB_STATUS_RUNNING
+        job.started_at = datetime.datetime.now().isoformat()
+        settings.logger.info(f"job {job.job_id}: started")
+
+        try:
+            # the job stops writing if this process stops being the leader
+            update_dataset(job.year, job.month, metadata=job.metadata, fence=leading)
+            hot_store.refresh()
+            status = definitions.JOB_STATUS_SUCCEEDED
+        except Exception as error:
+            error_traceback = "".join(
+                traceback.format_exception(None, error, error.__traceback__)
+            )
+            settings.logger.critical(f"job {job.job_id}: failed:\n {error_traceback}")
+            job.error = f"{type(error).__name__}: {error}"
+            status = definitions.JOB_STATUS_FAILED
+
+        job.finished_at = datetime.datetime.now().isoformat()
+        job.status = status
+        settings.logger.info(f"job {job.job_id}: {job.status}")
+
+
+# the update jobs of the service
+update_jobs = UpdateJobQueue()
@@ -0,0 +1,319 @@
+import json
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from earthquake_data_layer import definitions, settings
+from earthquake_data_layer.exceptions import ClaimTimeoutError
+from earthquake_data_layer.helpers import random_string
+from earthquake_data_layer.storage import Storage
+
+
+def process_id() -> str:
+    """identifies this process among the holders of leases, host-pid-random"""
+    return f"{socket.gethostname()}-{os.getpid()}-{random_string(settings.RANDOM_STRING_LENGTH_KEY)}"
+
+
+class Lease:
+    """
+    A lease on a key in storage: a json record of its owner and expiry time, written only if it didn't change since
+    it was read (or doesn't exist), so at most one process holds an unexpired lease. Leases are refused on a storage
+    that doesn't enforce conditional writes (see Storage.enforces_conditional_writes). The owner renews it before it
+    expires, a lease that wasn't renewed in time can be taken by anyone.
+    Expiry times are compared to the local clock, the ttl should be well above the clock skew between processes.
+    """
+
+    def __init__(
+        self,
+        key: str,
+        owner: str,
+        ttl: float,
+        storage: Optional[Storage] = None,
+    ):
+        self.key = key
+        self.owner = owner
+        self.ttl = ttl
+        self.storage = storage
+        # local time until which the lease is known to be held, 0 if it isn't
+        self.expires_at = 0.0
+
+    @property
+    def held(self) -> bool:
+        return time.time() < self.expires_at
+
+    def _storage(self) -> Storage:
+        if self.storage is None:
+            self.storage = Storage()
+        return self.storage
+
+    def load(self) -> tuple[Optional[dict], Optional[str]]:
+        """the current lease record and its ETag, (None, None) if there is none"""
+        content, etag = self._storage().load_object_with_etag(self.key)
+        if content is None:
+            return None, None
+        return json.loads(content.decode("utf-8")), etag
+
+    def acquire(self) -> bool:
+        """
+        Takes the lease if it is free or expired, or renews it if this owner holds it.
+
+        Returns:
+        bool: True if the lease is held until now + ttl, False otherwise.
+        """
+        now = time.time()
+        try:
+            # two processes could take the lease at once if the storage ignores the conditions
+            if not self._storage().enforces_conditional_writes():
+                self.expires_at = 0.0
+                return False
+
+            record, etag = self.load()
+            if (
+                record is not None
+                and record["owner"] != self.owner
+                and record["expires_at"] > now
+            ):
+                self.expires_at = 0.0
+                return False
+
+            acquired = self._storage().save_object_conditional(
+                json.dumps(
+                    {
+                        "owner": self.owner,
+                        "acquired_at": (
+                            record["acquired_at"]
+                            if record is not None and record["owner"] == self.owner
+                            else now
+                        ),
+                        "expires_at": now + self.ttl,
+                    }
+                ).encode("utf-8"),
+                self.key,
+                if_match=etag,
+                if_none_match=record is None,
+            )
+        except Exception as error:
+            settings.logger.error(f"couldn't acquire the lease {self.key}: {error}")
+            acquired = False
+
+        # the expiry is counted from before the write, the record may say a little later
+        self.expires_at = now + self.ttl if acquired else 0.0
+        return acquired
+
+    def release(self) -> bool:
+        """gives the lease up by expiring it, if this owner holds it"""
+        self.expires_at = 0.0
+        try:
+            record, etag = self.load()
+            if record is None or record["owner"] != self.owner:
+                return False
+            record["expires_at"] = 0
+            return self._storage().save_object_conditional(
+                json.dumps(record).encode("utf-8"), self.key, if_match=etag
+            )
+        except Exception as error:
+            settings.logger.error(f"couldn't release the lease {self.key}: {error}")
+            return False
+
+
+class LeaderElection:
+    """
+    Elects the process that collects and updates the dataset among the processes sharing a bucket: the leader is
+    the holder of the lease at definitions.LEADER_LEASE_KEY. The leader renews the lease from a heartbeat thread
+    every third of settings.LEADER_LEASE_TTL, and stops being the leader as soon as a renewal fails. The writes the
+    leader started check is_leader before they upload or publish (see leading), so they stop once it lost the lease.
+    The other processes only serve reads and retry to become the leader, so one of them takes over when the leader is
+    gone.
+    Without settings.LEADER_ELECTION the process is the single writer of the bucket and always leads, no lease is
+    written and the storage isn't probed for conditional writes.
+    """
+
+    def __init__(
+        self,
+        key: str = definitions.LEADER_LEASE_KEY,
+        ttl: float = settings.LEADER_LEASE_TTL,
+        storage: Optional[Storage] = None,
+        owner: Optional[str] = None,
+        enabled: bool = settings.LEADER_ELECTION,
+    ):
+        self.lease = Lease(key, owner or process_id(), ttl, storage)
+        self.enabled = enabled
+        self.heartbeat: Optional[threading.Thread] = None
+        self.stopped = threading.Event()
+
+    @property
+    def is_leader(self) -> bool:
+        return not self.enabled or self.lease.held
+
+    def try_to_lead(self) -> bool:
+        """
+        Tries to acquire the lease once, the heartbeat starts when it is acquired.
+
+        Returns:
+        bool: True if this process is the leader, False otherwise.
+        """
+        if self.is_leader:
+            return True
+        if not self.lease.acquire():
+            return False
+
+        settings.logger.info(f"{self.lease.owner} is the leader")
+        self.stopped.clear()
+        self.heartbeat = threading.Thread(
+            target=self._renew, name="leader-heartbeat", daemon=True
+        )
+        self.heartbeat.start()
+        return True
+
+    def _renew(self):
+        while not self.stopped.wait(self.lease.ttl / 3):
+            if not self.lease.acquire():
+                settings.logger.critical(
+                    f"{self.lease.owner} lost the leader lease, serving reads only"
+                )
+                return
+
+    def resign(self):
+        """stops the heartbeat and releases the lease, another process can become the leader at once"""
+        if not self.enabled:
+            return
+        self.stopped.set()
+        if self.heartbeat is not None:
+            self.heartbeat.join()
+        if self.lease.release():
+            settings.logger.info(f"{self.lease.owner} resigned")
+
+
+class Claims:
+    """
+    Claims of this process on names shared with other processes, e.g. the months of a distributed collection. A name
+    is claimed by acquiring the lease at {prefix}/{name}.json, the claimed leases are renewed together from a
+    heartbeat thread every third of the ttl until they are released, a claim whose renewal failed is dropped and
+    holds returns False for it. The claims of a process that died expire, then other processes can claim their names.
+    """
+
+    def __init__(
+        self,
+        prefix: str = definitions.COLLECTION_CLAIMS_PREFIX,
+        ttl: float = settings.COLLECTION_CLAIM_TTL,
+        storage: Optional[Storage] = None,
+        owner: Optional[str] = None,
+    ):
+        self.prefix = prefix
+        self.ttl = ttl
+        self.storage = storage
+        self.owner = owner or process_id()
+        self.lock = threading.Lock()
+        self.leases: dict[str, Lease] = dict()
+        self.heartbeat: Optional[threading.Thread] = None
+        self.stopped = threading.Event()
+
+    def _storage(self) -> Storage:
+        # a single client is shared by the leases
+        if self.storage is None:
+            self.storage = Storage()
+        return self.storage
+
+    def claim(self, name: str) -> bool:
+        """
+        Claims the name unless another process holds an unexpired claim on it.
+
+        Returns:
+        bool: True if this process holds the claim, False otherwise.
+        """
+        lease = Lease(
+            f"{self.prefix}/{name}.json", self.owner, self.ttl, self._storage()
+        )
+        if not lease.acquire():
+            return False
+
+        with self.lock:
+            self.leases[name] = lease
+            if self.heartbeat is None:
+                self.stopped.clear()
+                self.heartbeat = threading.Thread(
+                    target=self._renew, name="claims-heartbeat", daemon=True
+                )
+                self.heartbeat.start()
+        return True
+
+    def holds(self, name: str) -> bool:
+        """whether this process still holds its claim on the name, checked before the work done under it is saved"""
+        with self.lock:
+            lease = self.leases.get(name)
+        return lease is not None and lease.held
+
+    def release(self, name: str):
+        """releases the claim on the name, if this process holds it"""
+        with self.lock:
+            lease = self.leases.pop(name, None)
+        if lease is not None:
+            lease.release()
+
+    @contextmanager
+    def hold(
+        self,
+        name: str,
+        retry_interval: float = settings.COLLECTION_PUBLISH_RETRY_INTERVAL,
+        timeout: Optional[float] = None,
+    ):
+        """
+        Claims the name for the block, waiting for other processes to release it (or for their claim to expire).
+
+        Raises:
+        ClaimTimeoutError: if the name couldn't be claimed within timeout seconds (default to
+            settings.COLLECTION_PUBLISH_TIMEOUT), e.g. the storage keeps failing.
+        """
+        if timeout is None:
+            timeout = settings.COLLECTION_PUBLISH_TIMEOUT
+        deadline = time.monotonic() + timeout
+        while not self.claim(name):
+            if time.monotonic() >= deadline:
+                settings.logger.error(
+                    f"{self.owner} couldn't claim {name} within {timeout} seconds"
+                )
+                raise ClaimTimeoutError(
+                    f"couldn't claim {name} within {timeout} seconds"
+                )
+            time.sleep(retry_interval)
+        try:
+            yield
+        finally:
+            self.release(name)
+
+    def _renew(self):
+        while not self.stopped.wait(self.ttl / 3):
+            with self.lock:
+                leases = list(self.leases.items())
+            for name, lease in leases:
+                if lease.acquire():
+                    continue
+                settings.logger.critical(f"{self.owner} lost its claim on {name}")
+                with self.lock:
+                    if self.leases.get(name) is lease:
+                        del self.leases[name]
+
+    def close(self):
+        """stops the heartbeat and releases the remaining claims"""
+        self.stopped.set()
+        if self.heartbeat is not None:
+            self.heartbeat.join()
+            self.heartbeat = None
+
+        with self.lock:
+            leases = list(self.leases.values())
+            self.leases.clear()
+        for lease in leases:
+            lease.release()
+
+
+# the election of the service process
+leader_election = LeaderElection()
+
+
+def leading() -> bool:
+    """whether the service process is still the leader, the fence of the writes it makes as the leader"""
+    return leader_election.is_leader
@@ -0,0 +1,258 @@
+import abc
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+# upper bounds (seconds) of the latency histograms buckets
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+def escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def format_labels(label_names: tuple, label_values: tuple, **extra) -> str:
+    pairs = list(zip(label_names, label_values)) + list(extra.items())
+    if not pairs:
+        return ""
+    return (
+        "{"
+        + ",".join(f'{name}="{escape_label_value(value)}"' for name, value in pairs)
+        + "}"
+    )
+
+
+class Metric(abc.ABC):
+    """
+    A metric with a fixed set of label names, one series is kept per combination of label values.
+    Updates take a lock held only for the update itself, so instrumenting hot paths is cheap.
+    """
+
+    metric_type = "untyped"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.lock = threading.Lock()
+        self.series: dict[tuple, object] = dict()
+
+    def label_values(self, labels: dict) -> tuple:
+        if set(labels) != set(self.label_names):
+            raise ValueError(
+                f"{self.name}: expected the labels {self.label_names}, got {tuple(labels)}"
+            )
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    @abc.abstractmethod
+    def samples(self) -> list[str]:
+        """the exposition lines of every series"""
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """A value that only goes up, e.g. the number of retries"""
+
+    metric_type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self.series.get(self.label_values(labels), 0)
+
+    def samples(self) -> list[str]:
+        with self.lock:
+            series = dict(self.series)
+        return [
+            f"{self.name}{format_labels(self.label_names, key)} {format_value(value)}"
+            for key, value in sorted(series.items())
+        ]
+
+
+class Gauge(Counter):
+    """A value that goes up and down, e.g. the depth of a queue"""
+
+    metric_type = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            self.series[key] = value
+
+
+class Histogram(Metric):
+    """Counts observations (e.g. latencies) in cumulative buckets, with their sum and count"""
+
+    metric_type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: tuple = (),
+        buckets: tuple = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self.label_values(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            # [count per bucket..., count above the last bucket, sum]
+            series = self.series.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """observes the duration of the block in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        series = self.series.get(self.label_values(labels))
+        return sum(series[:-1]) if series else 0
+
+    def samples(self) -> list[str]:
+        with self.lock:
+            series = {key: list(value) for key, value in self.series.items()}
+
+        lines = list()
+        for key, value in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), value[:-1]):
+                cumulative += count
+                lines.append(
+                    f"{self.name}_bucket{format_labels(self.label_names, key, le=format_value(bound))} "
+                    f"{cumulative}"
+                )
+            labels = format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {format_value(value[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """The metrics of the process, rendered in the Prometheus text exposition format"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics: dict[str, Metric] = dict()
+
+    def register(self, metric: Metric) -> Metric:
+        with self.lock:
+            if metric.name in self.metrics:
+                raise ValueError(f"{metric.name} is already registered")
+            self.metrics[metric.name] = metric
+        return metric
+
+    def get(self, name: str) -> Optional[Metric]:
+        return self.metrics.get(name)
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+FETCH_STAGE_SECONDS = REGISTRY.register(
+    Histogram(
+        "edl_fetch_stage_seconds",
+        "Duration of each step of Fetcher.fetch_data.",
+        ("stage",),
+    )
+)
+API_REQUEST_SECONDS = REGISTRY.register(
+    Histogram(
+        "edl_api_request_seconds",
+        "Duration of a single API request (a page of events or a count).",
+        ("endpoint",),
+    )
+)
+API_RETRIES = REGISTRY.register(
+    Counter(
+        "edl_api_retries_total",
+        "API requests that failed and were retried.",
+        ("endpoint",),
+    )
+)
+API_DOWNLOADED_BYTES = REGISTRY.register(
+    Counter("edl_api_downloaded_bytes_total", "Bytes of API responses downloaded.")
+)
+STORAGE_UPLOADED_BYTES = REGISTRY.register(
+    Counter("edl_storage_uploaded_bytes_total", "Bytes uploaded to storage.")
+)
+STORAGE_DOWNLOADED_BYTES = REGISTRY.register(
+    Counter("edl_storage_downloaded_bytes_total", "Bytes downloaded from storage.")
+)
+PROXY_VALIDATION_SECONDS = REGISTRY.register(
+    Histogram(
+        "edl_proxy_validation_seconds",
+        "Duration of a proxy validation request.",
+        ("result",),
+    )
+)
+MONTH_RETRIES = REGISTRY.register(
+    Counter(
+        "edl_month_retries_total",
+        "Months that failed and were fetched again in the same run.",
+    )
+)
+FETCH_QUEUE_DEPTH = REGISTRY.register(
+    Gauge(
+        "edl_fetch_queue_depth",
+        "Months submitted to the fetch thread pool that didn't start yet.",
+    )
+)
+FETCHES_IN_PROGRESS = REGISTRY.register(
+    Gauge("edl_fetches_in_progress", "Months being fetched.")
+)
+QUERY_CACHE_REQUESTS = REGISTRY.register(
+    Counter(
+        "edl_query_cache_requests_total",
+        "Cacheable queries by outcome: hit, miss or not_modified.",
+        ("result",),
+    )
+)
+STAGE_QUEUE_DEPTH = REGISTRY.register(
+    Gauge(
+        "edl_stage_queue_depth",
+        "Months waiting for a slot of a fetch stage (query, process or upload).",
+        ("stage",),
+    )
+)
+STAGE_IN_PROGRESS = REGISTRY.register(
+    Gauge(
+        "edl_stage_in_progress",
+        "Months running a fetch stage (query, process or upload).",
+        ("stage",),
+    )
+)
@@ -1,10 +1,11 @@
 import random
 import threading
+import time
 from re import findall, sub
 
 import requests
 
-from earthquake_data_layer import settings
+from earthquake_data_layer import metrics, settings
 
 SSL = "https://www.sslproxies.org/"
 GOOGLE = "https://www.google-proxy.net/"
@@ -148,12 +149,21 @@ class ProxiesGenerator:
 
     def is_proxy_working(self, proxy: Proxy):
         url = settings.IP_VERIFYING_URL
-        with requests.get(
-            url, proxies=proxy.proxy, timeout=self.test_timeout, stream=True
-        ) as r:
-            if (
-                r.raw.connection.sock
-                and r.raw.connection.sock.getpeername()[0] == proxy.ip
-            ):
-                return True
-        return False
+        start = time.perf_counter()
+        result = "error"
+        try:
+            with requests.get(
+                url, proxies=proxy.proxy, timeout=self.test_timeout, stream=True
+            ) as r:
+                if (
+                    r.raw.connection.sock
+                    and r.raw.connection.sock.getpeername()[0] == proxy.ip
+                ):
+                    result = "working"
+                    return True
+            result = "not_working"
+            return False
+        finally:
+            metrics.PROXY_VALIDATION_SECONDS.observe(
+                time.perf_counter() - start, result=result
+            )
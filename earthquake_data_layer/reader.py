@@ -0,0 +1,404 @@
+import datetime
+from typing import Iterator, Optional, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from dateutil.relativedelta import relativedelta
+
+from earthquake_data_layer import definitions, settings
+from earthquake_data_layer.catalog import (
+    column_ranges,
+    load_dataset_summary,
+    partition_of,
+    ranges_match,
+    summary_row_groups,
+)
+from earthquake_data_layer.compaction import compacted_months
+from earthquake_data_layer.helpers import generate_raw_data_key_from_date, month_label
+from earthquake_data_layer.spatial import BBox
+from earthquake_data_layer.storage import Storage
+from earthquake_data_layer.table import load_data_file, load_snapshot
+
+# the columns the filters are evaluated on
+FILTER_COLUMNS = ["time", "longitude", "latitude", "mag"]
+
+
+def to_epoch_ms(date: Union[datetime.date, str]) -> int:
+    """converts a date (or a {definitions.DATE_FORMAT} string) to epoch milliseconds, the API's time unit"""
+    if isinstance(date, str):
+        date = datetime.datetime.strptime(date, definitions.DATE_FORMAT)
+    if not isinstance(date, datetime.datetime):
+        date = datetime.datetime(date.year, date.month, date.day)
+    return int(date.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+
+
+def months_in_range(
+    start_date: Union[datetime.date, str], end_date: Union[datetime.date, str]
+) -> list[tuple[int, int]]:
+    """returns the (year, month) tuples of every month that intersects the time frame, both ends included"""
+    if isinstance(start_date, str):
+        start_date = datetime.datetime.strptime(start_date, definitions.DATE_FORMAT)
+    if isinstance(end_date, str):
+        end_date = datetime.datetime.strptime(end_date, definitions.DATE_FORMAT)
+
+    current_month = datetime.date(start_date.year, start_date.month, 1)
+    last_month = datetime.date(end_date.year, end_date.month, 1)
+
+    months = list()
+    while current_month <= last_month:
+        months.append((current_month.year, current_month.month))
+        current_month += relativedelta(months=1)
+
+    return months
+
+
+def row_group_matches(
+    row_group: pq.RowGroupMetaData,
+    time_range: Optional[tuple[int, int]] = None,
+    bbox: Optional[BBox] = None,
+    mag_range: Optional[tuple[float, float]] = None,
+) -> bool:
+    """
+    Check, using only the row group statistics, if the row group might contain rows in the time range, bbox and
+    magnitude range. Row groups without statistics for a filtered column are kept.
+
+    Parameters:
+    - row_group (pq.RowGroupMetaData): the row group metadata.
+    - time_range (tuple[int, int]): [start, end) in epoch milliseconds, optional.
+    - bbox (BBox): (min_longitude, min_latitude, max_longitude, max_latitude), optional.
+    - mag_range (tuple[float, float]): [min, max] magnitude, optional.
+
+    Returns:
+    bool: False if the row group can be skipped, True otherwise.
+    """
+    return ranges_match(
+        column_ranges(row_group, FILTER_COLUMNS), time_range, bbox, mag_range
+    )
+
+
+def plan_from_summary(
+    summary: pq.FileMetaData,
+    months: list[tuple[int, int]],
+    time_range: Optional[tuple[int, int]] = None,
+    bbox: Optional[BBox] = None,
+    mag_range: Optional[tuple[float, float]] = None,
+) -> list[tuple[str, list[int]]]:
+    """
+    Plans a scan from the dataset _metadata summary alone: the partition filter is applied on the files paths
+    and the time range and bbox on the row groups statistics.
+
+    Returns:
+    list[tuple[str, list[int]]]: (key, [row group index in the file, ...]) for every file that should be read.
+    """
+    months = set(months)
+    plan = list()
+    for path, indexes in summary_row_groups(summary).items():
+        if partition_of(path) not in months:
+            continue
+        row_groups = [
+            file_index
+            for file_index, summary_index in enumerate(indexes)
+            if row_group_matches(
+                summary.row_group(summary_index), time_range, bbox, mag_range
+            )
+        ]
+        if row_groups:
+            plan.append((f"{definitions.RAW_DATA_PREFIX}/{path}", row_groups))
+
+    return plan
+
+
+def plan_from_manifest(
+    manifest: dict,
+    months: list[tuple[int, int]],
+    time_range: Optional[tuple[int, int]] = None,
+    bbox: Optional[BBox] = None,
+    mag_range: Optional[tuple[float, float]] = None,
+) -> list[tuple[str, list[int]]]:
+    """
+    Plans a scan from a table snapshot manifest: files are skipped by their month and file level statistics,
+    then row groups by their own statistics.
+
+    Returns:
+    list[tuple[str, list[int]]]: (key, [row group index in the file, ...]) for every file that should be read.
+    """
+    plan = list()
+    for year, month in months:
+        entry = manifest["files"].get(month_label(year, month))
+        if entry is None or not ranges_match(
+            entry["stats"], time_range, bbox, mag_range
+        ):
+            continue
+        row_groups = [
+            index
+            for index, row_group in enumerate(entry["row_groups"])
+            if ranges_match(row_group["stats"], time_range, bbox, mag_range)
+        ]
+        if row_groups:
+            plan.append((entry["key"], row_groups))
+
+    return plan
+
+
+def plan_scan(
+    months: list[tuple[int, int]],
+    time_range: Optional[tuple[int, int]] = None,
+    bbox: Optional[BBox] = None,
+    storage: Optional[Storage] = None,
+    mag_range: Optional[tuple[float, float]] = None,
+) -> list[tuple[str, Optional[list[int]]]]:
+    """
+    Lists the files (and when known, the row groups) to read for the given months and filters.
+    - with the table layout everything is planned from the current snapshot manifest.
+    - compacted months are read from the row groups the compaction index points to.
+    - with the hive layout the rest is planned from the _metadata summary without listing the bucket.
+    - otherwise the keys are generated from the months and the row groups are selected when each file is opened.
+
+    Returns:
+    list[tuple[str, Optional[list[int]]]]: (key, [row group index, ...] or None for all), one entry per key.
+    """
+    if settings.RAW_DATA_LAYOUT == definitions.RAW_DATA_LAYOUT_TABLE:
+        return plan_from_manifest(
+            load_snapshot(storage), months, time_range, bbox, mag_range
+        )
+
+    compacted = compacted_months(months, storage)
+    months = [month for month in months if month not in compacted]
+
+    plan = None
+    if settings.RAW_DATA_LAYOUT == definitions.RAW_DATA_LAYOUT_HIVE:
+        summary = load_dataset_summary(storage)
+        if summary is not None:
+            plan = plan_from_summary(summary, months, time_range, bbox, mag_range)
+        else:
+            settings.logger.debug("no dataset summary, planning by keys")
+    if plan is None:
+        plan = [
+            (generate_raw_data_key_from_date(year, month), None)
+            for year, month in months
+        ]
+
+    # several compacted months share a file, read each file once
+    compacted_row_groups = dict()
+    for entry in compacted.values():
+        compacted_row_groups.setdefault(entry["key"], []).extend(entry["row_groups"])
+    plan.extend(
+        (key, sorted(row_groups))
+        for key, row_groups in compacted_row_groups.items()
+        if row_groups
+    )
+
+    return plan
+
+
+def filter_mask(
+    table: pa.Table,
+    time_range: Optional[tuple[int, int]] = None,
+    bbox: Optional[BBox] = None,
+    mag_range: Optional[tuple[float, float]] = None,
+) -> Optional[pa.ChunkedArray]:
+    """
+    Builds the row mask of the filters with pyarrow compute, so the rows are filtered before any pandas conversion.
+    Rows with a missing filter value don't match, a bbox crossing the antimeridian is handled like bbox_contains.
+
+    Parameters:
+    - table (pa.Table): the rows to filter.
+    - time_range (tuple[int, int]): [start, end) in epoch milliseconds, optional.
+    - bbox (BBox): (min_longitude, min_latitude, max_longitude, max_latitude), optional.
+    - mag_range (tuple[float, float]): [min, max] magnitude, optional.
+
+    Returns:
+    Optional[pa.ChunkedArray]: the boolean mask, None if no filter applies to the table's columns.
+    """
+    columns = table.column_names
+    conditions = []
+
+    if time_range and "time" in columns:
+        conditions.append(pc.greater_equal(table["time"], time_range[0]))
+        conditions.append(pc.less(table["time"], time_range[1]))
+    if bbox and {"longitude", "latitude"}.issubset(columns):
+        min_longitude, min_latitude, max_longitude, max_latitude = bbox
+        conditions.append(pc.greater_equal(table["latitude"], min_latitude))
+        conditions.append(pc.less_equal(table["latitude"], max_latitude))
+        east_of_min = pc.greater_equal(table["longitude"], min_longitude)
+        west_of_max = pc.less_equal(table["longitude"], max_longitude)
+        if min_longitude <= max_longitude:
+            conditions.extend([east_of_min, west_of_max])
+        else:
+            conditions.append(pc.or_(east_of_min, west_of_max))
+    if mag_range and "mag" in columns:
+        conditions.append(pc.greater_equal(table["mag"], mag_range[0]))
+        conditions.append(pc.less_equal(table["mag"], mag_range[1]))
+
+    if not conditions:
+        return None
+
+    mask = conditions[0]
+    for condition in conditions[1:]:
+        mask = pc.and_(mask, condition)
+    return pc.fill_null(mask, False)
+
+
+def read_parquet_filtered(
+    source,
+    time_range: Optional[tuple[int, int]] = None,
+    bbox: Optional[BBox] = None,
+    columns: Optional[list[str]] = None,
+    row_groups: Optional[list[int]] = None,
+    mag_range: Optional[tuple[float, float]] = None,
+) -> Optional[pa.Table]:
+    """
+    Reads only the row groups of a parquet file that may match the filters, then filters the rows.
+
+    Parameters:
+    - source: a path or a file like object of a parquet file.
+    - time_range (tuple[int, int]): [start, end) in epoch milliseconds, optional.
+    - bbox (BBox): (min_longitude, min_latitude, max_longitude, max_latitude), optional.
+    - columns (list[str]): the columns to return, default to all.
+    - row_groups (list[int]): the candidate row groups (e.g. from the summary), default to all.
+    - mag_range (tuple[float, float]): [min, max] magnitude, optional.
+
+    Returns:
+    Optional[pa.Table]: the matching rows, None if all the row groups were skipped.
+    """
+    parquet_file = source
+    if not isinstance(parquet_file, pq.ParquetFile):
+        parquet_file = pq.ParquetFile(source)
+
+    if row_groups is None:
+        row_groups = range(parquet_file.metadata.num_row_groups)
+    row_groups = [
+        index
+        for index in row_groups
+        if row_group_matches(
+            parquet_file.metadata.row_group(index), time_range, bbox, mag_range
+        )
+    ]
+    settings.logger.debug(
+        f"reading {len(row_groups)}/{parquet_file.metadata.num_row_groups} row groups"
+    )
+    if not row_groups:
+        return None
+
+    file_columns = parquet_file.schema_arrow.names
+    read_columns = None
+    if columns:
+        read_columns = [
+            column
+            for column in dict.fromkeys([*columns, *FILTER_COLUMNS])
+            if column in file_columns
+        ]
+
+    table = parquet_file.read_row_groups(row_groups, columns=read_columns)
+    mask = filter_mask(table, time_range, bbox, mag_range)
+    if mask is not None:
+        table = table.filter(mask)
+    if columns:
+        table = table.select([column for column in columns if column in file_columns])
+
+    return table
+
+
+def time_range_of(
+    start_date: Union[datetime.date, str], end_date: Union[datetime.date, str]
+) -> tuple[int, int]:
+    """returns [start, end) in epoch milliseconds of the days between two dates, both included"""
+    return (
+        to_epoch_ms(start_date),
+        to_epoch_ms(end_date) + int(datetime.timedelta(days=1).total_seconds() * 1000),
+    )
+
+
+def open_planned_file(key: str, storage: Storage) -> Optional[pq.ParquetFile]:
+    """
+    opens a planned file, None if the key is missing. table data files are served from the data file cache, and
+    compacted files (many months each) are read with ranged requests, only their footer and planned row groups are
+    downloaded. the other files hold a single month and are downloaded whole.
+    """
+    try:
+        if key.startswith(f"{definitions.TABLE_DATA_PREFIX}/"):
+            return pq.ParquetFile(load_data_file(key, storage))
+        if key.startswith(f"{definitions.COMPACTED_DATA_PREFIX}/"):
+            return pq.ParquetFile(storage.open_object(key))
+        return pq.ParquetFile(storage.load_object(key))
+    except FileNotFoundError:
+        settings.logger.debug(f"{key}: no data")
+        return None
+
+
+def scan_events(
+    start_date: Union[datetime.date, str],
+    end_date: Union[datetime.date, str],
+    bbox: Optional[BBox] = None,
+    columns: Optional[list[str]] = None,
+    storage: Optional[Storage] = None,
+    mag_range: Optional[tuple[float, float]] = None,
+) -> Iterator[pa.Table]:
+    """
+    Streams the events between two dates (both included), optionally inside a bbox and a magnitude range.
+    The scan is planned before the first file is opened, then every matching row group is decoded and filtered
+    on its own, so at most one decoded row group is held in memory regardless of the size of the result. A single
+    month file is downloaded whole before it is decoded, a compacted file (many months) is read with ranged requests
+    and only its planned row groups are downloaded.
+
+    Parameters:
+    - start_date (Union[date, str]): first day of the time frame.
+    - end_date (Union[date, str]): last day of the time frame.
+    - bbox (BBox): (min_longitude, min_latitude, max_longitude, max_latitude), optional.
+    - columns (list[str]): the columns to return, default to all.
+    - storage (Storage): a Storage object, optional.
+    - mag_range (tuple[float, float]): [min, max] magnitude, optional.
+
+    Returns:
+    Iterator[pa.Table]: the matching rows of each row group, row groups without matches are not yielded.
+    """
+    if storage is None:
+        storage = Storage()
+
+    time_range = time_range_of(start_date, end_date)
+    months = months_in_range(start_date, end_date)
+    for key, row_groups in plan_scan(months, time_range, bbox, storage, mag_range):
+        parquet_file = open_planned_file(key, storage)
+        if parquet_file is None:
+            continue
+
+        if row_groups is None:
+            row_groups = range(parquet_file.metadata.num_row_groups)
+        for index in row_groups:
+            table = read_parquet_filtered(
+                parquet_file, time_range, bbox, columns, [index], mag_range
+            )
+            if table is not None and table.num_rows:
+                yield table
+
+
+def read_events(
+    start_date: Union[datetime.date, str],
+    end_date: Union[datetime.date, str],
+    bbox: Optional[BBox] = None,
+    columns: Optional[list[str]] = None,
+    storage: Optional[Storage] = None,
+    mag_range: Optional[tuple[float, float]] = None,
+) -> pd.DataFrame:
+    """
+    Read the events between two dates (both included) and optionally inside a bbox and a magnitude range, only
+    the row groups whose statistics intersect the filters are decoded.
+
+    Parameters:
+    - start_date (Union[date, str]): first day of the time frame.
+    - end_date (Union[date, str]): last day of the time frame.
+    - bbox (BBox): (min_longitude, min_latitude, max_longitude, max_latitude), optional.
+    - columns (list[str]): the columns to return, default to all.
+    - storage (Storage): a Storage object, optional.
+    - mag_range (tuple[float, float]): [min, max] magnitude, optional.
+
+    Returns:
+    pd.DataFrame: the matching events.
+    """
+    tables = list(scan_events(start_date, end_date, bbox, columns, storage, mag_range))
+    if not tables:
+        return pd.DataFrame(columns=columns)
+
+    return pa.concat_tables(tables, promote_options="default").to_pandas()
@@ -0,0 +1,210 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+from fastapi import Response, status
+
+from earthquake_data_layer import definitions, metrics, settings
+
+# the objects rewritten whenever the stored events change, by this process or any other: the table snapshot pointer,
+# the dataset summary, the compaction index and the weekly aggregates every published batch replaces
+DATASET_VERSION_KEYS = (
+    definitions.TABLE_POINTER_KEY,
+    definitions.DATASET_METADATA_KEY,
+    definitions.COMPACTION_INDEX_KEY,
+    definitions.WEEKLY_AGGREGATES_KEY,
+)
+
+
+@dataclass(frozen=True)
+class CachedResult:
+    """the encoded body of a query response"""
+
+    body: bytes
+    media_type: str
+
+
+def etag_matches(etag: str, if_none_match: Optional[str]) -> bool:
+    """whether an If-None-Match header lists the etag, weak validators match as well"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in (tag.removeprefix("W/") for tag in tags)
+
+
+def dataset_version(storage) -> str:
+    """the version of the stored dataset, the ETags of the DATASET_VERSION_KEYS objects (HEAD requests only)"""
+    return ",".join(str(storage.object_etag(key)) for key in DATASET_VERSION_KEYS)
+
+
+class ResultCache:
+    """
+    A least recently used cache of encoded query responses, capped at settings.QUERY_CACHE_MAX_BYTES bytes.
+    Entries are keyed by the route, its normalized parameters and the dataset version. The dataset version is
+    read from storage (see dataset_version) at most every settings.QUERY_CACHE_REVALIDATE_INTERVAL seconds, so
+    writes by other processes and replicas invalidate the cache too. The local version is bumped whenever this
+    process commits or loads new data. Either change empties the cache. The key doubles as the ETag of the response.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = settings.QUERY_CACHE_MAX_BYTES,
+        max_entry_bytes: int = settings.QUERY_CACHE_MAX_ENTRY_BYTES,
+        revalidate_interval: float = settings.QUERY_CACHE_REVALIDATE_INTERVAL,
+    ):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes, max_bytes)
+        self.revalidate_interval = revalidate_interval
+        self.lock = threading.Lock()
+        self.entries: OrderedDict[str, CachedResult] = OrderedDict()
+        self.nbytes = 0
+        self.version = 0
+        self.dataset_version: Optional[str] = None
+        self.revalidated_at: Optional[float] = None
+
+    @staticmethod
+    def key(route: str, version, params: dict) -> str:
+        """
+        The key (and ETag) of a query at a dataset version. The parameters should already be parsed, so equivalent
+        queries (e.g. "4.5" and "4.50") share a key.
+        """
+        normalized = json.dumps([route, version, sorted(params.items())], default=str)
+        return hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).hexdigest()
+
+    @staticmethod
+    def etag(key: str) -> str:
+        return f'"{key}"'
+
+    def get(self, key: str) -> Optional[CachedResult]:
+        with self.lock:
+            result = self.entries.get(key)
+            if result is not None:
+                self.entries.move_to_end(key)
+            return result
+
+    def put(self, key: str, version: int, result: CachedResult) -> bool:
+        """
+        Caches a result computed at the given dataset version, results of an older version or larger than
+        max_entry_bytes are not cached.
+
+        Returns:
+        bool: True if the result was cached, False otherwise.
+        """
+        size = len(result.body)
+        with self.lock:
+            if version != self.version or size > self.max_entry_bytes:
+                return False
+
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.nbytes -= len(previous.body)
+            while self.entries and self.nbytes + size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.nbytes -= len(evicted.body)
+
+            self.entries[key] = result
+            self.nbytes += size
+        return True
+
+    def tee(
+        self, key: str, version: int, media_type: str, chunks: Iterator[bytes]
+    ) -> Iterator[bytes]:
+        """passes a streamed body through and caches it once complete, unless it grew past max_entry_bytes"""
+        collected = list()
+        size = 0
+        for chunk in chunks:
+            yield chunk
+            size += len(chunk)
+            if size <= self.max_entry_bytes:
+                collected.append(chunk)
+        if size <= self.max_entry_bytes:
+            self.put(key, version, CachedResult(b"".join(collected), media_type))
+
+    def lookup(
+        self, route: str, params: dict, if_none_match: Optional[str]
+    ) -> tuple[str, int, Optional[Response]]:
+        """
+        Looks a query up at the current dataset version, revalidated first if it is due.
+
+        Parameters:
+        - route (str): the path of the route.
+        - params (dict): the parsed query parameters.
+        - if_none_match (str): the If-None-Match header of the request, optional.
+
+        Returns:
+        tuple[str, int, Optional[Response]]: the key and version to cache the result with, and the response to
+        return if the client's copy is current (304) or the result is cached.
+        """
+        self.revalidate()
+        with self.lock:
+            version = self.version
+            dataset_version = self.dataset_version
+        key = self.key(route, [dataset_version, version], params)
+        headers = {"ETag": self.etag(key)}
+
+        if etag_matches(headers["ETag"], if_none_match):
+            metrics.QUERY_CACHE_REQUESTS.inc(result="not_modified")
+            return (
+                key,
+                version,
+                Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers),
+            )
+
+        result = self.get(key)
+        if result is not None:
+            metrics.QUERY_CACHE_REQUESTS.inc(result="hit")
+            return (
+                key,
+                version,
+                Response(result.body, media_type=result.media_type, headers=headers),
+            )
+
+        metrics.QUERY_CACHE_REQUESTS.inc(result="miss")
+        return key, version, None
+
+    def revalidate(self, storage=None):
+        """
+        Reads the dataset version from storage unless it was read in the last revalidate_interval seconds, the
+        cache is emptied if it changed. The previous version is kept if storage can't be reached.
+        """
+        now = time.monotonic()
+        if (
+            self.revalidated_at is not None
+            and now - self.revalidated_at < self.revalidate_interval
+        ):
+            return
+        self.revalidated_at = now
+
+        try:
+            if storage is None:
+                # pylint: disable=import-outside-toplevel
+                from earthquake_data_layer.storage import Storage
+
+                storage = Storage()
+            current = dataset_version(storage)
+        except Exception as error:
+            settings.logger.warning(
+                f"query cache: couldn't read the dataset version: {error}"
+            )
+            return
+
+        if current != self.dataset_version:
+            with self.lock:
+                self.dataset_version = current
+            self.bump_version()
+
+    def bump_version(self):
+        """marks the cached results as stale, called when the dataset changes"""
+        with self.lock:
+            self.version += 1
+            self.entries.clear()
+            self.nbytes = 0
+        settings.logger.debug(f"query cache: dataset version {self.version}")
+
+
+# the query results of the service
+query_cache = ResultCache()
@@ -0,0 +1,103 @@
+# pylint: disable=raise-missing-from,import-outside-toplevel
+import datetime
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException, Query, status
+from fastapi.responses import JSONResponse
+
+from earthquake_data_layer import definitions, settings
+from earthquake_data_layer.result_cache import CachedResult, query_cache
+from earthquake_data_layer.routes.events import (
+    INVALID_DATE_MASSAGE,
+    parse_bbox,
+    parse_mag_range,
+)
+
+INVALID_BUCKET_MASSAGE = (
+    f"Invalid bucket, expecting one of {list(definitions.AGGREGATE_TIME_BUCKETS)}"
+)
+
+aggregate_router = APIRouter()
+
+
+@aggregate_router.get(
+    "/aggregate",
+    description="counts the events in a time frame by time bucket, and optionally spatial cell and magnitude bin.",
+)
+def aggregate(
+    start_date: str,
+    end_date: str,
+    bucket: str = Query(
+        "day", description=f"one of {list(definitions.AGGREGATE_TIME_BUCKETS)}"
+    ),
+    cell_bits: Optional[int] = Query(
+        None,
+        ge=0,
+        le=settings.SPATIAL_CELL_BITS,
+        description="group by spatial cells of this precision (bits per axis)",
+    ),
+    mag_bin: Optional[float] = Query(
+        None, gt=0, description="group by magnitude bins of this width"
+    ),
+    min_magnitude: Optional[float] = None,
+    max_magnitude: Optional[float] = None,
+    bbox: Optional[str] = Query(
+        None, description="min_longitude,min_latitude,max_longitude,max_latitude"
+    ),
+    if_none_match: Optional[str] = Header(None),
+):
+    from earthquake_data_layer import helpers
+    from earthquake_data_layer.aggregates import aggregate_events
+
+    settings.logger.info(f"incoming get request at /aggregate/{start_date}/{end_date}")
+
+    # verify input
+    if not helpers.is_valid_date(start_date) or not helpers.is_valid_date(end_date):
+        raise HTTPException(
+            status_code=definitions.HTTP_INVALID_DATE,
+            detail=INVALID_DATE_MASSAGE,
+        )
+    if bucket not in definitions.AGGREGATE_TIME_BUCKETS:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=INVALID_BUCKET_MASSAGE,
+        )
+    bbox = parse_bbox(bbox)
+    mag_range = parse_mag_range(min_magnitude, max_magnitude)
+
+    start_date = datetime.datetime.strptime(start_date, definitions.DATE_FORMAT)
+    end_date = datetime.datetime.strptime(end_date, definitions.DATE_FORMAT)
+
+    key, version, response = query_cache.lookup(
+        "/aggregate",
+        {
+            "start_date": start_date,
+            "end_date": end_date,
+            "bucket": bucket,
+            "cell_bits": cell_bits,
+            "mag_bin": mag_bin,
+            "bbox": bbox,
+            "mag_range": mag_range,
+        },
+        if_none_match,
+    )
+    if response is not None:
+        return response
+
+    try:
+        result = aggregate_events(
+            start_date, end_date, bucket, cell_bits, mag_bin, bbox, mag_range
+        )
+    except Exception as error:
+        settings.logger.critical(f"couldn't aggregate the events: {error}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Encountered an error",
+        )
+
+    response = JSONResponse(
+        {"result": result.to_pylist(), "status_code": status.HTTP_200_OK},
+        headers={"ETag": query_cache.etag(key)},
+    )
+    query_cache.put(key, version, CachedResult(response.body, response.media_type))
+    return response
@@ -0,0 +1,207 @@
+# pylint: disable=raise-missing-from,import-outside-toplevel
+import datetime
+import io
+import itertools
+import json
+from typing import Iterator, Optional
+
+from fastapi import APIRouter, Header, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
+
+from earthquake_data_layer import definitions, settings
+from earthquake_data_layer.result_cache import query_cache
+from earthquake_data_layer.spatial import BBox
+
+# pyarrow and the reader are imported by the handlers, so the service starts without them
+
+INVALID_DATE_MASSAGE = f"Invalid date format, expecting {definitions.DATE_FORMAT}"
+INVALID_BBOX_MASSAGE = (
+    "Invalid bbox, expecting min_longitude,min_latitude,max_longitude,max_latitude"
+)
+INVALID_COLUMNS_MASSAGE = "Unknown columns: {}"
+INVALID_FORMAT_MASSAGE = (
+    f"Invalid format, expecting one of {list(definitions.EVENTS_MEDIA_TYPES)}"
+)
+
+events_router = APIRouter()
+
+
+def parse_bbox(bbox: Optional[str]) -> Optional[BBox]:
+    """parses a "min_longitude,min_latitude,max_longitude,max_latitude" query parameter"""
+    if bbox is None:
+        return None
+    try:
+        values = tuple(float(value) for value in bbox.split(","))
+    except ValueError:
+        values = tuple()
+    if len(values) != 4:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=INVALID_BBOX_MASSAGE,
+        )
+    return values
+
+
+def parse_mag_range(
+    min_magnitude: Optional[float], max_magnitude: Optional[float]
+) -> Optional[tuple[float, float]]:
+    """the [min, max] magnitude range of the query, None if neither bound is set"""
+    if min_magnitude is None and max_magnitude is None:
+        return None
+    return (
+        min_magnitude if min_magnitude is not None else float("-inf"),
+        max_magnitude if max_magnitude is not None else float("inf"),
+    )
+
+
+def parse_columns(columns: Optional[str]) -> Optional[list[str]]:
+    """parses a comma separated columns query parameter, the columns must be in the raw data schema"""
+    from earthquake_data_layer.schema import RAW_DATA_SCHEMA
+
+    if not columns:
+        return None
+    columns = [column.strip() for column in columns.split(",") if column.strip()]
+    unknown = [column for column in columns if column not in RAW_DATA_SCHEMA.names]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=INVALID_COLUMNS_MASSAGE.format(unknown),
+        )
+    return columns
+
+
+def arrow_stream(tables: Iterator, schema) -> Iterator[bytes]:
+    """encodes the tables (pa.Table) as an Arrow IPC stream of the schema (pa.Schema), one message per record batch"""
+    import pyarrow as pa
+
+    from earthquake_data_layer.schema import cast_table
+
+    sink = io.BytesIO()
+    writer = pa.ipc.new_stream(sink, schema)
+
+    def flush() -> bytes:
+        chunk = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return chunk
+
+    for table in tables:
+        writer.write_table(cast_table(table, schema))
+        yield flush()
+    writer.close()
+    yield flush()
+
+
+def ndjson_stream(tables: Iterator, schema) -> Iterator[bytes]:
+    """encodes the rows as json lines, one chunk is yielded per table"""
+    from earthquake_data_layer.schema import cast_table
+
+    for table in tables:
+        rows = cast_table(table, schema).to_pylist()
+        yield "".join(f"{json.dumps(row)}\n" for row in rows).encode("utf-8")
+
+
+@events_router.get(
+    "/events",
+    description="streams the events in a time frame, optionally filtered by magnitude and bbox.",
+)
+def events(
+    start_date: str,
+    end_date: str,
+    min_magnitude: Optional[float] = None,
+    max_magnitude: Optional[float] = None,
+    bbox: Optional[str] = Query(
+        None, description="min_longitude,min_latitude,max_longitude,max_latitude"
+    ),
+    columns: Optional[str] = Query(None, description="comma separated columns"),
+    output_format: str = Query(
+        definitions.EVENTS_FORMAT_ARROW,
+        alias="format",
+        description=f"one of {list(definitions.EVENTS_MEDIA_TYPES)}",
+    ),
+    if_none_match: Optional[str] = Header(None),
+):
+    import pyarrow as pa
+
+    from earthquake_data_layer import helpers
+    from earthquake_data_layer.hot_store import hot_store
+    from earthquake_data_layer.reader import scan_events, time_range_of
+    from earthquake_data_layer.schema import RAW_DATA_SCHEMA
+
+    settings.logger.info(f"incoming get request at /events/{start_date}/{end_date}")
+
+    # verify input
+    if not helpers.is_valid_date(start_date) or not helpers.is_valid_date(end_date):
+        raise HTTPException(
+            status_code=definitions.HTTP_INVALID_DATE,
+            detail=INVALID_DATE_MASSAGE,
+        )
+    if output_format not in definitions.EVENTS_MEDIA_TYPES:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=INVALID_FORMAT_MASSAGE,
+        )
+    bbox = parse_bbox(bbox)
+    columns = parse_columns(columns)
+    mag_range = parse_mag_range(min_magnitude, max_magnitude)
+
+    schema = RAW_DATA_SCHEMA
+    if columns:
+        schema = pa.schema([RAW_DATA_SCHEMA.field(column) for column in columns])
+
+    start_date = datetime.datetime.strptime(start_date, definitions.DATE_FORMAT)
+    end_date = datetime.datetime.strptime(end_date, definitions.DATE_FORMAT)
+
+    media_type = definitions.EVENTS_MEDIA_TYPES[output_format]
+    key, version, response = query_cache.lookup(
+        "/events",
+        {
+            "start_date": start_date,
+            "end_date": end_date,
+            "bbox": bbox,
+            "mag_range": mag_range,
+            "columns": columns,
+            "format": output_format,
+        },
+        if_none_match,
+    )
+    if response is not None:
+        return response
+
+    # recent time frames are answered from memory
+    result = hot_store.query(
+        time_range_of(start_date, end_date), bbox, mag_range, columns
+    )
+    if result is not None:
+        settings.logger.debug(f"/events: {result.num_rows} events from the hot store")
+        tables = (
+            pa.Table.from_batches([batch])
+            for batch in result.to_batches(settings.RAW_DATA_ROW_GROUP_SIZE)
+        )
+    else:
+        tables = scan_events(
+            start_date, end_date, bbox=bbox, columns=columns, mag_range=mag_range
+        )
+
+    # plan the scan and read the first row group before the response starts, so storage errors get a status code
+    try:
+        first = list(itertools.islice(tables, 1))
+    except Exception as error:
+        settings.logger.critical(f"couldn't scan the events: {error}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Encountered an error",
+        )
+
+    encode = (
+        arrow_stream
+        if output_format == definitions.EVENTS_FORMAT_ARROW
+        else ndjson_stream
+    )
+    return StreamingResponse(
+        query_cache.tee(
+            key, version, media_type, encode(itertools.chain(first, tables), schema)
+        ),
+        media_type=media_type,
+        headers={"ETag": query_cache.etag(key)},
+    )
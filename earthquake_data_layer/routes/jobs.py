@@ -0,0 +1,22 @@
+from fastapi import APIRouter, HTTPException, status
+
+from earthquake_data_layer import settings
+from earthquake_data_layer.jobs import update_jobs
+
+jobs_router = APIRouter()
+
+
+@jobs_router.get(
+    "/jobs/{job_id}", description="reports the status and per month progress of a job."
+)
+def get_job(job_id: str):
+    settings.logger.debug(f"incoming get request at /jobs/{job_id}")
+
+    job = update_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Unknown job {job_id}",
+        )
+
+    return {**job.report(), "status_code": status.HTTP_200_OK}
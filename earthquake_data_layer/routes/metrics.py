@@ -0,0 +1,18 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from earthquake_data_layer.metrics import REGISTRY
+
+# the Prometheus text exposition format
+METRICS_MEDIA_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+metrics_router = APIRouter()
+
+
+@metrics_router.get(
+    "/metrics",
+    response_class=PlainTextResponse,
+    description="the service metrics in the Prometheus text format.",
+)
+def get_metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type=METRICS_MEDIA_TYPE)
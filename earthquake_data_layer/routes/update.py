@@ -1,24 +1,23 @@
-# pylint: disable=raise-missing-from
+# pylint: disable=raise-missing-from,import-outside-toplevel
 import datetime
 import traceback
 
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, Body, HTTPException, status
 
-from earthquake_data_layer import definitions, exceptions, helpers, settings
-from update_dataset import update_dataset
+from earthquake_data_layer import definitions, exceptions, settings
+from earthquake_data_layer.jobs import update_jobs
 
 INVALID_DATE_MASSAGE = f"Invalid date format, expecting {definitions.DATE_FORMAT}"
 
 update_router = APIRouter()
 
 
-@update_router.get(
-    "/update/{date}", description="used to initialize a data update run."
-)
-def update(date: str):
-    settings.logger.info(f"incoming get request at /collect/{date}")
+def verify_update_request(date: str):
+    """raises an HTTPException if the date is invalid, this process isn't the leader or the storage can't be reached"""
+    # the pipeline modules are imported by the first request that uses them
+    from earthquake_data_layer import helpers
+    from earthquake_data_layer.leases import leader_election
 
-    # verify input
     if not helpers.is_valid_date(date):
         settings.logger.critical(INVALID_DATE_MASSAGE)
         raise HTTPException(
@@ -26,20 +25,65 @@ def update(date: str):
             detail=INVALID_DATE_MASSAGE,
         )
 
-    if settings.INTEGRATION_TEST:
-        return {"result": "test_result", "status_code": status.HTTP_200_OK}
+    # only the leader writes, the other processes serve reads
+    if not settings.INTEGRATION_TEST and not leader_election.is_leader:
+        raise HTTPException(
+            status_code=definitions.HTTP_NOT_LEADER,
+            detail="Updates run on the leader, retry on another instance",
+        )
 
     # verify connection to storage
-    if not helpers.verify_storage_connection():
+    if not settings.INTEGRATION_TEST and not helpers.verify_storage_connection():
         raise HTTPException(
             status_code=definitions.HTTP_COULD_NOT_CONNECT_TO_STORAGE,
             detail="Could not connect to the cloud",
         )
 
+
+@update_router.post(
+    "/update",
+    status_code=status.HTTP_202_ACCEPTED,
+    description="submits a data update run, follow it at /jobs/{job_id}.",
+)
+def submit_update(date: str = Body(..., embed=True)):
+    settings.logger.info(f"incoming post request at /update for {date}")
+
+    verify_update_request(date)
+
+    if settings.INTEGRATION_TEST:
+        return {"result": "test_result", "status_code": status.HTTP_202_ACCEPTED}
+
+    last_date = datetime.datetime.strptime(date, definitions.DATE_FORMAT)
+    job = update_jobs.submit(last_date.year, last_date.month)
+    return {
+        "job_id": job.job_id,
+        "status": job.status,
+        "status_code": status.HTTP_202_ACCEPTED,
+    }
+
+
+@update_router.get(
+    "/update/{date}",
+    description="used to run a data update and wait for its result, prefer POST /update.",
+)
+def update(date: str):
+    from earthquake_data_layer.hot_store import hot_store
+    from earthquake_data_layer.leases import leading
+    from update_dataset import update_dataset
+
+    settings.logger.info(f"incoming get request at /collect/{date}")
+
+    # verify input
+    verify_update_request(date)
+
+    if settings.INTEGRATION_TEST:
+        return {"result": "test_result", "status_code": status.HTTP_200_OK}
+
     last_date = datetime.datetime.strptime(date, definitions.DATE_FORMAT)
 
     try:
-        result = update_dataset(last_date.year, last_date.month)
+        result = update_dataset(last_date.year, last_date.month, fence=leading)
+        hot_store.refresh()
         settings.logger.info("Success! returning results")
         return {"result": result, "status_code": status.HTTP_200_OK}
 
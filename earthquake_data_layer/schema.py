@@ -0,0 +1,82 @@
+import pandas as pd
+import pyarrow as pa
+
+from earthquake_data_layer import settings
+
+# the properties of a feature returned by the API, followed by the columns added in Fetcher.process
+RAW_DATA_SCHEMA = pa.schema(
+    [
+        ("mag", pa.float64()),
+        ("place", pa.string()),
+        ("time", pa.int64()),
+        ("updated", pa.int64()),
+        ("tz", pa.int32()),
+        ("url", pa.string()),
+        ("detail", pa.string()),
+        ("felt", pa.int64()),
+        ("cdi", pa.float64()),
+        ("mmi", pa.float64()),
+        ("alert", pa.string()),
+        ("status", pa.string()),
+        ("tsunami", pa.int64()),
+        ("sig", pa.int64()),
+        ("net", pa.string()),
+        ("code", pa.string()),
+        ("ids", pa.string()),
+        ("sources", pa.string()),
+        ("types", pa.string()),
+        ("nst", pa.int64()),
+        ("dmin", pa.float64()),
+        ("rms", pa.float64()),
+        ("gap", pa.float64()),
+        ("magType", pa.string()),
+        ("type", pa.string()),
+        ("title", pa.string()),
+        ("id", pa.string()),
+        ("longitude", pa.float64()),
+        ("latitude", pa.float64()),
+        ("depth", pa.float64()),
+        ("cell", pa.int64()),
+    ]
+)
+
+
+def conform_table(df: pd.DataFrame, schema: pa.Schema = RAW_DATA_SCHEMA) -> pa.Table:
+    """
+    Converts a DataFrame to a table with exactly the given schema, so files written at different times
+    can be summarized and concatenated without schema merges.
+    Missing columns are filled with nulls and columns that are not in the schema are dropped.
+
+    Parameters:
+    - df (pd.DataFrame): the data.
+    - schema (pa.Schema): the target schema, default to RAW_DATA_SCHEMA.
+
+    Returns:
+    pa.Table: the conformed table.
+    """
+    extra_columns = set(df.columns) - set(schema.names)
+    if extra_columns:
+        settings.logger.debug(f"dropping columns not in the schema: {extra_columns}")
+
+    arrays = [
+        pa.array(df[field.name], type=field.type, from_pandas=True)
+        if field.name in df.columns
+        else pa.nulls(len(df), type=field.type)
+        for field in schema
+    ]
+
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def cast_table(table: pa.Table, schema: pa.Schema = RAW_DATA_SCHEMA) -> pa.Table:
+    """
+    Casts a table read from any file to exactly the given schema, like conform_table but without a round trip
+    through pandas. Missing columns are filled with nulls and columns that are not in the schema are dropped.
+    """
+    arrays = [
+        table.column(field.name).cast(field.type)
+        if field.name in table.column_names
+        else pa.nulls(table.num_rows, type=field.type)
+        for field in schema
+    ]
+    return pa.Table.from_arrays(arrays, schema=schema)
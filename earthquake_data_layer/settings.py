@@ -17,10 +17,89 @@ load_dotenv()
 EARLIEST_EARTHQUAKE_DATE = "1900-01-01"
 # save the runs data every n months completed
 COLLECTION_BATCH_SIZE = 50
+# or every n seconds, whichever comes first
+COLLECTION_CHECKPOINT_SECONDS = 300
+# months fetched at the same time, a worker starts the next month as soon as it is done with one
+COLLECTION_WORKERS = 50
+# of the months in flight, how many query the API, process the responses and upload the data at the same time,
+# the others wait for their turn. processing runs in a pool of worker processes, 0 to process in the fetching thread
+COLLECTION_QUERY_WORKERS = 40
+COLLECTION_PROCESS_WORKERS = os.cpu_count() or 1
+COLLECTION_UPLOAD_WORKERS = 10
 SLEEP_EVERY_N_REQUESTS = 40
+# attempts to fetch a month in a run, a month that failed is fetched again after an exponential backoff (with jitter)
+# from COLLECTION_RETRY_BASE_DELAY up to COLLECTION_RETRY_MAX_DELAY seconds
+COLLECTION_MONTH_ATTEMPTS = 4
+COLLECTION_RETRY_BASE_DELAY = 30
+COLLECTION_RETRY_MAX_DELAY = 600
+# seconds before a failed collection is patched, once its months used their attempts
 COLLECTION_SLEEP_TIME = 3000
 # url to test proxy is working
 IP_VERIFYING_URL = "http://httpbin.org/ip"
+# keep the raw API responses of every fetched month, so the dataset can be reprocessed without the API
+ARCHIVE_RAW_RESPONSES = True
+# worker processes used to reprocess the archived responses
+REPROCESS_PROCESSES = os.cpu_count() or 1
+# an update always fetches the months of the last n months (and the current one), events are still revised there
+UPDATE_REVISION_MONTHS = 2
+# seconds a claim of a distributed collection (on a month, or to publish a checkpoint) is valid for, the holder renews
+# it every third of that. the months of a process that died are claimed by others once their claims expire
+COLLECTION_CLAIM_TTL = 300
+# seconds between checks of the months claimed by other processes, once a process has nothing else to fetch
+COLLECTION_CLAIM_POLL_INTERVAL = 60
+# seconds between attempts to publish a checkpoint while another process publishes one
+COLLECTION_PUBLISH_RETRY_INTERVAL = 2
+# seconds a process waits to publish a checkpoint before giving up on it, past the ttl of a claim left by a process
+# that died
+COLLECTION_PUBLISH_TIMEOUT = 2 * COLLECTION_CLAIM_TTL
+# attempts to save the collection metadata merged with the one saved by other processes meanwhile
+COLLECTION_METADATA_MERGE_RETRIES = 10
+
+
+""" Data Layout """
+# precision (bits per axis) of the spatial cell computed for every event
+SPATIAL_CELL_BITS = 16
+# max rows per parquet row group, smaller groups allow finer pruning by bbox and time
+RAW_DATA_ROW_GROUP_SIZE = 5000
+# months before this year are closed history, compacted into files of COMPACTION_PERIOD_YEARS years
+COMPACTION_CUTOFF_YEAR = 1970
+COMPACTION_PERIOD_YEARS = 10
+# a compacted period is split into files of about this size (bytes)
+COMPACTION_TARGET_FILE_SIZE = 128 * 1024 * 1024
+# attempts to update the compaction index when other processes update it at the same time
+COMPACTION_INDEX_RETRIES = 10
+# compacted files are read with ranged requests of at least this many bytes, only the planned row groups are downloaded
+RANGED_READ_BUFFER_SIZE = 1024 * 1024
+# attempts to commit a snapshot of the table when other writers commit concurrently
+TABLE_COMMIT_RETRIES = 10
+# number of (immutable) table data files kept in memory by the reader
+TABLE_FILE_CACHE_SIZE = 32
+# attempts to claim the next sequence number of a change set when other writers claim it concurrently
+CHANGELOG_WRITE_RETRIES = 10
+
+""" Feature Tensors """
+# precision (bits per axis) of the grid the feature tensors are aggregated to, 4 ** FEATURE_GRID_BITS cells
+FEATURE_GRID_BITS = 3
+# number of feature tensors versions kept in storage
+FEATURE_VERSIONS_KEPT = 3
+
+""" Service """
+# the last n months (and the current one) are kept in memory by the service to answer recent queries
+HOT_STORE_MONTHS = 3
+# update jobs running at the same time, the rest wait in the queue
+UPDATE_JOB_WORKERS = 1
+# number of finished update jobs whose reports are kept in memory
+UPDATE_JOBS_KEPT = 100
+# seconds a leader lease is valid for, the leader renews it every third of that
+LEADER_LEASE_TTL = 60
+# seconds between attempts of a follower to become the leader
+LEADER_RETRY_INTERVAL = 15
+# seconds between reloads of the hot store by followers, the leader reloads it after its own updates
+HOT_STORE_REFRESH_INTERVAL = 300
+# query results larger than this many bytes are streamed without being cached
+QUERY_CACHE_MAX_ENTRY_BYTES = 8 * 1024 * 1024
+# seconds between checks of the dataset version in storage, cached query results may lag writes by others this long
+QUERY_CACHE_REVALIDATE_INTERVAL = 5
 
 
 """ Quasi-unique ID Generations """
@@ -32,6 +111,14 @@ RANDOM_STRING_LENGTH_KEY = 5
 DATA_LAYER_ENDPOINT = os.getenv("DATA_LAYER_ENDPOINT", "localhost")
 DATA_LAYER_PORT = os.getenv("DATA_LAYER_PORT", "9000")
 
+# raw data layout, one of definitions.RAW_DATA_LAYOUTS or definitions.RAW_DATA_LAYOUT_TABLE
+RAW_DATA_LAYOUT = os.getenv("RAW_DATA_LAYOUT", "monthly")
+
+# max bytes of events held in memory by the service, the oldest hot months are dropped to fit
+HOT_STORE_MEMORY_BUDGET = int(os.getenv("HOT_STORE_MEMORY_BUDGET", 256 * 1024 * 1024))
+# max bytes of query results cached by the service, the least recently used results are evicted to fit
+QUERY_CACHE_MAX_BYTES = int(os.getenv("QUERY_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
 # aws
 AWS_S3_ENDPOINT = os.getenv("AWS_S3_ENDPOINT", None)
 AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID", None)
@@ -39,6 +126,14 @@ AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY", None)
 AWS_REGION = os.getenv("AWS_REGION", None)
 AWS_BUCKET_NAME = os.getenv("AWS_BUCKET_NAME", None)
 
+# elect a leader among the processes sharing the bucket (e.g. replicas or uvicorn workers), only the leader collects
+# and updates the dataset. needs a storage that enforces conditional writes, probed with an object under
+# definitions.LEASES_PREFIX. otherwise the process is the single writer and always leads
+LEADER_ELECTION = get_bool("LEADER_ELECTION")
+# collect the initial dataset with the other processes sharing the bucket (e.g. on other nodes), each fetches the
+# months it claims. otherwise only the leader collects
+DISTRIBUTED_COLLECTION = get_bool("DISTRIBUTED_COLLECTION")
+
 # testing
 INTEGRATION_TEST = get_bool("INTEGRATION_TEST")
 
@@ -0,0 +1,69 @@
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+
+import pyarrow as pa
+
+
+@dataclass(frozen=True)
+class SharedTable:
+    """
+    An Arrow table written as an IPC stream to a block of shared memory. The handle is all that is pickled between
+    processes, the table itself is written once by the worker and read once by the caller.
+    """
+
+    name: str
+    size: int
+
+
+def _write_stream(table: pa.Table, sink):
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    sink.close()
+
+
+def share_table(table: pa.Table) -> SharedTable:
+    """
+    Writes the table to a new block of shared memory, the block is freed by take_table.
+
+    Parameters:
+    - table (pa.Table): the table.
+
+    Returns:
+    SharedTable: the handle of the block.
+    """
+    sizer = pa.MockOutputStream()
+    _write_stream(table, sizer)
+    size = sizer.size()
+
+    block = shared_memory.SharedMemory(create=True, size=size)
+    try:
+        # the writer must not outlive the call, the block can't be closed while its memory is referenced
+        _write_stream(table, pa.FixedSizeBufferWriter(pa.py_buffer(block.buf)))
+    except Exception:
+        block.close()
+        block.unlink()
+        raise
+    block.close()
+    return SharedTable(block.name, size)
+
+
+def take_table(shared: SharedTable) -> pa.Table:
+    """
+    Reads a table written by share_table and frees its block of shared memory.
+
+    Parameters:
+    - shared (SharedTable): the handle of the block.
+
+    Returns:
+    pa.Table: the table.
+    """
+    block = shared_memory.SharedMemory(name=shared.name)
+    try:
+        # copied out of the block, so it is freed at once instead of living as long as the table
+        with block.buf[: shared.size] as view:
+            data = pa.py_buffer(bytes(view))
+    finally:
+        block.close()
+        block.unlink()
+
+    return pa.ipc.open_stream(data).read_all()
@@ -0,0 +1,94 @@
+import math
+from typing import Optional
+
+from earthquake_data_layer import settings
+
+# (min_longitude, min_latitude, max_longitude, max_latitude), the GeoJSON bbox order
+BBox = tuple[float, float, float, float]
+
+
+def _spread_bits(value: int) -> int:
+    """spreads the lower 32 bits of value so there is a zero bit between every two bits"""
+    value &= 0xFFFFFFFF
+    value = (value | (value << 16)) & 0x0000FFFF0000FFFF
+    value = (value | (value << 8)) & 0x00FF00FF00FF00FF
+    value = (value | (value << 4)) & 0x0F0F0F0F0F0F0F0F
+    value = (value | (value << 2)) & 0x3333333333333333
+    value = (value | (value << 1)) & 0x5555555555555555
+    return value
+
+
+def _quantize(value: float, lower: float, upper: float, bits: int) -> int:
+    """maps value from [lower, upper] to an integer in [0, 2**bits - 1]"""
+    num_cells = 1 << bits
+    index = int((value - lower) / (upper - lower) * num_cells)
+    return min(max(index, 0), num_cells - 1)
+
+
+def cell_id(
+    latitude: Optional[float],
+    longitude: Optional[float],
+    bits: int = settings.SPATIAL_CELL_BITS,
+) -> Optional[int]:
+    """
+    Compute the spatial cell of a coordinate.
+
+    The cell is an integer geohash: the longitude and latitude are quantized to {bits} bits each and interleaved
+    (Z-order), so cells that are numerically close are also close on the map and a parent cell is a prefix of
+    its children (cell >> 2 * k is the cell at bits - k).
+
+    Parameters:
+    - latitude (float): latitude in degrees.
+    - longitude (float): longitude in degrees.
+    - bits (int): the precision per axis, at most 31.
+
+    Returns:
+    Optional[int]: the cell id, or None if either coordinate is missing.
+    """
+    if latitude is None or longitude is None:
+        return None
+    if math.isnan(latitude) or math.isnan(longitude):
+        return None
+
+    latitude_index = _quantize(latitude, -90.0, 90.0, bits)
+    longitude_index = _quantize(longitude, -180.0, 180.0, bits)
+
+    return (_spread_bits(longitude_index) << 1) | _spread_bits(latitude_index)
+
+
+def bbox_contains(bbox: BBox, longitude, latitude):
+    """
+    Check which points fall inside a bbox, works for scalars and numpy/pandas arrays.
+    A bbox with min_longitude > max_longitude is treated as crossing the antimeridian.
+    """
+    min_longitude, min_latitude, max_longitude, max_latitude = bbox
+
+    in_latitude = (latitude >= min_latitude) & (latitude <= max_latitude)
+    if min_longitude <= max_longitude:
+        in_longitude = (longitude >= min_longitude) & (longitude <= max_longitude)
+    else:
+        in_longitude = (longitude >= min_longitude) | (longitude <= max_longitude)
+
+    return in_latitude & in_longitude
+
+
+def bbox_intersects(
+    bbox: BBox,
+    min_longitude: float,
+    min_latitude: float,
+    max_longitude: float,
+    max_latitude: float,
+) -> bool:
+    """checks if the bbox intersects the rectangle spanned by the given bounds"""
+    bbox_min_longitude, bbox_min_latitude, bbox_max_longitude, bbox_max_latitude = bbox
+
+    if max_latitude < bbox_min_latitude or min_latitude > bbox_max_latitude:
+        return False
+
+    if bbox_min_longitude <= bbox_max_longitude:
+        return not (
+            max_longitude < bbox_min_longitude or min_longitude > bbox_max_longitude
+        )
+
+    # crossing the antimeridian: [bbox_min_longitude, 180] or [-180, bbox_max_longitude]
+    return max_longitude >= bbox_min_longitude or min_longitude <= bbox_max_longitude
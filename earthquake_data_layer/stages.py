@@ -0,0 +1,122 @@
+import concurrent.futures
+import multiprocessing
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Optional
+
+from earthquake_data_layer import metrics, settings
+
+# the modules the worker processes import once, before they are forked
+PROCESS_WORKERS_PRELOAD = ["earthquake_data_layer.fetcher"]
+
+
+class Stage:
+    """
+    A step of the fetch pipeline that runs for at most `concurrency` months at a time, the other months wait for
+    a slot. The waiting months are the queue of the stage, it is bounded by the number of months in flight
+    (settings.COLLECTION_WORKERS), so a stage that falls behind holds the months before it.
+    """
+
+    def __init__(self, name: str, concurrency: int):
+        self.name = name
+        self.concurrency = concurrency
+        self.semaphore = threading.BoundedSemaphore(max(concurrency, 1))
+
+    @contextmanager
+    def slot(self):
+        """waits for a slot of the stage and holds it for the block"""
+        metrics.STAGE_QUEUE_DEPTH.inc(stage=self.name)
+        try:
+            self.semaphore.acquire()
+        finally:
+            metrics.STAGE_QUEUE_DEPTH.dec(stage=self.name)
+
+        metrics.STAGE_IN_PROGRESS.inc(stage=self.name)
+        try:
+            yield
+        finally:
+            metrics.STAGE_IN_PROGRESS.dec(stage=self.name)
+            self.semaphore.release()
+
+
+class FetchStages:
+    """
+    The stages of Fetcher.run_pipeline: querying the API (network), processing the responses (CPU) and uploading
+    the data (storage). Each stage has its own concurrency, so while some months are being queried others are
+    processed and uploaded, and all three are busy during a collection.
+    Processing runs in a pool of process_workers processes, so it isn't serialized with the other threads of the
+    collection. The workers are forked from a server process that imported the fetcher, not from the collecting
+    process and its threads.
+    """
+
+    def __init__(
+        self,
+        query_workers: int = settings.COLLECTION_QUERY_WORKERS,
+        process_workers: int = settings.COLLECTION_PROCESS_WORKERS,
+        upload_workers: int = settings.COLLECTION_UPLOAD_WORKERS,
+    ):
+        self.process_workers = process_workers
+        self.stages = {
+            "query": Stage("query", query_workers),
+            "process": Stage("process", process_workers),
+            "upload": Stage("upload", upload_workers),
+        }
+        self.executor: Optional[concurrent.futures.ProcessPoolExecutor] = None
+        self.executor_lock = threading.Lock()
+        # set in the worker processes of a pool by mark_worker_process
+        self.in_worker = False
+
+    def slot(self, stage: str):
+        return self.stages[stage].slot()
+
+    def _process_pool(self) -> concurrent.futures.ProcessPoolExecutor:
+        with self.executor_lock:
+            if self.executor is None:
+                method = (
+                    "forkserver"
+                    if "forkserver" in multiprocessing.get_all_start_methods()
+                    else "spawn"
+                )
+                context = multiprocessing.get_context(method)
+                if method == "forkserver":
+                    context.set_forkserver_preload(PROCESS_WORKERS_PRELOAD)
+                self.executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.process_workers,
+                    mp_context=context,
+                    initializer=mark_worker_process,
+                )
+            return self.executor
+
+    @property
+    def runs_inline(self) -> bool:
+        """whether run_in_process calls in this thread: there are no process workers or this is already a worker"""
+        return self.process_workers <= 0 or self.in_worker
+
+    def run_in_process(self, function: Callable, *args) -> Any:
+        """
+        Calls function(*args) in a worker process, or in this thread when there are no process workers or this is
+        already a worker process (e.g. of reprocess_dataset), see runs_inline. The function and its arguments must
+        be picklable.
+        """
+        if self.runs_inline:
+            return function(*args)
+        return self._process_pool().submit(function, *args).result()
+
+    def shutdown(self):
+        """stops the worker processes, a later call to run_in_process starts new ones"""
+        with self.executor_lock:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+
+
+# the stages shared by the fetchers of the process
+fetch_stages = FetchStages()
+
+
+def mark_worker_process():
+    """
+    The initializer of the pools' worker processes: their fetchers process in the worker itself. A process that
+    merely has a parent (e.g. a uvicorn worker) still processes in its pool.
+    """
+    fetch_stages.in_worker = True
@@ -2,12 +2,13 @@ import datetime
 import io
 import logging
 import os
+import threading
 from typing import Optional, Union
 
 import boto3
 from botocore.exceptions import ClientError
 
-from earthquake_data_layer import helpers, settings
+from earthquake_data_layer import definitions, metrics, settings
 from earthquake_data_layer.settings import (
     AWS_ACCESS_KEY_ID,
     AWS_BUCKET_NAME,
@@ -17,6 +18,53 @@ from earthquake_data_layer.settings import (
 )
 
 
+class RangedObjectReader(io.RawIOBase):
+    """
+    A read only, seekable file of an S3 object. Every read is a ranged GET of the requested bytes, so a reader
+    that seeks (e.g. to the footer and the row groups of a parquet file) downloads only what it reads.
+    """
+
+    def __init__(self, client, bucket_name: str, key: str, size: int):
+        super().__init__()
+        self.client = client
+        self.bucket_name = bucket_name
+        self.key = key
+        self.size = size
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.position = max(offset, 0)
+        return self.position
+
+    def readinto(self, buffer) -> int:
+        if self.position >= self.size or not len(buffer):
+            return 0
+
+        end = min(self.position + len(buffer), self.size)
+        content = self.client.get_object(
+            Bucket=self.bucket_name,
+            Key=self.key,
+            Range=f"bytes={self.position}-{end - 1}",
+        )["Body"].read()
+        metrics.STORAGE_DOWNLOADED_BYTES.inc(len(content))
+        buffer[: len(content)] = content
+        self.position += len(content)
+        return len(content)
+
+
 class Storage:
     """
     Class for handling S3 storage operations.
@@ -48,6 +96,20 @@ class Storage:
     - load_object(key: str, return_as_io: bool = True, destination_path: Optional[str] = None,
                   bucket_name: str = AWS_BUCKET_NAME, client: Optional[boto3.client] = None) -> Optional[Union[bool, io.BytesIO]]:
         Load an object from an S3 bucket.
+    - load_object_with_etag(key: str, bucket_name: str = AWS_BUCKET_NAME) -> tuple[Optional[bytes], Optional[str]]:
+        Load an object and its ETag from an S3 bucket.
+    - open_object(key: str, buffer_size: int = settings.RANGED_READ_BUFFER_SIZE,
+                  bucket_name: str = AWS_BUCKET_NAME) -> io.BufferedReader:
+        Open an object as a seekable file read with ranged requests.
+    - object_etag(key: str, bucket_name: str = AWS_BUCKET_NAME) -> Optional[str]:
+        Get the ETag of an object without loading it.
+    - enforces_conditional_writes(bucket_name: str = AWS_BUCKET_NAME) -> bool:
+        Probe once whether the server rejects conditional writes whose condition fails.
+    - save_object_conditional(file_source: bytes, key: str, if_match: Optional[str] = None,
+                              if_none_match: bool = False, bucket_name: str = AWS_BUCKET_NAME) -> bool:
+        Save an object only if it is unchanged since it was loaded / doesn't exist.
+    - remove_object_conditional(key: str, if_match: str, bucket_name: str = AWS_BUCKET_NAME) -> bool:
+        Remove an object only if it is unchanged since it was loaded.
 
     Example:
     storage = Storage()
@@ -59,6 +121,16 @@ class Storage:
     The class can be initialized with custom AWS credentials and endpoint URL.
     """
 
+    # serializes the conditional writes made by this process
+    conditional_write_lock = threading.Lock()
+    # the error codes of a conditional write whose condition failed
+    precondition_failed_codes = {
+        "PreconditionFailed",
+        "ConditionalRequestConflict",
+        "412",
+        "409",
+    }
+
     def __init__(self, **kwargs):
         """
         Initializes the Storage class.
@@ -88,6 +160,8 @@ class Storage:
                 region_name=self.region_name,
             )
         self.client = client
+        # the result of the conditional writes probe, None until it runs
+        self.conditional_writes_enforced: Optional[bool] = None
 
         settings.logger.info("initiated Storage")
 
@@ -146,8 +220,13 @@ class Storage:
         settings.logger.debug(f"listing objects with prefix {prefix}")
 
         bucket_name = bucket_name or self.bucket_name
-        response = self.client.list_objects(Bucket=bucket_name, Prefix=prefix)
-        return [obj["Key"] for obj in response.get("Contents", [])]
+        # a single response is limited to 1000 keys
+        paginator = self.client.get_paginator("list_objects")
+        return [
+            obj["Key"]
+            for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix)
+            for obj in page.get("Contents", [])
+        ]
 
     def remove_object(
         self,
@@ -210,13 +289,18 @@ class Storage:
                 if not key:
                     key = os.path.basename(file_source)
                 client.upload_file(file_source, bucket_name, key)
+                metrics.STORAGE_UPLOADED_BYTES.inc(os.path.getsize(file_source))
             elif isinstance(file_source, bytes):
                 if not key:
+                    # pylint: disable=import-outside-toplevel
+                    from earthquake_data_layer import helpers
+
                     random_string = helpers.random_string(
                         settings.RANDOM_STRING_LENGTH_KEY
                     )
                     key = f"{random_string}_{datetime.datetime.now().strftime('%Y-%m-%d_%H:%m:%S')}"
                 client.upload_fileobj(io.BytesIO(file_source), bucket_name, key)
+                metrics.STORAGE_UPLOADED_BYTES.inc(len(file_source))
             settings.logger.info(f"File uploaded successfully: {key}")
         except ClientError as e:
             settings.logger.error(f"Error uploading file: {e}")
@@ -256,6 +340,7 @@ class Storage:
             if return_as_io:
                 file_content = io.BytesIO()
                 client.download_fileobj(bucket_name, key, file_content)
+                metrics.STORAGE_DOWNLOADED_BYTES.inc(file_content.tell())
                 file_content.seek(0)
                 settings.logger.info(f"File downloaded successfully: {key}")
                 return file_content
@@ -272,3 +357,247 @@ class Storage:
             )
 
         return None
+
+    def open_object(
+        self,
+        key: str,
+        buffer_size: int = settings.RANGED_READ_BUFFER_SIZE,
+        bucket_name: Optional[str] = None,
+    ) -> io.BufferedReader:
+        """
+        Open an object as a seekable file without downloading it, its bytes are downloaded with ranged requests
+        of at least buffer_size bytes as they are read.
+
+        Parameters:
+        - key (str): The S3 object key.
+        - buffer_size (int): The minimal size of a request.
+        - bucket_name (str): The name of the bucket.
+
+        Returns:
+        - io.BufferedReader: the file.
+        """
+        bucket_name = bucket_name or self.bucket_name
+
+        try:
+            size = self.client.head_object(Bucket=bucket_name, Key=key)["ContentLength"]
+        except ClientError as error:
+            if error.response["Error"]["Code"] in {"NoSuchKey", "404"}:
+                raise FileNotFoundError(
+                    f"no object found under the key {key}"
+                ) from error
+            raise
+
+        return io.BufferedReader(
+            RangedObjectReader(self.client, bucket_name, key, size), buffer_size
+        )
+
+    def load_object_with_etag(
+        self, key: str, bucket_name: Optional[str] = None
+    ) -> tuple[Optional[bytes], Optional[str]]:
+        """
+        Load an object and its ETag from an S3 bucket, to be used with save_object_conditional.
+
+        Parameters:
+        - key (str): The S3 object key.
+        - bucket_name (str): The name of the bucket.
+
+        Returns:
+        - tuple[Optional[bytes], Optional[str]]: the content and the ETag, (None, None) if the object doesn't exist.
+        """
+        bucket_name = bucket_name or self.bucket_name
+
+        try:
+            response = self.client.get_object(Bucket=bucket_name, Key=key)
+            content = response["Body"].read()
+            metrics.STORAGE_DOWNLOADED_BYTES.inc(len(content))
+            return content, response["ETag"]
+        except ClientError as error:
+            if error.response["Error"]["Code"] in {"NoSuchKey", "404"}:
+                return None, None
+            raise
+
+    def object_etag(self, key: str, bucket_name: Optional[str] = None) -> Optional[str]:
+        """returns the ETag of an object (a HEAD request), None if it doesn't exist"""
+        bucket_name = bucket_name or self.bucket_name
+
+        try:
+            return self.client.head_object(Bucket=bucket_name, Key=key)["ETag"]
+        except ClientError as error:
+            if error.response["Error"]["Code"] in {"NoSuchKey", "404"}:
+                return None
+            raise
+
+    @property
+    def supports_conditional_writes(self) -> bool:
+        """checks if the client knows the S3 conditional writes parameters"""
+        members = self.client.meta.service_model.operation_model(
+            "PutObject"
+        ).input_shape.members
+        return "IfMatch" in members and "IfNoneMatch" in members
+
+    def enforces_conditional_writes(self, bucket_name: Optional[str] = None) -> bool:
+        """
+        Probes once whether the server enforces conditional writes: a PUT with IfNoneMatch on an existing object
+        and one with a stale IfMatch must both be rejected. Knowing the parameters isn't enough, servers that
+        accept and ignore them let two processes hold the same lease. The probe writes (and leaves) the empty object
+        definitions.CONDITIONAL_WRITES_PROBE_KEY in the bucket. Errors are raised and not remembered, the probe runs
+        again on the next call.
+
+        Parameters:
+        - bucket_name (str): The name of the bucket.
+
+        Returns:
+        - bool: True if the server rejected both writes, False otherwise.
+        """
+        if self.conditional_writes_enforced is not None:
+            return self.conditional_writes_enforced
+
+        bucket_name = bucket_name or self.bucket_name
+        key = definitions.CONDITIONAL_WRITES_PROBE_KEY
+
+        def rejected(**conditions) -> bool:
+            try:
+                self.client.put_object(
+                    Bucket=bucket_name, Key=key, Body=b"", **conditions
+                )
+            except ClientError as error:
+                if error.response["Error"]["Code"] in self.precondition_failed_codes:
+                    return True
+                raise
+            return False
+
+        enforced = self.supports_conditional_writes
+        if enforced:
+            self.client.put_object(Bucket=bucket_name, Key=key, Body=b"")
+            enforced = rejected(IfNoneMatch="*") and rejected(
+                IfMatch='"conditional-writes-probe"'
+            )
+        if not enforced:
+            settings.logger.critical(
+                "the storage doesn't enforce conditional writes, leases can't be held, unset LEADER_ELECTION to "
+                "run a single writer"
+            )
+
+        self.conditional_writes_enforced = enforced
+        return enforced
+
+    def _atomic_across_processes(self, key: str, bucket_name: str) -> bool:
+        """False if the processes sharing the bucket can't change the key atomically, the change is then refused"""
+        try:
+            shared = settings.LEADER_ELECTION or settings.DISTRIBUTED_COLLECTION
+            if shared and not self.enforces_conditional_writes(bucket_name):
+                settings.logger.critical(
+                    f"{key}: the processes sharing the bucket can't change it atomically, refused"
+                )
+                return False
+        except ClientError as error:
+            settings.logger.error(f"Error probing conditional writes: {error}")
+            return False
+        return True
+
+    def save_object_conditional(
+        self,
+        file_source: bytes,
+        key: str,
+        if_match: Optional[str] = None,
+        if_none_match: bool = False,
+        bucket_name: Optional[str] = None,
+    ) -> bool:
+        """
+        Save an object only if it wasn't changed since it was loaded (if_match) or if it doesn't exist
+        (if_none_match). The condition is checked against the current ETag under a process wide lock, and is also
+        sent to S3 when the client supports conditional writes, so writers in other processes are detected by the
+        servers that implement them. On a server that doesn't enforce the conditions the check-then-put is atomic
+        within this process only: the writes are refused when processes share the bucket (settings.LEADER_ELECTION
+        or settings.DISTRIBUTED_COLLECTION), see enforces_conditional_writes.
+
+        Parameters:
+        - file_source (bytes): The content of the object.
+        - key (str): The S3 object key.
+        - if_match (str, optional): The ETag the object should still have.
+        - if_none_match (bool, optional): If True, the object should not exist.
+        - bucket_name (str): The name of the bucket.
+
+        Returns:
+        - bool: True if the object was saved, False if the condition failed or an error occurred.
+        """
+        bucket_name = bucket_name or self.bucket_name
+
+        if not self._atomic_across_processes(key, bucket_name):
+            return False
+
+        conditions = dict()
+        if self.supports_conditional_writes:
+            if if_match:
+                conditions["IfMatch"] = if_match
+            if if_none_match:
+                conditions["IfNoneMatch"] = "*"
+
+        with self.conditional_write_lock:
+            try:
+                current_etag = self.object_etag(key, bucket_name)
+                if (if_match and current_etag != if_match) or (
+                    if_none_match and current_etag is not None
+                ):
+                    settings.logger.info(f"{key} was modified, not saving")
+                    return False
+
+                self.client.put_object(
+                    Bucket=bucket_name, Key=key, Body=file_source, **conditions
+                )
+            except ClientError as error:
+                if error.response["Error"]["Code"] in self.precondition_failed_codes:
+                    settings.logger.info(f"{key} was modified, not saving")
+                else:
+                    settings.logger.error(f"Error uploading file: {error}")
+                return False
+
+        settings.logger.info(f"File uploaded successfully: {key}")
+        return True
+
+    def remove_object_conditional(
+        self, key: str, if_match: str, bucket_name: Optional[str] = None
+    ) -> bool:
+        """
+        Remove an object only if it wasn't changed since it was loaded, e.g. a file that was rewritten since is kept.
+        Like save_object_conditional, the ETag is checked under a process wide lock and is also sent to S3 when the
+        client supports conditional deletes, on a server that doesn't enforce it the removal is atomic within this
+        process only.
+
+        Parameters:
+        - key (str): The S3 object key.
+        - if_match (str): The ETag the object should still have.
+        - bucket_name (str): The name of the bucket.
+
+        Returns:
+        - bool: True if the object was removed, False if it changed, doesn't exist or an error occurred.
+        """
+        bucket_name = bucket_name or self.bucket_name
+        if not self._atomic_across_processes(key, bucket_name):
+            return False
+
+        conditions = dict()
+        if (
+            "IfMatch"
+            in self.client.meta.service_model.operation_model(
+                "DeleteObject"
+            ).input_shape.members
+        ):
+            conditions["IfMatch"] = if_match
+
+        with self.conditional_write_lock:
+            try:
+                if self.object_etag(key, bucket_name) != if_match:
+                    settings.logger.info(f"{key} was modified, not removing")
+                    return False
+
+                self.client.delete_object(Bucket=bucket_name, Key=key, **conditions)
+            except ClientError as error:
+                if error.response["Error"]["Code"] in self.precondition_failed_codes:
+                    settings.logger.info(f"{key} was modified, not removing")
+                else:
+                    settings.logger.error(f"Error removing object: {error}")
+                return False
+
+        settings.logger.info(f"Object removed successfully: {key}")
+        return True
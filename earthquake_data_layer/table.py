@@ -0,0 +1,213 @@
+import copy
+import datetime
+import hashlib
+import io
+import json
+import threading
+from collections import OrderedDict
+from typing import Optional, Union
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from earthquake_data_layer import definitions, settings
+from earthquake_data_layer.catalog import column_ranges
+from earthquake_data_layer.helpers import random_string
+from earthquake_data_layer.storage import Storage
+
+# the columns whose min/max are recorded in the manifest
+STATISTICS_COLUMNS = ["time", "latitude", "longitude", "depth", "mag"]
+
+EMPTY_MANIFEST = {"snapshot_id": 0, "parent_id": None, "files": {}}
+
+# data files are immutable, the most recently loaded are kept in memory
+data_file_cache: OrderedDict[str, bytes] = OrderedDict()
+data_file_cache_lock = threading.Lock()
+
+
+def data_file_key(data: bytes, year: Union[str, int]) -> str:
+    """the content addressed key of a data file, a file is never overwritten with different content"""
+    return f"{definitions.TABLE_DATA_PREFIX}/{year}/{hashlib.sha256(data).hexdigest()}.parquet"
+
+
+def file_entry(key: str, file_metadata: pq.FileMetaData, size: int) -> dict:
+    """
+    Describes a data file in the manifest: its key, size, row count and min/max statistics, both for the whole
+    file and per row group, so scans can be planned without reading the footers.
+    """
+    row_groups = list()
+    for index in range(file_metadata.num_row_groups):
+        row_group = file_metadata.row_group(index)
+        row_groups.append(
+            {
+                "row_count": row_group.num_rows,
+                "stats": {
+                    column: list(value_range)
+                    for column, value_range in column_ranges(
+                        row_group, STATISTICS_COLUMNS
+                    ).items()
+                },
+            }
+        )
+
+    stats = dict()
+    for row_group in row_groups:
+        for column, (min_value, max_value) in row_group["stats"].items():
+            if column in stats:
+                min_value = min(min_value, stats[column][0])
+                max_value = max(max_value, stats[column][1])
+            stats[column] = [min_value, max_value]
+
+    return {
+        "key": key,
+        "size": size,
+        "row_count": file_metadata.num_rows,
+        "stats": stats,
+        "row_groups": row_groups,
+    }
+
+
+def write_data_file(
+    table: pa.Table, year: Union[str, int], storage: Optional[Storage] = None
+) -> Optional[dict]:
+    """
+    Writes a table to an immutable, content addressed data file. The file is not committed to the table, pass the
+    returned entry to commit().
+
+    Returns:
+    Optional[dict]: the manifest entry of the file, None if the upload failed.
+    """
+    if storage is None:
+        storage = Storage()
+
+    writer = pa.BufferOutputStream()
+    pq.write_table(table, writer, row_group_size=settings.RAW_DATA_ROW_GROUP_SIZE)
+    data = bytes(writer.getvalue())
+    key = data_file_key(data, year)
+
+    # identical content was already written
+    if storage.object_etag(key) is None and not storage.save_object(data, key):
+        return None
+
+    return file_entry(key, pq.read_metadata(pa.BufferReader(data)), len(data))
+
+
+def load_data_file(key: str, storage: Optional[Storage] = None) -> io.BytesIO:
+    """loads a data file, the last settings.TABLE_FILE_CACHE_SIZE loaded files are served from memory"""
+    with data_file_cache_lock:
+        if key in data_file_cache:
+            data_file_cache.move_to_end(key)
+            return io.BytesIO(data_file_cache[key])
+
+    if storage is None:
+        storage = Storage()
+    data = storage.load_object(key).read()
+
+    with data_file_cache_lock:
+        data_file_cache[key] = data
+        while len(data_file_cache) > settings.TABLE_FILE_CACHE_SIZE:
+            data_file_cache.popitem(last=False)
+
+    return io.BytesIO(data)
+
+
+def load_pointer(
+    storage: Optional[Storage] = None,
+) -> tuple[Optional[dict], Optional[str]]:
+    """loads the pointer to the current snapshot and its ETag, (None, None) before the first commit"""
+    if storage is None:
+        storage = Storage()
+
+    content, etag = storage.load_object_with_etag(definitions.TABLE_POINTER_KEY)
+    if content is None:
+        return None, None
+    return json.loads(content.decode("utf-8")), etag
+
+
+def load_snapshot(storage: Optional[Storage] = None) -> dict:
+    """
+    Loads the manifest of the current snapshot:
+    {"snapshot_id": int, "parent_id": int, "committed_at": str, "files": {"YYYY-MM": file_entry}}
+    """
+    if storage is None:
+        storage = Storage()
+
+    pointer, _ = load_pointer(storage)
+    if pointer is None:
+        return copy.deepcopy(EMPTY_MANIFEST)
+
+    return json.loads(
+        storage.load_object(pointer["manifest_key"]).read().decode("utf-8")
+    )
+
+
+def commit(
+    added: dict[str, dict],
+    storage: Optional[Storage] = None,
+    removed: Optional[list[str]] = None,
+) -> Optional[dict]:
+    """
+    Commits a new snapshot: writes a manifest with the files of the current snapshot, replaced by added and without
+    removed, then swaps the pointer to it only if no other snapshot was committed meanwhile. When it was, the
+    changes are applied again on top of the newer snapshot, up to settings.TABLE_COMMIT_RETRIES times.
+    Across processes the swap is atomic only on a storage that enforces conditional writes, see
+    Storage.save_object_conditional.
+
+    Parameters:
+    - added (dict[str, dict]): {"YYYY-MM": file_entry} of the months that were written.
+    - storage (Storage): a Storage object, optional.
+    - removed (list[str]): "YYYY-MM" of months to remove from the table, optional.
+
+    Returns:
+    Optional[dict]: the committed manifest, None if the commit failed.
+    """
+    if storage is None:
+        storage = Storage()
+
+    for _ in range(settings.TABLE_COMMIT_RETRIES):
+        pointer, etag = load_pointer(storage)
+        base = (
+            json.loads(
+                storage.load_object(pointer["manifest_key"]).read().decode("utf-8")
+            )
+            if pointer
+            else copy.deepcopy(EMPTY_MANIFEST)
+        )
+
+        files = {**base["files"], **added}
+        for label in removed or []:
+            files.pop(label, None)
+
+        snapshot_id = base["snapshot_id"] + 1
+        manifest = {
+            "snapshot_id": snapshot_id,
+            "parent_id": base["snapshot_id"] or None,
+            "committed_at": datetime.datetime.now().isoformat(),
+            "files": files,
+        }
+        manifest_key = (
+            f"{definitions.TABLE_MANIFESTS_PREFIX}/"
+            f"{snapshot_id:012d}-{random_string(settings.RANDOM_STRING_LENGTH_KEY)}.json"
+        )
+        if not storage.save_object(json.dumps(manifest).encode("utf-8"), manifest_key):
+            return None
+
+        new_pointer = {"snapshot_id": snapshot_id, "manifest_key": manifest_key}
+        if storage.save_object_conditional(
+            json.dumps(new_pointer).encode("utf-8"),
+            definitions.TABLE_POINTER_KEY,
+            if_match=etag,
+            if_none_match=etag is None,
+        ):
+            settings.logger.info(
+                f"committed snapshot {snapshot_id} ({len(added)} month(s) added)"
+            )
+            return manifest
+
+        settings.logger.info(
+            f"snapshot {snapshot_id} was committed by another writer, retrying"
+        )
+        storage.remove_object(manifest_key)
+
+    settings.logger.error("couldn't commit the snapshot")
+    return None
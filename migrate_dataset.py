@@ -0,0 +1,89 @@
+from typing import Optional
+
+import pandas as pd
+
+from earthquake_data_layer import Storage, definitions, helpers, settings
+from earthquake_data_layer.catalog import update_dataset_summary
+from earthquake_data_layer.schema import RAW_DATA_SCHEMA
+from earthquake_data_layer.spatial import cell_id
+
+LOG_MESSAGE_MIGRATION_START = "migrating {} monthly file(s) to the hive layout"
+LOG_MESSAGE_MIGRATION_DONE = "migrated {} file(s), {} failed"
+
+
+def migrate_to_hive(
+    storage: Optional[Storage] = None, remove_old: bool = False
+) -> dict:
+    """
+    Rewrites the files of the monthly layout (data/raw_data/{year}/{year}_{month}_raw_data.parquet)
+    in the hive layout (data/raw_data/year={year}/month={month}/part-0.parquet), conformed to the raw data
+    schema and sorted by spatial cell, then builds the dataset _metadata and _common_metadata summary.
+
+    Args:
+        storage (Storage): a Storage object, optional.
+        remove_old (bool): if to remove the monthly files that were migrated, default to False.
+
+    Returns:
+        dict: {"migrated": [keys], "failed": [keys]}
+    """
+    if storage is None:
+        storage = Storage()
+
+    monthly_keys = [
+        key
+        for key in storage.list_objects(prefix=f"{definitions.RAW_DATA_PREFIX}/")
+        if helpers.parse_raw_data_key(key, layout=definitions.RAW_DATA_LAYOUT_MONTHLY)
+    ]
+    settings.logger.info(LOG_MESSAGE_MIGRATION_START.format(len(monthly_keys)))
+
+    result = {"migrated": [], "failed": []}
+    written_files = dict()
+    for key in monthly_keys:
+        year, month = helpers.parse_raw_data_key(key)
+        new_key = helpers.generate_raw_data_key_from_date(
+            year, month, layout=definitions.RAW_DATA_LAYOUT_HIVE
+        )
+
+        df = pd.read_parquet(storage.load_object(key))
+        # files written before the spatial cell was added
+        if "cell" not in df and {"latitude", "longitude"}.issubset(df.columns):
+            df["cell"] = [
+                cell_id(latitude, longitude)
+                for latitude, longitude in zip(df["latitude"], df["longitude"])
+            ]
+        sort_columns = [
+            column for column in definitions.RAW_DATA_SORT_COLUMNS if column in df
+        ]
+        if sort_columns:
+            df = df.sort_values(sort_columns, kind="stable", ignore_index=True)
+
+        metadata_collector = list()
+        if helpers.upload_df(
+            df,
+            new_key,
+            storage,
+            row_group_size=settings.RAW_DATA_ROW_GROUP_SIZE,
+            schema=RAW_DATA_SCHEMA,
+            metadata_collector=metadata_collector,
+        ):
+            written_files[new_key] = metadata_collector[0]
+            result["migrated"].append(key)
+        else:
+            result["failed"].append(key)
+
+    update_dataset_summary(written_files, storage)
+
+    if remove_old:
+        for key in result["migrated"]:
+            storage.remove_object(key)
+
+    settings.logger.info(
+        LOG_MESSAGE_MIGRATION_DONE.format(
+            len(result["migrated"]), len(result["failed"])
+        )
+    )
+    return result
+
+
+if __name__ == "__main__":
+    migrate_to_hive()
@@ -0,0 +1,137 @@
+import concurrent.futures
+import datetime
+from typing import Optional
+
+from earthquake_data_layer import (
+    Fetcher,
+    Storage,
+    archive,
+    definitions,
+    helpers,
+    settings,
+    stages,
+)
+
+LOG_MESSAGE_REPROCESS_START = "reprocessing {} month(s) with {} process(es)"
+LOG_MESSAGE_MONTH_FAILED = "{}-{}: failed to reprocess, status: {}"
+LOG_MESSAGE_REPROCESS_DONE = "reprocessed {} month(s), {} failed"
+
+
+def reprocess_month(
+    year: int, month: int, storage: Optional[Storage] = None
+) -> tuple[dict, Fetcher]:
+    """
+    Rebuilds a month from its archived responses: the responses are processed again and replace the stored rows
+    of the month. Nothing is fetched from the API.
+
+    Returns:
+    tuple[dict, Fetcher]: the result (like Fetcher.fetch_data) and the fetcher, without its responses.
+    """
+    fetcher = Fetcher(*helpers.get_month_start_end_dates(year, month))
+    fetcher.metadata = {
+        "start_date": fetcher.start_date,
+        "end_date": fetcher.end_date,
+        "execution_date": definitions.TODAY,
+    }
+
+    try:
+        fetcher.responses = archive.read_archive(year, month, storage)
+    except FileNotFoundError:
+        fetcher.metadata.update(
+            {"status": definitions.STATUS_PROCESS_FAIL, "error": True}
+        )
+        return fetcher.metadata, fetcher
+
+    for step in (fetcher.process, lambda: fetcher.upload_data(replace=True)):
+        fetcher.metadata.update(step())
+        if fetcher.metadata.get("error"):
+            break
+
+    # the responses are not needed by the caller, don't send them back from the worker process
+    fetcher.responses = None
+    return fetcher.metadata, fetcher
+
+
+def _reprocess_month(month: tuple[int, int]) -> tuple[dict, Fetcher]:
+    """the entry point of the worker processes"""
+    return reprocess_month(*month)
+
+
+def reprocess_dataset(
+    months: Optional[list[tuple[int, int]]] = None,
+    processes: int = settings.REPROCESS_PROCESSES,
+    storage: Optional[Storage] = None,
+) -> dict:
+    """
+    Rebuilds the processed data from the archived API responses, e.g. after Fetcher.process or the schema changed.
+    The months are processed in parallel worker processes and published in batches of
+    settings.COLLECTION_BATCH_SIZE like a collection (summary/snapshot, aggregates and change sets).
+
+    Parameters:
+    - months (list[tuple[int, int]]): the (year, month) to rebuild, default to every archived month.
+    - processes (int): number of worker processes, 1 to reprocess in this process.
+    - storage (Storage): a Storage object, optional.
+
+    Returns:
+    dict: {"reprocessed": [YYYY-MM, ...], "failed": [YYYY-MM, ...], "change_sets": [sequence, ...]}
+    """
+    if storage is None:
+        storage = Storage()
+    if months is None:
+        months = archive.archived_months(storage)
+
+    settings.logger.info(LOG_MESSAGE_REPROCESS_START.format(len(months), processes))
+
+    run_id = f"{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}-{helpers.random_string(settings.RANDOM_STRING_LENGTH_KEY)}"
+    summary = {"reprocessed": [], "failed": [], "change_sets": []}
+
+    executor = (
+        concurrent.futures.ProcessPoolExecutor(
+            max_workers=processes, initializer=stages.mark_worker_process
+        )
+        if processes > 1
+        else None
+    )
+    try:
+        for start in range(0, len(months), settings.COLLECTION_BATCH_SIZE):
+            batch_months = months[start : start + settings.COLLECTION_BATCH_SIZE]
+            if executor is None:
+                outputs = [reprocess_month(*month, storage) for month in batch_months]
+            else:
+                outputs = list(executor.map(_reprocess_month, batch_months))
+            results = [result for result, _ in outputs]
+
+            sequence = helpers.publish_batch(
+                batch_months,
+                [fetcher for _, fetcher in outputs],
+                results,
+                run_id,
+                storage,
+            )
+            if sequence is not None:
+                summary["change_sets"].append(sequence)
+
+            for result, (year, month) in zip(results, batch_months):
+                if result.get("status") == definitions.STATUS_UPLOAD_DATA_SUCCESS:
+                    summary["reprocessed"].append(helpers.month_label(year, month))
+                else:
+                    settings.logger.error(
+                        LOG_MESSAGE_MONTH_FAILED.format(
+                            year, month, result.get("status")
+                        )
+                    )
+                    summary["failed"].append(helpers.month_label(year, month))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    settings.logger.info(
+        LOG_MESSAGE_REPROCESS_DONE.format(
+            len(summary["reprocessed"]), len(summary["failed"])
+        )
+    )
+    return summary
+
+
+if __name__ == "__main__":
+    reprocess_dataset()
@@ -0,0 +1,206 @@
+# pylint: disable=redefined-outer-name
+from unittest.mock import Mock, patch
+
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from earthquake_data_layer import aggregates, definitions, reader
+from earthquake_data_layer.helpers import (
+    add_rows_to_parquet,
+    generate_raw_data_key_from_date,
+)
+from earthquake_data_layer.reader import to_epoch_ms
+
+
+def make_event(event_id, date, mag, depth=10.0, cell=1):
+    return {
+        "id": event_id,
+        "time": to_epoch_ms(date) + 1000,
+        "mag": mag,
+        "depth": depth,
+        "cell": cell,
+    }
+
+
+@pytest.fixture
+def march():
+    # 2021-03-29 is a monday, the week continues into april
+    return [
+        make_event("a", "2021-03-29", 4.0, depth=5.0),
+        make_event("b", "2021-03-30", 5.0, depth=15.0),
+        make_event("c", "2021-03-30", 3.0, cell=2),
+        make_event("d", "2021-03-22", None),
+    ]
+
+
+@pytest.fixture
+def april():
+    return [make_event("e", "2021-04-02", 6.0, depth=30.0)]
+
+
+def test_week_start():
+    monday = to_epoch_ms("2021-03-29")
+    times = pd.Series([monday, monday + 1, to_epoch_ms("2021-04-04")])
+    assert aggregates.week_start(times).tolist() == [monday] * 3
+
+
+def test_month_partials(march):
+    partials = aggregates.month_partials(march, "2021-03")
+
+    assert list(partials.columns) == aggregates.WEEKLY_AGGREGATES_SCHEMA.names
+    assert len(partials) == 3
+    row = partials[
+        (partials["week_start"] == to_epoch_ms("2021-03-29")) & (partials["cell"] == 1)
+    ].iloc[0]
+    assert row["count"] == 2
+    assert row["mag_max"] == 5.0
+    assert row["depth_min"] == 5.0
+    assert row["energy_sum"] == pytest.approx(10**10.8 + 10**12.3)
+
+    # events without a magnitude are counted but not in the magnitude stats
+    row = partials[partials["week_start"] == to_epoch_ms("2021-03-22")].iloc[0]
+    assert row["count"] == 1
+    assert row["mag_count"] == 0
+
+
+def test_weeks_spanning_months(storage, march, april):
+    assert aggregates.update_weekly_aggregates(
+        {
+            "2021-03": aggregates.month_partials(march, "2021-03"),
+            "2021-04": aggregates.month_partials(april, "2021-04"),
+        },
+        storage,
+    )
+
+    weekly = aggregates.load_weekly_aggregates(
+        "2021-03-29", "2021-04-30", cells=[1], storage=storage
+    )
+    assert len(weekly) == 1
+    row = weekly.iloc[0]
+    assert row["week_start"] == to_epoch_ms("2021-03-29")
+    assert row["count"] == 3
+    assert row["mag_max"] == 6.0
+    assert row["mag_mean"] == 5.0
+    assert row["depth_mean"] == pytest.approx(50 / 3)
+
+
+def test_incremental_update(storage, march, april):
+    aggregates.update_weekly_aggregates(
+        {
+            "2021-03": aggregates.month_partials(march, "2021-03"),
+            "2021-04": aggregates.month_partials(april, "2021-04"),
+        },
+        storage,
+    )
+
+    # april is rewritten, march's rows are kept as they are
+    april.append(make_event("f", "2021-04-01", 2.0))
+    assert aggregates.update_weekly_aggregates(
+        {"2021-04": aggregates.month_partials(april, "2021-04")}, storage
+    )
+
+    partials = aggregates.load_partials(storage)
+    assert partials[partials["month"] == "2021-03"]["count"].sum() == 4
+    assert partials[partials["month"] == "2021-04"]["count"].sum() == 2
+    assert storage.list_objects(prefix=definitions.AGGREGATES_PREFIX) == [
+        definitions.WEEKLY_AGGREGATES_KEY
+    ]
+
+
+def test_no_aggregates(storage):
+    assert aggregates.load_weekly_aggregates(storage=storage).empty
+
+
+def test_aggregate_tables(march, april):
+    tables = [pa.Table.from_pylist(march), pa.Table.from_pylist(april)]
+
+    result = aggregates.aggregate_tables(tables, "week")
+    assert result.to_pylist() == [
+        {
+            "time_bucket": to_epoch_ms("2021-03-22"),
+            "count": 1,
+            "mag_max": None,
+            "mag_mean": None,
+        },
+        {
+            "time_bucket": to_epoch_ms("2021-03-29"),
+            "count": 4,
+            "mag_max": 6.0,
+            "mag_mean": 4.5,
+        },
+    ]
+
+    # the same week split by magnitude bins of 2, the cells are coarsened to a single cell
+    result = aggregates.aggregate_tables(tables, "week", cell_bits=0, mag_bin=2.0)
+    assert [
+        (row["mag_bin"], row["cell"], row["count"])
+        for row in result.to_pylist()
+        if row["time_bucket"] == to_epoch_ms("2021-03-29")
+    ] == [(2.0, 0, 1), (4.0, 0, 2), (6.0, 0, 1)]
+
+
+def test_aggregate_days_and_months(march, april):
+    tables = [pa.Table.from_pylist(march + april)]
+
+    days = aggregates.aggregate_tables(tables, "day")
+    assert days.column("count").to_pylist() == [1, 1, 2, 1]
+
+    months = aggregates.aggregate_tables(tables, "month")
+    assert months.column("time_bucket").to_pylist() == [
+        to_epoch_ms("2021-03-01"),
+        to_epoch_ms("2021-04-01"),
+    ]
+    assert months.column("count").to_pylist() == [4, 1]
+
+
+def test_aggregate_nothing():
+    result = aggregates.aggregate_tables([], "day", cell_bits=4, mag_bin=1.0)
+    assert result.num_rows == 0
+    assert result.column_names == [
+        "time_bucket",
+        "cell",
+        "mag_bin",
+        "count",
+        "mag_max",
+        "mag_mean",
+    ]
+
+
+def test_aggregate_events_reads_needed_columns(storage, march):
+    assert add_rows_to_parquet(
+        march, generate_raw_data_key_from_date(2021, 3), storage=storage
+    )
+
+    with patch(
+        "earthquake_data_layer.reader.read_parquet_filtered",
+        wraps=reader.read_parquet_filtered,
+    ) as mock_read:
+        result = aggregates.aggregate_events(
+            "2021-03-29",
+            "2021-03-31",
+            bucket="day",
+            mag_range=(3.5, 10),
+            storage=storage,
+        )
+
+    assert mock_read.call_args.args[3] == aggregates.AGGREGATE_INPUT_COLUMNS
+    assert result.column("count").to_pylist() == [1, 1]
+
+
+def test_aggregate_events_from_hot_store(march):
+    hot_store = Mock()
+    hot_store.query.return_value = pa.Table.from_pylist(march).select(
+        aggregates.AGGREGATE_INPUT_COLUMNS
+    )
+
+    with patch("earthquake_data_layer.hot_store.hot_store", hot_store), patch(
+        "earthquake_data_layer.aggregates.scan_events"
+    ) as mock_scan:
+        result = aggregates.aggregate_events("2021-03-29", "2021-03-31", "day")
+
+    mock_scan.assert_not_called()
+    assert hot_store.query.call_args.args[0] == reader.time_range_of(
+        "2021-03-29", "2021-03-31"
+    )
+    assert result.column("count").to_pylist() == [1, 1, 2]
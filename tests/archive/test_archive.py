@@ -0,0 +1,41 @@
+# pylint: disable=unused-import,redefined-outer-name
+import json
+
+from earthquake_data_layer import archive, definitions
+from tests.fetcher.conftest import (
+    data_point_1,
+    data_point_2,
+    first_response_content,
+    last_response_content,
+    mock_response_data,
+)
+
+
+def test_round_trip(storage, first_response_content, last_response_content):
+    responses = [first_response_content, last_response_content]
+
+    key = archive.write_archive(responses, "2021", "03", storage)
+    assert (
+        key == f"{definitions.RAW_RESPONSES_PREFIX}/2021/2021_03_responses.ndjson.zst"
+    )
+    assert archive.read_archive(2021, 3, storage) == responses
+
+    # the archive is compressed
+    assert storage.load_object(key).read()[:4] == b"\x28\xb5\x2f\xfd"
+
+
+def test_raw_bodies(storage, last_response_content):
+    # a page as queried, the newlines between its tokens don't split the line
+    body = json.dumps(last_response_content, indent=2).encode("utf-8")
+    assert b"\n" in body
+
+    archive.write_archive([body, last_response_content], 2021, 3, storage)
+    assert archive.read_archive(2021, 3, storage) == [last_response_content] * 2
+
+
+def test_archived_months(storage):
+    archive.write_archive([], 2021, 3, storage)
+    archive.write_archive([], 1999, 12, storage)
+    storage.save_object(b"", f"{definitions.RAW_RESPONSES_PREFIX}/other.json")
+
+    assert archive.archived_months(storage) == [(1999, 12), (2021, 3)]
@@ -0,0 +1,73 @@
+# pylint: disable=redefined-outer-name
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from earthquake_data_layer import catalog, definitions, helpers
+from earthquake_data_layer.schema import RAW_DATA_SCHEMA
+
+
+def write_month(storage, year, month, num_rows):
+    key = helpers.generate_raw_data_key_from_date(
+        year, month, layout=definitions.RAW_DATA_LAYOUT_HIVE
+    )
+    df = pd.DataFrame(
+        {"id": [f"{year}{month}{i}" for i in range(num_rows)], "time": range(num_rows)}
+    )
+    metadata_collector = list()
+    assert helpers.upload_df(
+        df,
+        key,
+        storage,
+        row_group_size=2,
+        schema=RAW_DATA_SCHEMA,
+        metadata_collector=metadata_collector,
+    )
+    return key, metadata_collector[0]
+
+
+@pytest.fixture
+def summary_files(storage):
+    return dict(
+        write_month(storage, 2021, month, num_rows)
+        for month, num_rows in ((1, 4), (2, 3))
+    )
+
+
+def test_summary(storage, summary_files):
+    assert catalog.update_dataset_summary(summary_files, storage)
+
+    summary = catalog.load_dataset_summary(storage)
+    assert summary.num_rows == 7
+    assert catalog.summary_row_groups(summary) == {
+        "year=2021/month=01/part-0.parquet": [0, 1],
+        "year=2021/month=02/part-0.parquet": [2, 3],
+    }
+
+    common_metadata = pq.read_schema(
+        storage.load_object(definitions.DATASET_COMMON_METADATA_KEY)
+    )
+    assert common_metadata.names == RAW_DATA_SCHEMA.names
+
+
+def test_rewritten_file_replaces_its_row_groups(storage, summary_files):
+    assert catalog.update_dataset_summary(summary_files, storage)
+    assert catalog.update_dataset_summary(
+        dict([write_month(storage, 2021, 1, 1)]), storage
+    )
+
+    summary = catalog.load_dataset_summary(storage)
+    assert summary.num_rows == 4
+    assert catalog.summary_row_groups(summary) == {
+        "year=2021/month=01/part-0.parquet": [0],
+        "year=2021/month=02/part-0.parquet": [1, 2],
+    }
+
+
+def test_no_summary(storage):
+    assert catalog.load_dataset_summary(storage) is None
+
+
+def test_partition_of():
+    assert catalog.partition_of("year=2021/month=03/part-0.parquet") == (2021, 3)
+    assert catalog.partition_of("2021/2021_03_raw_data.parquet") is None
@@ -0,0 +1,86 @@
+# pylint: disable=redefined-outer-name
+import threading
+
+import pandas as pd
+import pytest
+
+from earthquake_data_layer import changelog, definitions
+
+
+@pytest.fixture
+def previous():
+    return pd.DataFrame(
+        [
+            {"id": "a", "mag": 4.0, "updated": 1},
+            {"id": "b", "mag": 5.0, "updated": 1},
+            {"id": "c", "mag": 3.0, "updated": 1},
+        ]
+    )
+
+
+@pytest.fixture
+def current():
+    return pd.DataFrame(
+        [
+            {"id": "a", "mag": 4.0, "updated": 1},
+            {"id": "b", "mag": 5.0, "updated": 1},
+            # a newer version of b, the older one is still stored
+            {"id": "b", "mag": 5.2, "updated": 2},
+            {"id": "d", "mag": 2.0, "updated": 1},
+        ]
+    )
+
+
+def test_diff_rows(previous, current):
+    changes = changelog.diff_rows(previous, current, "2021-03")
+
+    assert set(changes["month"]) == {"2021-03"}
+    assert dict(zip(changes["id"], changes["change"])) == {
+        "b": definitions.CHANGE_UPDATE,
+        "c": definitions.CHANGE_DELETE,
+        "d": definitions.CHANGE_INSERT,
+    }
+    assert changes.set_index("id").loc["b", "mag"] == 5.2
+
+
+def test_first_write(current):
+    changes = changelog.diff_rows(None, current, "2021-03")
+    assert sorted(changes["id"]) == ["a", "b", "d"]
+    assert set(changes["change"]) == {definitions.CHANGE_INSERT}
+
+
+def test_no_changes(previous):
+    assert changelog.diff_rows(previous, previous.copy(), "2021-03").empty
+    assert changelog.write_change_set([pd.DataFrame()], "run") is None
+
+
+def test_sequence_numbers(storage, previous, current):
+    changes = changelog.diff_rows(previous, current, "2021-03")
+
+    assert changelog.write_change_set([changes], "run-1", storage) == 1
+    assert changelog.write_change_set([changes], "run-2", storage) == 2
+
+    change_sets = changelog.load_change_sets(storage=storage)
+    assert [sequence for sequence, _ in change_sets] == [1, 2]
+    sequence, df = change_sets[1]
+    assert set(df["sequence"]) == {2}
+    assert set(df["run_id"]) == {"run-2"}
+    assert list(df.columns) == changelog.CHANGELOG_SCHEMA.names
+
+    assert [sequence for sequence, _ in changelog.load_change_sets(1, storage)] == [2]
+
+
+def test_concurrent_writers(storage, current):
+    changes = changelog.diff_rows(None, current, "2021-03")
+    sequences = list()
+
+    def write(run_id):
+        sequences.append(changelog.write_change_set([changes], run_id, storage))
+
+    threads = [threading.Thread(target=write, args=(f"run-{i}",)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(sequences) == [1, 2, 3, 4]
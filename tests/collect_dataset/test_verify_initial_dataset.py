@@ -4,7 +4,7 @@ from unittest.mock import patch
 
 import pytest
 
-from collect_dataset import verify_initial_dataset
+from collect_dataset import incomplete_months, verify_initial_dataset
 from earthquake_data_layer import definitions
 
 
@@ -67,3 +67,51 @@ def test_incomplete(storage, unsuccessful_run):
             result = verify_initial_dataset()
 
             assert not result
+
+
+def test_incomplete_months():
+    metadata = {
+        "first_date": "2021-01-01",
+        "last_date": "2021-04-30",
+        "details": {
+            "2021": {
+                "1": definitions.STATUS_PIPELINE_SUCCESS,
+                "2": definitions.STATUS_PIPELINE_FAIL,
+            }
+        },
+    }
+
+    # the months the collection didn't reach are fetched as well
+    assert incomplete_months(metadata) == [(2021, 2), (2021, 3), (2021, 4)]
+
+    del metadata["first_date"]
+    assert incomplete_months(metadata) == [(2021, 2)]
+
+
+@pytest.mark.usefixtures("conditional_writes")
+def test_distributed_collection(storage, successful_run):
+    with patch("collect_dataset.Storage", return_value=storage), patch(
+        "earthquake_data_layer.settings.DISTRIBUTED_COLLECTION", True
+    ), patch(
+        "earthquake_data_layer.helpers.fetch_months_data",
+        return_value=successful_run,
+    ) as mock_fetch:
+        assert verify_initial_dataset()
+
+    # the months are claimed through the storage
+    claims = mock_fetch.call_args.kwargs["claims"]
+    assert claims.storage is storage
+    assert not claims.leases
+    assert json.loads(storage.load_object(definitions.COLLECTION_METADATA_KEY).read())[
+        "status"
+    ] == (definitions.STATUS_COLLECTION_METADATA_COMPLETE)
+
+
+def test_distributed_collection_refused(storage):
+    # the storage accepts the conditional writes without enforcing them
+    with patch("collect_dataset.Storage", return_value=storage), patch(
+        "earthquake_data_layer.settings.DISTRIBUTED_COLLECTION", True
+    ), patch("earthquake_data_layer.helpers.fetch_months_data") as mock_fetch:
+        assert not verify_initial_dataset()
+
+    mock_fetch.assert_not_called()
@@ -0,0 +1,144 @@
+# pylint: disable=redefined-outer-name
+from unittest.mock import patch
+
+import pandas as pd
+import pytest
+
+from compact_dataset import PeriodWriter, compact_dataset
+from earthquake_data_layer import compaction, definitions, helpers, reader
+
+
+def upload_month(storage, year, month, num_rows):
+    df = pd.DataFrame(
+        {
+            "id": [f"{year}-{month}-{i}" for i in range(num_rows)],
+            "time": [
+                reader.to_epoch_ms(f"{year}-{str(month).zfill(2)}-01") + i
+                for i in range(num_rows)
+            ],
+            "mag": [5.0] * num_rows,
+        }
+    )
+    key = helpers.generate_raw_data_key_from_date(year, month)
+    assert helpers.upload_df(df, key, storage)
+    return key
+
+
+@pytest.fixture
+def historical_months(storage):
+    return [upload_month(storage, 1950, month, 3) for month in range(1, 4)]
+
+
+def test_compact(storage, historical_months):
+    recent_key = upload_month(storage, 2020, 1, 2)
+
+    results = compact_dataset(storage)
+
+    assert list(results) == ["1950-1959"]
+    assert results["1950-1959"]["months"] == 3
+    assert len(results["1950-1959"]["files"]) == 1
+    for key in historical_months:
+        assert not storage.list_objects(prefix=key)
+    assert storage.list_objects(prefix=recent_key)
+
+    index = compaction.load_compaction_index(storage)["months"]
+    assert index["1950-02"]["row_groups"] == [1]
+
+    events = reader.read_events("1950-02-01", "1950-03-31", storage=storage)
+    assert sorted(events["id"]) == [
+        f"1950-{month}-{i}" for month in (2, 3) for i in range(3)
+    ]
+
+    # nothing new to compact
+    assert compact_dataset(storage) == {}
+
+
+def test_released_month_is_folded_back(storage, historical_months):
+    compact_dataset(storage)
+
+    compaction.release_month(1950, 2, storage)
+    upload_month(storage, 1950, 2, 5)
+    assert len(reader.read_events("1950-02-01", "1950-02-28", storage=storage)) == 5
+
+    results = compact_dataset(storage)
+    assert results["1950-1959"]["months"] == 3
+    # the previous compacted file was replaced
+    assert (
+        storage.list_objects(prefix=definitions.COMPACTED_DATA_PREFIX)
+        == results["1950-1959"]["files"]
+    )
+    assert len(reader.read_events("1950-01-01", "1950-03-31", storage=storage)) == 11
+
+
+def test_target_file_size(storage, historical_months):
+    with patch("compact_dataset.settings.COMPACTION_TARGET_FILE_SIZE", 1):
+        results = compact_dataset(storage)
+
+    assert len(results["1950-1959"]["files"]) == 3
+    assert len(reader.read_events("1950-01-01", "1950-03-31", storage=storage)) == 9
+
+
+def test_months_changed_while_compacted(storage, historical_months):
+    compact_dataset(storage)
+    compaction.release_month(1950, 2, storage)
+    upload_month(storage, 1950, 2, 5)
+
+    close = PeriodWriter.close
+
+    def close_after_changes(writer):
+        # February is fetched again and March is released while the period is written
+        upload_month(storage, 1950, 2, 7)
+        compaction.release_month(1950, 3, storage)
+        upload_month(storage, 1950, 3, 4)
+        return close(writer)
+
+    with patch.object(PeriodWriter, "close", close_after_changes):
+        results = compact_dataset(storage)
+
+    assert results["1950-1959"]["months"] == 1
+    index = compaction.load_compaction_index(storage)["months"]
+    assert sorted(index) == ["1950-01"]
+    # the rewritten monthly files are kept
+    assert storage.list_objects(prefix=helpers.generate_raw_data_key_from_date(1950, 2))
+    assert len(reader.read_events("1950-01-01", "1950-01-31", storage=storage)) == 3
+    assert len(reader.read_events("1950-02-01", "1950-03-31", storage=storage)) == 11
+
+
+def test_compacted_files_read_by_ranges(storage, historical_months):
+    compact_dataset(storage)
+
+    with patch.object(
+        storage, "load_object", wraps=storage.load_object
+    ) as mock_load, patch.object(
+        storage, "open_object", wraps=storage.open_object
+    ) as mock_open:
+        events = reader.read_events("1950-02-01", "1950-02-28", storage=storage)
+
+    assert len(events) == 3
+    # the compacted file isn't downloaded whole
+    assert not any(
+        call.args[0].startswith(definitions.COMPACTED_DATA_PREFIX)
+        for call in mock_load.call_args_list
+    )
+    mock_open.assert_called_once()
+
+
+def test_month_rewritten_before_removed(storage, historical_months):
+    remove_object_conditional = storage.remove_object_conditional
+
+    def rewrite_then_remove(key, *args):
+        # January is fetched again after the commit, right before its monthly file is removed
+        if key == historical_months[0]:
+            upload_month(storage, 1950, 1, 6)
+        return remove_object_conditional(key, *args)
+
+    with patch.object(
+        storage, "remove_object_conditional", side_effect=rewrite_then_remove
+    ):
+        compact_dataset(storage)
+    compaction.release_month(1950, 1, storage)
+
+    # the rewritten monthly file is kept, the others were removed
+    assert storage.list_objects(prefix=historical_months[0])
+    assert not storage.list_objects(prefix=historical_months[1])
+    assert len(reader.read_events("1950-01-01", "1950-01-31", storage=storage)) == 6
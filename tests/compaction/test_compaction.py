@@ -0,0 +1,67 @@
+from unittest.mock import patch
+
+from earthquake_data_layer import compaction
+
+
+def test_compaction_periods():
+    with (
+        patch("earthquake_data_layer.compaction.settings.COMPACTION_CUTOFF_YEAR", 1970),
+        patch("earthquake_data_layer.compaction.settings.COMPACTION_PERIOD_YEARS", 10),
+    ):
+        periods = compaction.compaction_periods(1905)
+
+    assert periods[0] == (1900, 1909)
+    assert periods[-1] == (1960, 1969)
+    assert len(periods) == 7
+
+
+def test_release_month(storage):
+    index = {"months": {"1950-01": {"key": "some_key", "row_groups": [0]}}}
+    assert compaction.save_compaction_index(index, storage)
+
+    assert compaction.compacted_months([(1950, 1), (1950, 2)], storage) == {
+        (1950, 1): {"key": "some_key", "row_groups": [0]}
+    }
+    assert compaction.release_month("1950", "01", storage)
+    assert not compaction.release_month("1950", "01", storage)
+    assert compaction.compacted_months([(1950, 1)], storage) == {}
+
+
+def test_recent_months_are_not_looked_up(storage):
+    with patch.object(storage, "load_object_with_etag") as mock_load:
+        assert compaction.compacted_months([(2021, 1)], storage) == {}
+        assert not compaction.release_month(2021, 1, storage)
+    mock_load.assert_not_called()
+
+
+def test_concurrent_releases(storage):
+    index = {
+        "months": {
+            "1950-01": {"key": "some_key", "row_groups": [0]},
+            "1950-02": {"key": "some_key", "row_groups": [1]},
+        }
+    }
+    assert compaction.save_compaction_index(index, storage)
+    load = compaction.load_compaction_index_with_etag
+    calls = list()
+
+    def load_then_release_elsewhere(*args):
+        loaded = load(*args)
+        if not calls:
+            # another process releases February after this one loaded the index
+            calls.append(1)
+            other = load(*args)[0]
+            other["months"].pop("1950-02")
+            compaction.save_compaction_index(other, storage)
+        return loaded
+
+    with patch.object(
+        compaction,
+        "load_compaction_index_with_etag",
+        side_effect=load_then_release_elsewhere,
+    ) as mock_load:
+        assert compaction.release_month(1950, 1, storage)
+
+    # the first save found the index changed, the release was applied again on the newer index
+    assert mock_load.call_count == 2
+    assert compaction.load_compaction_index(storage) == {"months": {}}
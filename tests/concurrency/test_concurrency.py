@@ -0,0 +1,89 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from unittest.mock import patch
+
+import pandas as pd
+import pytest
+
+from earthquake_data_layer.concurrency import KeyedLocks, SingleFlight
+from earthquake_data_layer.helpers import add_rows_to_parquet
+
+
+def test_single_flight_shares_result():
+    single_flight = SingleFlight()
+    followers = threading.Semaphore(0)
+    calls = list()
+
+    class CountingFuture(Future):
+        def result(self, timeout=None):
+            followers.release()
+            return super().result(timeout)
+
+    def function(value):
+        calls.append(value)
+        # wait until the 3 followers joined the call
+        for _ in range(3):
+            assert followers.acquire(timeout=5)
+        return value * 2
+
+    with patch("earthquake_data_layer.concurrency.Future", CountingFuture):
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [executor.submit(single_flight.do, "key", function, 21)]
+            while not calls:
+                time.sleep(0.01)
+            futures += [
+                executor.submit(single_flight.do, "key", function, 21) for _ in range(3)
+            ]
+            results = [future.result() for future in futures]
+
+    assert calls == [21]
+    assert results == [(42, False)] + [(42, True)] * 3
+    assert single_flight.in_flight() == 0
+
+    # the key is free again once the call returned
+    assert single_flight.do("key", lambda: 1) == (1, False)
+
+
+def test_single_flight_shares_exception():
+    single_flight = SingleFlight()
+    release = threading.Event()
+
+    def function():
+        release.wait(5)
+        raise ValueError("error")
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        leader = executor.submit(single_flight.do, "key", function)
+        while not single_flight.in_flight():
+            time.sleep(0.01)
+        follower = executor.submit(single_flight.do, "key", function)
+        release.set()
+        for future in (leader, follower):
+            with pytest.raises(ValueError):
+                future.result()
+
+    assert single_flight.in_flight() == 0
+
+
+def test_keyed_locks():
+    locks = KeyedLocks()
+    assert locks("a") is locks("a")
+    assert locks("a") is not locks("b")
+
+
+def test_concurrent_writers_keep_all_rows(storage):
+    key = "data/test_concurrent_writers.parquet"
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(
+            executor.map(
+                lambda index: add_rows_to_parquet(
+                    {"id": str(index)}, key, storage=storage
+                ),
+                range(16),
+            )
+        )
+
+    assert all(results)
+    df = pd.read_parquet(storage.load_object(key))
+    assert sorted(df["id"].astype(int)) == list(range(16))
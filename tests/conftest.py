@@ -1,11 +1,15 @@
 # pylint: disable=redefined-outer-name,unused-argument,import-outside-toplevel
 import os
 from collections import Counter
+from unittest.mock import patch
 
 import boto3
 import pytest
 from moto import mock_s3
 
+# the package imports the fetcher lazily, it is imported here so the names it imports are bound before any test
+# patches them
+import earthquake_data_layer.fetcher  # pylint: disable=unused-import
 from earthquake_data_layer.definitions import EXPECTED_DATA_DATE_FORMAT, TODAY
 
 
@@ -64,6 +68,16 @@ def storage(aws_credentials, test_bucket):
         yield storage
 
 
+@pytest.fixture
+def conditional_writes():
+    # moto accepts the conditional writes parameters without enforcing them, the leases are tested as if it did
+    with patch(
+        "earthquake_data_layer.storage.Storage.enforces_conditional_writes",
+        return_value=True,
+    ):
+        yield
+
+
 @pytest.fixture(autouse=True)
 def clear_bucket(storage, test_bucket):
     yield
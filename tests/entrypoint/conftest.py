@@ -1,9 +1,57 @@
+from unittest.mock import MagicMock, patch
+
 import pytest
 from fastapi.testclient import TestClient
 
+from earthquake_data_layer import definitions
 from earthquake_data_layer.entrypoint import app
+from earthquake_data_layer.helpers import (
+    add_rows_to_parquet,
+    generate_raw_data_key_from_date,
+)
+from earthquake_data_layer.result_cache import query_cache
+from tests.utils import make_event
 
 
 @pytest.fixture
 def client():
     return TestClient(app)
+
+
+@pytest.fixture(autouse=True)
+def empty_query_cache():
+    # the tests upload different events for the same queries
+    query_cache.bump_version()
+    yield
+
+
+@pytest.fixture(autouse=True)
+def leader():
+    # this process runs the updates unless a test says otherwise
+    election = MagicMock(is_leader=True)
+    with patch("earthquake_data_layer.leases.leader_election", election):
+        yield election
+
+
+@pytest.fixture
+def events():
+    # off japan, a day and half a magnitude apart. override it to upload other events
+    return [
+        make_event(f"jp{i}", i + 1, 142.0 + i / 10, 38.0, 3.0 + i / 2)
+        for i in range(10)
+    ]
+
+
+@pytest.fixture
+def uploaded_events(storage, events):
+    # the events of 2021-03, read by the routes from the test storage
+    key = generate_raw_data_key_from_date(2021, 3)
+    assert add_rows_to_parquet(
+        events,
+        key,
+        storage=storage,
+        sort_by=definitions.RAW_DATA_SORT_COLUMNS,
+        row_group_size=5,
+    )
+    with patch("earthquake_data_layer.reader.Storage", return_value=storage):
+        yield key
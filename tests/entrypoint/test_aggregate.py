@@ -0,0 +1,42 @@
+import pytest
+
+from earthquake_data_layer import definitions, reader
+
+
+def test_aggregate(client, uploaded_events):
+    response = client.get(
+        "/aggregate",
+        params={
+            "start_date": "2021-03-01",
+            "end_date": "2021-03-31",
+            "bucket": "week",
+            "cell_bits": 0,
+            "mag_bin": 2,
+            "min_magnitude": 4,
+        },
+    )
+
+    assert response.status_code == 200
+    rows = response.json()["result"]
+    # 2021-03-01 and 2021-03-08 are mondays, events from 2021-03-03 have a magnitude of 4 or more
+    assert [
+        (row["time_bucket"], row["cell"], row["mag_bin"], row["count"]) for row in rows
+    ] == [
+        (reader.to_epoch_ms("2021-03-01"), 0, 4.0, 4),
+        (reader.to_epoch_ms("2021-03-01"), 0, 6.0, 1),
+        (reader.to_epoch_ms("2021-03-08"), 0, 6.0, 3),
+    ]
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        {"start_date": "2021-03-01", "end_date": "2021-03-32"},
+        {"start_date": "2021-03-01", "end_date": "2021-03-31", "bucket": "year"},
+        {"start_date": "2021-03-01", "end_date": "2021-03-31", "mag_bin": 0},
+        {"start_date": "2021-03-01", "end_date": "2021-03-31", "cell_bits": 40},
+    ],
+)
+def test_invalid_input(client, params):
+    response = client.get("/aggregate", params=params)
+    assert response.status_code in (definitions.HTTP_INVALID_DATE, 422)
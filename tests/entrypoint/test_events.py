@@ -0,0 +1,134 @@
+# pylint: disable=redefined-outer-name
+import datetime
+import json
+from unittest.mock import patch
+
+import pyarrow as pa
+import pytest
+
+from earthquake_data_layer import definitions
+from earthquake_data_layer.hot_store import HotStore
+from tests.utils import make_event
+
+
+@pytest.fixture
+def events(events):
+    # and off chile
+    return [
+        make_event(f"cl{i}", i + 1, -71.0 - i / 10, -33.0, 4.0) for i in range(10)
+    ] + events
+
+
+def test_arrow_stream(client, uploaded_events):
+    response = client.get(
+        "/events",
+        params={
+            "start_date": "2021-03-01",
+            "end_date": "2021-03-31",
+            "bbox": "140,30,150,40",
+            "min_magnitude": 5,
+            "columns": "id,mag",
+        },
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/vnd.apache.arrow.stream"
+    table = pa.ipc.open_stream(response.content).read_all()
+    assert table.column_names == ["id", "mag"]
+    assert sorted(table.column("id").to_pylist()) == [f"jp{i}" for i in range(4, 10)]
+
+
+def test_ndjson_stream(client, uploaded_events):
+    response = client.get(
+        "/events",
+        params={
+            "start_date": "2021-03-02",
+            "end_date": "2021-03-03",
+            "max_magnitude": 4,
+            "columns": "id,mag,latitude",
+            "format": "ndjson",
+        },
+    )
+
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(rows, key=lambda row: row["id"]) == [
+        {"id": "cl1", "mag": 4.0, "latitude": -33.0},
+        {"id": "cl2", "mag": 4.0, "latitude": -33.0},
+        {"id": "jp1", "mag": 3.5, "latitude": 38.0},
+        {"id": "jp2", "mag": 4.0, "latitude": 38.0},
+    ]
+
+
+def test_empty_result(client, uploaded_events):
+    response = client.get(
+        "/events",
+        params={"start_date": "2021-05-01", "end_date": "2021-05-31"},
+    )
+
+    assert response.status_code == 200
+    table = pa.ipc.open_stream(response.content).read_all()
+    assert table.num_rows == 0
+    assert "mag" in table.column_names
+
+
+def test_row_groups_streamed(client, uploaded_events):
+    with patch(
+        "earthquake_data_layer.schema.cast_table",
+        wraps=lambda table, schema: table.select(schema.names),
+    ) as mock_cast:
+        response = client.get(
+            "/events",
+            params={
+                "start_date": "2021-03-01",
+                "end_date": "2021-03-31",
+                "columns": "id",
+                "format": "ndjson",
+            },
+        )
+
+    assert len(response.text.splitlines()) == 20
+    # 4 row groups of 5 rows, each encoded on its own
+    assert [call.args[0].num_rows for call in mock_cast.call_args_list] == [5] * 4
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        {"start_date": "2021-13-01", "end_date": "2021-03-31"},
+        {"start_date": "2021-03-01", "end_date": "2021-03-31", "bbox": "1,2,3"},
+        {"start_date": "2021-03-01", "end_date": "2021-03-31", "columns": "foo"},
+        {"start_date": "2021-03-01", "end_date": "2021-03-31", "format": "csv"},
+    ],
+)
+def test_invalid_input(client, params):
+    response = client.get("/events", params=params)
+    assert response.status_code in (
+        definitions.HTTP_INVALID_DATE,
+        422,
+    )
+
+
+def test_served_from_hot_store(client, storage, uploaded_events):
+    store = HotStore(months=0, memory_budget=1024 * 1024)
+    assert store.refresh(storage, datetime.date(2021, 3, 15))
+
+    with patch("earthquake_data_layer.hot_store.hot_store", store):
+        with patch("earthquake_data_layer.reader.scan_events") as mock_scan:
+            response = client.get(
+                "/events",
+                params={
+                    "start_date": "2021-03-03",
+                    "end_date": "2021-03-05",
+                    "bbox": "140,30,150,40",
+                    "columns": "id",
+                    "format": "ndjson",
+                },
+            )
+
+    mock_scan.assert_not_called()
+    assert [json.loads(line)["id"] for line in response.text.splitlines()] == [
+        "jp2",
+        "jp3",
+        "jp4",
+    ]
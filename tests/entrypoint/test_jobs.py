@@ -0,0 +1,44 @@
+from unittest.mock import patch
+
+from earthquake_data_layer import definitions
+from earthquake_data_layer.jobs import UpdateJobQueue
+
+
+def test_submit_and_follow(client):
+    queue = UpdateJobQueue(max_workers=1)
+
+    def update_dataset(last_year, last_month, metadata, fence):
+        metadata["progress"] = {"2020-01": definitions.STATUS_UPLOAD_DATA_SUCCESS}
+        metadata["status"] = definitions.STATUS_COLLECTION_METADATA_COMPLETE
+        return metadata
+
+    with patch("earthquake_data_layer.routes.update.update_jobs", queue), patch(
+        "earthquake_data_layer.routes.jobs.update_jobs", queue
+    ), patch("update_dataset.update_dataset", side_effect=update_dataset), patch(
+        "earthquake_data_layer.helpers.verify_storage_connection",
+        return_value=True,
+    ), patch(
+        "earthquake_data_layer.hot_store.hot_store"
+    ):
+        response = client.post("/update", json={"date": "2020-01-01"})
+        assert response.status_code == 202
+        job_id = response.json()["job_id"]
+
+        queue.executor.submit(lambda: None).result(5)
+        response = client.get(f"/jobs/{job_id}")
+
+    assert response.status_code == 200
+    report = response.json()
+    assert report["status"] == definitions.JOB_STATUS_SUCCEEDED
+    assert report["months"] == {"2020-01": definitions.STATUS_UPLOAD_DATA_SUCCESS}
+    assert report["result"]["status"] == definitions.STATUS_COLLECTION_METADATA_COMPLETE
+
+
+def test_invalid_date(client):
+    response = client.post("/update", json={"date": "2020-13-01"})
+    assert response.status_code == definitions.HTTP_INVALID_DATE
+
+
+def test_unknown_job(client):
+    response = client.get("/jobs/unknown")
+    assert response.status_code == 404
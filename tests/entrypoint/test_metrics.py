@@ -0,0 +1,7 @@
+def test_metrics(client):
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert "# TYPE edl_fetch_stage_seconds histogram" in response.text
+    assert "# TYPE edl_fetch_queue_depth gauge" in response.text
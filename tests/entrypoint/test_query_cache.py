@@ -0,0 +1,46 @@
+from unittest.mock import patch
+
+import pyarrow as pa
+import pytest
+
+from earthquake_data_layer.result_cache import query_cache
+
+PARAMS = {"start_date": "2021-03-01", "end_date": "2021-03-31", "min_magnitude": 4}
+
+
+@pytest.mark.parametrize("route", ["/events", "/aggregate"])
+def test_cached(client, uploaded_events, route):
+    first = client.get(route, params=PARAMS)
+    assert first.status_code == 200
+
+    # equivalent parameters are served from the cache
+    with patch("earthquake_data_layer.reader.scan_events") as mock_scan:
+        second = client.get(route, params={**PARAMS, "min_magnitude": "4.0"})
+    mock_scan.assert_not_called()
+
+    assert second.status_code == 200
+    assert second.content == first.content
+    assert second.headers["etag"] == first.headers["etag"]
+
+
+@pytest.mark.parametrize("route", ["/events", "/aggregate"])
+def test_not_modified(client, uploaded_events, route):
+    etag = client.get(route, params=PARAMS).headers["etag"]
+
+    response = client.get(route, params=PARAMS, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
+
+def test_invalidated_by_new_data(client, uploaded_events):
+    first = client.get("/events", params=PARAMS)
+    assert pa.ipc.open_stream(first.content).read_all().num_rows == 8
+
+    # a batch committed new data
+    query_cache.bump_version()
+
+    response = client.get(
+        "/events", params=PARAMS, headers={"If-None-Match": first.headers["etag"]}
+    )
+    assert response.status_code == 200
+    assert response.headers["etag"] != first.headers["etag"]
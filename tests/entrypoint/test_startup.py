@@ -0,0 +1,116 @@
+import json
+import os
+import subprocess
+import sys
+from unittest.mock import patch
+
+from earthquake_data_layer import entrypoint
+
+# generous, importing the entrypoint takes well under a second without the pipeline modules
+IMPORT_TIME_BUDGET = 3.0
+
+HEAVY_MODULES = ["pandas", "pyarrow", "numpy", "boto3", "fake_headers", "requests"]
+
+IMPORT_BENCHMARK = f"""
+import json, sys, time
+start = time.perf_counter()
+import earthquake_data_layer.entrypoint
+seconds = time.perf_counter() - start
+print(json.dumps({{
+    "seconds": seconds,
+    "imported": [module for module in {HEAVY_MODULES} if module in sys.modules],
+}}))
+"""
+
+
+def test_import_time():
+    # a fresh interpreter, the tests already imported everything
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_BENCHMARK],
+        cwd=os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout
+    benchmark = json.loads(output.splitlines()[-1])
+
+    assert benchmark["imported"] == []
+    assert benchmark["seconds"] < IMPORT_TIME_BUDGET
+
+
+def test_liveness_and_readiness(client):
+    entrypoint.ready.clear()
+
+    assert client.get("/").status_code == 200
+    assert client.get("/ready").status_code == 503
+
+    with patch("earthquake_data_layer.settings.INTEGRATION_TEST", True):
+        entrypoint.collect_initial_dataset()
+
+    response = client.get("/ready")
+    assert response.status_code == 200
+    assert response.json() == {"message": "Ready", "status": 200}
+
+
+def test_follower_loads_hot_store(leader):
+    leader.try_to_lead.return_value = False
+    entrypoint.ready.clear()
+
+    def refresh():
+        entrypoint.stopping.set()
+
+    with patch("collect_dataset.initial_dataset_complete", return_value=True), patch(
+        "earthquake_data_layer.hot_store.hot_store"
+    ) as mock_store, patch("collect_dataset.verify_initial_dataset") as mock_verify:
+        mock_store.refresh.side_effect = refresh
+        entrypoint.run_service()
+    entrypoint.stopping.clear()
+
+    # the follower serves reads without collecting
+    mock_verify.assert_not_called()
+    mock_store.refresh.assert_called_once()
+    assert entrypoint.ready.is_set()
+
+
+def test_leader_collects(leader):
+    entrypoint.ready.clear()
+
+    fences = list()
+
+    def verify_initial_dataset(fence):
+        fences.append(fence)
+        entrypoint.stopping.set()
+        return True
+
+    with patch(
+        "collect_dataset.verify_initial_dataset", side_effect=verify_initial_dataset
+    ), patch("earthquake_data_layer.hot_store.hot_store") as mock_store:
+        entrypoint.run_service()
+    entrypoint.stopping.clear()
+
+    mock_store.refresh.assert_called_once()
+    assert entrypoint.ready.is_set()
+
+    # the collection stops writing once the leader lost its lease
+    assert fences[0]()
+    leader.is_leader = False
+    assert not fences[0]()
+
+
+def test_distributed_follower_collects(leader):
+    leader.try_to_lead.return_value = False
+    entrypoint.ready.clear()
+
+    def verify_initial_dataset(fence):
+        entrypoint.stopping.set()
+        return True
+
+    with patch("earthquake_data_layer.settings.DISTRIBUTED_COLLECTION", True), patch(
+        "collect_dataset.verify_initial_dataset", side_effect=verify_initial_dataset
+    ) as mock_verify, patch("earthquake_data_layer.hot_store.hot_store"):
+        entrypoint.run_service()
+    entrypoint.stopping.clear()
+
+    # the follower collects with the leader
+    mock_verify.assert_called_once()
+    assert entrypoint.ready.is_set()
@@ -6,15 +6,18 @@ from earthquake_data_layer import definitions
 def test_update_success(client, storage):
     # Mock the run_collection function to return a result
     with patch(
-        "earthquake_data_layer.routes.update.update_dataset",
+        "update_dataset.update_dataset",
         return_value="some_result",
     ):
         with patch("earthquake_data_layer.helpers.Storage", return_value=storage):
-            # Send a request to the /collect endpoint
-            response = client.get("/update/2020-01-01")
+            with patch("earthquake_data_layer.hot_store.hot_store") as mock_store:
+                # Send a request to the /collect endpoint
+                response = client.get("/update/2020-01-01")
 
     # Assert that the response status code is 200
     assert response.status_code == 200
+    # the hot store is refreshed with the updated months
+    mock_store.refresh.assert_called_once()
 
     # Assert that the response JSON contains the expected result and status
     assert response.json() == {"result": "some_result", "status_code": 200}
@@ -35,7 +38,7 @@ def test_storage_connection_error(client):
 def test_update_generic_error(client, storage):
     # Mock the run_collection function to raise a generic exception
     with patch(
-        "earthquake_data_layer.routes.update.update_dataset",
+        "update_dataset.update_dataset",
         side_effect=Exception("Some error"),
     ):
         with patch("earthquake_data_layer.helpers.Storage", return_value=storage):
@@ -44,3 +47,13 @@ def test_update_generic_error(client, storage):
 
     # Assert that the response status code is 500 (HTTPException status_code for generic error)
     assert response.status_code == 500
+
+
+def test_not_leader(client, leader):
+    leader.is_leader = False
+
+    response = client.get("/update/2020-01-01")
+    assert response.status_code == definitions.HTTP_NOT_LEADER
+
+    response = client.post("/update", json={"date": "2020-01-01"})
+    assert response.status_code == definitions.HTTP_NOT_LEADER
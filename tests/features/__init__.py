@@ -0,0 +1 @@
+import tests.conftest
@@ -0,0 +1,150 @@
+# pylint: disable=redefined-outer-name
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from earthquake_data_layer import aggregates, definitions, features
+from earthquake_data_layer.exceptions import StorageConnectionError
+from earthquake_data_layer.reader import to_epoch_ms
+from earthquake_data_layer.spatial import cell_id
+
+# 2021-03-01 is a monday
+FIRST_WEEK = to_epoch_ms("2021-03-01")
+
+
+def make_event(event_id, date, mag, latitude=38.0, longitude=142.0):
+    return {
+        "id": event_id,
+        "time": to_epoch_ms(date) + 1000,
+        "mag": mag,
+        "depth": 10.0,
+        "cell": cell_id(latitude, longitude),
+    }
+
+
+@pytest.fixture
+def grid_cell():
+    return int(features.grid_cell(pd.Series([cell_id(38.0, 142.0)]))[0])
+
+
+@pytest.fixture
+def march(storage):
+    events = [
+        make_event("a", "2021-03-01", 4.0),
+        make_event("b", "2021-03-02", 5.0),
+        make_event("c", "2021-03-15", 3.0),
+        make_event("d", "2021-03-15", 3.0, latitude=-33.0, longitude=-71.0),
+    ]
+    assert aggregates.update_weekly_aggregates(
+        {"2021-03": aggregates.month_partials(events, "2021-03")}, storage
+    )
+    return events
+
+
+def test_full_build(storage, march, grid_cell):
+    manifest = features.build_feature_tensors(storage=storage)
+    assert manifest["version"] == 1
+    assert not manifest["incremental"]
+
+    tensor = features.load_array(manifest["keys"]["features"], storage)
+    assert tensor.shape == (3, 4**features.settings.FEATURE_GRID_BITS, 5)
+    assert tensor[0, grid_cell].tolist() == pytest.approx(
+        [2, 5.0, 4.5, np.log10(10**10.8 + 10**12.3), 10.0]
+    )
+    # no events in the second week
+    assert not tensor[1].any()
+    assert tensor[2].sum(axis=0)[0] == 2
+
+    labels = features.load_array(manifest["keys"]["labels"], storage)
+    assert labels[1, grid_cell] == 3.0
+    assert np.isnan(labels[2]).all()
+
+    weeks = features.load_array(manifest["keys"]["weeks"], storage)
+    assert weeks.tolist() == [FIRST_WEEK + week * features.WEEK_MS for week in range(3)]
+
+
+def test_incremental_build(storage, march, grid_cell):
+    features.build_feature_tensors(storage=storage)
+
+    april = [make_event("e", "2021-04-01", 6.0), make_event("f", "2021-04-12", 2.0)]
+    aggregates.update_weekly_aggregates(
+        {"2021-04": aggregates.month_partials(april, "2021-04")}, storage
+    )
+
+    with patch.object(
+        features, "grid_weekly_features", wraps=features.grid_weekly_features
+    ) as mock_compute:
+        manifest = features.build_feature_tensors([(2021, 4)], storage)
+
+    assert manifest["version"] == 2
+    assert manifest["incremental"]
+    # only the weeks after the previous version and the weeks of april were computed
+    assert min(mock_compute.call_args.args[1]) == to_epoch_ms("2021-03-22")
+
+    tensor = features.load_array(manifest["keys"]["features"], storage)
+    full = features.build_feature_tensors(storage=storage)
+    assert np.array_equal(
+        tensor, features.load_array(full["keys"]["features"], storage)
+    )
+    assert tensor[0, grid_cell, 0] == 2
+    assert tensor[4, grid_cell, 1] == 6.0
+
+
+def test_old_versions_removed(storage, march):
+    with patch.object(features.settings, "FEATURE_VERSIONS_KEPT", 2):
+        for _ in range(3):
+            manifest = features.build_feature_tensors(storage=storage)
+
+    assert features.load_feature_manifest(1, storage) is None
+    assert features.load_feature_manifest(2, storage)["version"] == 2
+    assert features.load_feature_manifest(storage=storage) == manifest
+
+
+def test_open_memory_mapped(storage, march, tmp_path):
+    manifest = features.build_feature_tensors(storage=storage)
+
+    tensors = features.open_feature_tensors(str(tmp_path), storage=storage)
+    assert tensors["manifest"] == manifest
+    assert isinstance(tensors["features"], np.memmap)
+    assert not tensors["features"].flags.writeable
+    assert tensors["features"].shape[0] == tensors["labels"].shape[0] == 3
+
+    # opening again doesn't download
+    with patch.object(storage, "load_object", wraps=storage.load_object) as mock_load:
+        features.open_feature_tensors(str(tmp_path), version=1, storage=storage)
+    assert all(
+        call.args[0] != manifest["keys"]["features"]
+        for call in mock_load.call_args_list
+    )
+
+
+def test_open_failed_download(storage, march, tmp_path):
+    manifest = features.build_feature_tensors(storage=storage)
+
+    load_object = storage.load_object
+
+    def failed_download(key, return_as_io=True, destination_path=None):
+        if return_as_io:
+            return load_object(key)
+        # the client error is logged and swallowed after a partial write
+        with open(destination_path, "wb") as file:
+            file.write(b"partial")
+        return None
+
+    with patch.object(storage, "load_object", side_effect=failed_download):
+        with pytest.raises(StorageConnectionError, match=manifest["keys"]["features"]):
+            features.open_feature_tensors(str(tmp_path), storage=storage)
+
+    version_directory = tmp_path / f"v{manifest['version']:06d}"
+    assert not list(version_directory.iterdir())
+
+    # the next open downloads again
+    tensors = features.open_feature_tensors(str(tmp_path), storage=storage)
+    assert tensors["features"].shape[0] == 3
+
+
+def test_no_aggregates(storage):
+    assert features.build_feature_tensors(storage=storage) is None
+    assert not storage.list_objects(prefix=definitions.FEATURES_PREFIX)
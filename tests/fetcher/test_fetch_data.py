@@ -1,24 +1,29 @@
 # pylint: disable=redefined-outer-name
+import concurrent.futures
+import threading
+import time
 from unittest.mock import patch
 
 import pytest
 import requests
 
-from earthquake_data_layer import definitions, helpers
+from earthquake_data_layer import Fetcher, definitions, helpers, settings
 from tests.utils import MockApiResponse
 
 
 @pytest.fixture
-def expected_metadata(mock_start_date, mock_end_date, expected_count):
+def expected_metadata(mock_start_date, mock_end_date, expected_count, expected_data):
     return {
         "start_date": mock_start_date,
         "end_date": mock_end_date,
         "count": expected_count,
+        "fingerprint": helpers.data_fingerprint(expected_data),
         "execution_date": definitions.TODAY,
         "status": definitions.STATUS_UPLOAD_DATA_SUCCESS,
         "data_key": helpers.generate_raw_data_key_from_date(
             mock_start_date[:4], mock_start_date[5:7]
         ),
+        "layout": settings.RAW_DATA_LAYOUT,
     }
 
 
@@ -30,14 +35,21 @@ def test_success(
         MockApiResponse(content=last_response_content),
     ]
 
+    expected_metadata["archive_key"] = "archive_key"
+
     with patch("earthquake_data_layer.fetcher.requests.get") as mock_response:
         with patch(
             "earthquake_data_layer.fetcher.add_rows_to_parquet", return_value=True
-        ):
+        ), patch(
+            "earthquake_data_layer.fetcher.write_archive", return_value="archive_key"
+        ) as mock_archive:
             mock_response.side_effect = expected_responses
             result = mock_fetcher.fetch_data()
 
             assert result == expected_metadata
+            mock_archive.assert_called_once_with(
+                mock_fetcher.responses, mock_fetcher.year, mock_fetcher.month
+            )
 
 
 def test_error_api(mock_fetcher, expected_metadata):
@@ -46,10 +58,148 @@ def test_error_api(mock_fetcher, expected_metadata):
         {"status": definitions.STATUS_QUERY_API_FAIL, "error": repr(expected_error)}
     )
     expected_metadata.pop("count")
+    expected_metadata.pop("fingerprint")
     expected_metadata.pop("data_key")
+    expected_metadata.pop("layout")
 
     with patch("earthquake_data_layer.fetcher.requests.get") as mock_response:
         mock_response.side_effect = expected_error
         result = mock_fetcher.fetch_data()
 
         assert result == expected_metadata
+
+
+def test_unchanged_data_not_uploaded(
+    mock_fetcher,
+    first_response_content,
+    last_response_content,
+    expected_metadata,
+    expected_data,
+):
+    mock_fetcher.previous_fingerprint = helpers.data_fingerprint(expected_data)
+    expected_metadata.pop("data_key")
+    expected_metadata["unchanged"] = True
+
+    with patch("earthquake_data_layer.fetcher.requests.get") as mock_response, patch(
+        "earthquake_data_layer.fetcher.Fetcher.stored_data_exists", return_value=True
+    ):
+        with patch("earthquake_data_layer.fetcher.add_rows_to_parquet") as mock_upload:
+            mock_response.side_effect = [
+                MockApiResponse(content=first_response_content),
+                MockApiResponse(content=last_response_content),
+            ]
+            result = mock_fetcher.fetch_data()
+
+    assert result == expected_metadata
+    mock_upload.assert_not_called()
+
+
+def test_unchanged_data_missing_uploaded(
+    mock_fetcher, first_response_content, last_response_content, expected_data
+):
+    mock_fetcher.previous_fingerprint = helpers.data_fingerprint(expected_data)
+
+    # e.g. the layout was switched or the file was lost
+    with patch("earthquake_data_layer.fetcher.requests.get") as mock_response, patch(
+        "earthquake_data_layer.fetcher.Fetcher.stored_data_exists", return_value=False
+    ), patch("earthquake_data_layer.fetcher.write_archive"):
+        with patch(
+            "earthquake_data_layer.fetcher.add_rows_to_parquet", return_value=True
+        ) as mock_upload:
+            mock_response.side_effect = [
+                MockApiResponse(content=first_response_content),
+                MockApiResponse(content=last_response_content),
+            ]
+            result = mock_fetcher.fetch_data()
+
+    mock_upload.assert_called_once()
+    assert "unchanged" not in result
+
+
+def test_stored_data_exists(storage, mock_fetcher):
+    with patch("earthquake_data_layer.fetcher.Storage", return_value=storage), patch(
+        "earthquake_data_layer.compaction.Storage", return_value=storage
+    ):
+        assert not mock_fetcher.stored_data_exists()
+
+        key = helpers.generate_raw_data_key_from_date(
+            mock_fetcher.year, mock_fetcher.month
+        )
+        assert storage.save_object(b"data", key)
+        assert mock_fetcher.stored_data_exists()
+
+        # the monthly file of another layout
+        with patch.object(
+            settings, "RAW_DATA_LAYOUT", definitions.RAW_DATA_LAYOUT_HIVE
+        ):
+            assert not mock_fetcher.stored_data_exists()
+
+
+def test_concurrent_fetches_shared(mock_start_date, mock_end_date, expected_metadata):
+    started = threading.Event()
+    release = threading.Event()
+
+    def run_pipeline(self, *_):
+        started.set()
+        release.wait(5)
+        self.metadata = dict(expected_metadata)
+        self.table_entry = {"key": f"{self.start_date}.parquet"}
+        return self.metadata
+
+    leader = Fetcher(start_date=mock_start_date, end_date=mock_end_date)
+    follower = Fetcher(start_date=mock_start_date, end_date=mock_end_date)
+    other_month = Fetcher(start_date="2021-04-01", end_date="2021-04-30")
+    with patch.object(
+        Fetcher, "run_pipeline", autospec=True, side_effect=run_pipeline
+    ) as mock_pipeline:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+            leader_result = executor.submit(leader.fetch_data)
+            assert started.wait(5)
+            follower_result = executor.submit(follower.fetch_data)
+            other_result = executor.submit(other_month.fetch_data)
+            # the follower waits for the leader's fetch while another month runs on its own
+            while mock_pipeline.call_count < 2:
+                time.sleep(0.01)
+            release.set()
+
+            assert leader_result.result() == expected_metadata
+            assert follower_result.result() == {**expected_metadata, "shared": True}
+            assert other_result.result() == expected_metadata
+
+    assert mock_pipeline.call_count == 2
+    # the follower took over what the leader uploaded, its batch publishes the month as well
+    assert follower.table_entry == leader.table_entry
+
+
+def test_fetches_under_other_fences_not_shared(
+    mock_start_date, mock_end_date, expected_metadata
+):
+    started = threading.Event()
+    release = threading.Event()
+
+    def run_pipeline(self, *_):
+        started.set()
+        release.wait(5)
+        self.metadata = dict(expected_metadata)
+        return self.metadata
+
+    first = Fetcher(
+        start_date=mock_start_date, end_date=mock_end_date, fence=lambda: True
+    )
+    # e.g. a run under a lease that was lost meanwhile
+    second = Fetcher(
+        start_date=mock_start_date, end_date=mock_end_date, fence=lambda: False
+    )
+    with patch.object(
+        Fetcher, "run_pipeline", autospec=True, side_effect=run_pipeline
+    ) as mock_pipeline:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            first_result = executor.submit(first.fetch_data)
+            assert started.wait(5)
+            second_result = executor.submit(second.fetch_data)
+            while mock_pipeline.call_count < 2:
+                time.sleep(0.01)
+            release.set()
+
+            assert "shared" not in first_result.result()
+            assert "shared" not in second_result.result()
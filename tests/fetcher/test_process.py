@@ -1,7 +1,22 @@
-from earthquake_data_layer import definitions
+import json
+from unittest.mock import patch
+
+import pyarrow as pa
+
+from earthquake_data_layer import definitions, fetcher
+from earthquake_data_layer.fetcher import table_from_rows
+from earthquake_data_layer.schema import RAW_DATA_SCHEMA
+from earthquake_data_layer.spatial import cell_id
 from tests.utils import MockApiResponse
 
 
+def non_null_rows(table: pa.Table) -> list[dict]:
+    return [
+        {key: value for key, value in row.items() if value is not None}
+        for row in table.to_pylist()
+    ]
+
+
 def test_single_response(mock_fetcher, last_response_content, mock_response_data):
     mock_fetcher.responses = [MockApiResponse(content=last_response_content).json()]
     result = mock_fetcher.process()
@@ -12,7 +27,7 @@ def test_single_response(mock_fetcher, last_response_content, mock_response_data
     assert not result.get("error")
     assert result.get("status") == definitions.STATUS_PROCESS_SUCCESS
     assert mock_fetcher.total_count == expected_count_self
-    assert mock_fetcher.data == expected_data
+    assert mock_fetcher.data.to_pylist() == expected_data
 
 
 def test_multiple_responses(
@@ -31,4 +46,71 @@ def test_multiple_responses(
     assert not result.get("error")
     assert result.get("status") == definitions.STATUS_PROCESS_SUCCESS
     assert mock_fetcher.total_count == expected_count
-    assert mock_fetcher.data == expected_data
+    # the rows come back as a table, with a column for every key of any row
+    assert isinstance(mock_fetcher.data, pa.Table)
+    assert non_null_rows(mock_fetcher.data) == expected_data
+
+
+def test_geometry(mock_fetcher, last_response_content):
+    last_response_content["features"][0]["geometry"] = {
+        "type": "Point",
+        "coordinates": [142.37, 38.3, 29.0],
+    }
+    mock_fetcher.responses = [MockApiResponse(content=last_response_content).json()]
+    mock_fetcher.process()
+
+    row = mock_fetcher.data.to_pylist()[0]
+    assert row["longitude"] == 142.37
+    assert row["latitude"] == 38.3
+    assert row["depth"] == 29.0
+    assert row["cell"] == cell_id(38.3, 142.37)
+
+
+def test_raw_pages(
+    mock_fetcher, first_response_content, last_response_content, expected_data
+):
+    # the pages as queried, decoded by the process stage
+    mock_fetcher.responses = [
+        json.dumps(first_response_content).encode("utf-8"),
+        json.dumps(last_response_content).encode("utf-8"),
+    ]
+    result = mock_fetcher.process()
+
+    assert result.get("status") == definitions.STATUS_PROCESS_SUCCESS
+    assert non_null_rows(mock_fetcher.data) == expected_data
+
+
+def test_processed_inline(mock_fetcher, last_response_content):
+    mock_fetcher.responses = [MockApiResponse(content=last_response_content).json()]
+    mock_fetcher.previous_fingerprint = "previous"
+
+    # without process workers the table isn't passed through shared memory
+    with patch.object(fetcher.fetch_stages, "process_workers", 0), patch(
+        "earthquake_data_layer.fetcher.share_table"
+    ) as mock_share, patch(
+        "earthquake_data_layer.fetcher.data_fingerprint",
+        wraps=fetcher.data_fingerprint,
+    ) as mock_fingerprint, patch(
+        "earthquake_data_layer.fetcher.add_rows_to_parquet", return_value=True
+    ), patch(
+        "earthquake_data_layer.fetcher.release_month"
+    ):
+        result = mock_fetcher.process()
+        mock_fetcher.upload_data()
+
+    mock_share.assert_not_called()
+    assert mock_fetcher.data.column("id").to_pylist() == [1]
+    # the fingerprint of the data is computed once
+    mock_fingerprint.assert_called_once()
+    assert result["fingerprint"] == mock_fetcher.fingerprint
+
+
+def test_table_from_rows_mixed_types():
+    table = table_from_rows(
+        [{"id": "a", "mag": True, "extra": 1}, {"id": "b", "mag": 2, "extra": "x"}]
+    )
+
+    # a column of the schema is converted to its type, other columns are dropped
+    assert table.column_names == ["id", "mag"]
+    assert table.schema.field("mag").type == RAW_DATA_SCHEMA.field("mag").type
+    assert table.column("mag").to_pylist() == [1.0, 2.0]
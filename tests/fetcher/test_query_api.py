@@ -1,8 +1,10 @@
-from unittest.mock import patch
+import json
+from unittest.mock import MagicMock, patch
 
 import requests
 
 from earthquake_data_layer import definitions
+from earthquake_data_layer.fetcher import page_count
 from tests.utils import MockApiResponse
 
 
@@ -43,3 +45,59 @@ def test_multiple_responses(
         assert not result.get("error")
         assert result.get("status") == definitions.STATUS_QUERY_API_SUCCESS
         assert len(mock_fetcher.responses) == len(expected_responses)
+
+
+def test_pages_not_decoded(mock_fetcher, first_response_content, last_response_content):
+    pages = [
+        json.dumps(first_response_content).encode("utf-8"),
+        json.dumps(last_response_content).encode("utf-8"),
+    ]
+    # the pages are decoded by the process stage, only their count is read
+    responses = [
+        MagicMock(content=page, **{"json.side_effect": AssertionError})
+        for page in pages
+    ]
+
+    with patch("earthquake_data_layer.fetcher.requests.get", side_effect=responses):
+        result = mock_fetcher.query_api(query_params={})
+
+    assert result.get("status") == definitions.STATUS_QUERY_API_SUCCESS
+    assert mock_fetcher.responses == pages
+
+
+def test_invalid_page_retried(mock_fetcher, last_response_content):
+    responses = [
+        MagicMock(content=b"<html>Service Unavailable</html>"),
+        MagicMock(content=json.dumps(last_response_content).encode("utf-8")),
+    ]
+
+    with patch("earthquake_data_layer.fetcher.requests.get", side_effect=responses):
+        result = mock_fetcher.query_api(query_params={})
+
+    assert result.get("status") == definitions.STATUS_QUERY_API_SUCCESS
+    assert len(mock_fetcher.responses) == 1
+
+
+def test_page_count():
+    assert page_count(b'{"metadata":{"status":200,"count":7},"features":[]}') == 7
+    # the metadata isn't at the head of the page, the page is decoded
+    assert page_count(b'{"features":[],"metadata":{"count":3}}') == 3
+    assert page_count({"metadata": {"count": 5}}) == 5
+
+
+def test_probe_count(mock_fetcher):
+    with patch("earthquake_data_layer.fetcher.requests.get") as mock_get:
+        mock_get.return_value.json.return_value = {"count": 42, "maxAllowed": 20000}
+        assert mock_fetcher.probe_count(updated_after="2021-01-01T00:00:00") == 42
+
+    assert mock_get.call_args.args[0] == definitions.API_COUNT_URL
+    assert mock_get.call_args.kwargs["params"]["updatedafter"] == "2021-01-01T00:00:00"
+
+
+def test_probe_count_fails(mock_fetcher):
+    with patch(
+        "earthquake_data_layer.fetcher.requests.get",
+        side_effect=requests.RequestException(),
+    ) as mock_get:
+        assert mock_fetcher.probe_count(retries=2) is None
+    assert mock_get.call_count == 3
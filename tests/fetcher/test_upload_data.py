@@ -1,7 +1,8 @@
 from unittest.mock import patch
 
-from earthquake_data_layer import definitions
+from earthquake_data_layer import definitions, settings, table
 from earthquake_data_layer.helpers import generate_raw_data_key_from_date
+from earthquake_data_layer.schema import RAW_DATA_SCHEMA
 
 
 def test_success(expected_key, expected_data, mock_fetcher):
@@ -19,8 +20,18 @@ def test_success(expected_key, expected_data, mock_fetcher):
 
         assert not result.get("error")
         assert result.get("status") == definitions.STATUS_UPLOAD_DATA_SUCCESS
+        assert set(mock_fetcher.changes["change"]) <= {definitions.CHANGE_INSERT}
 
-        mock_upload.assert_called_once_with(expected_data, expected_key)
+        mock_upload.assert_called_once_with(
+            expected_data,
+            expected_key,
+            sort_by=definitions.RAW_DATA_SORT_COLUMNS,
+            row_group_size=settings.RAW_DATA_ROW_GROUP_SIZE,
+            schema=RAW_DATA_SCHEMA,
+            metadata_collector=[],
+            previous_collector=[],
+            replace=False,
+        )
 
 
 def test_failed(expected_key, expected_data, mock_fetcher):
@@ -41,4 +52,45 @@ def test_failed(expected_key, expected_data, mock_fetcher):
         assert result.get("error") is True
         assert result.get("status") == definitions.STATUS_UPLOAD_DATA_FAIL
 
-        mock_upload.assert_called_once_with(expected_data, expected_key)
+        mock_upload.assert_called_once_with(
+            expected_data,
+            expected_key,
+            sort_by=definitions.RAW_DATA_SORT_COLUMNS,
+            row_group_size=settings.RAW_DATA_ROW_GROUP_SIZE,
+            schema=RAW_DATA_SCHEMA,
+            metadata_collector=[],
+            previous_collector=[],
+            replace=False,
+        )
+
+
+def test_table_layout(storage, mock_fetcher):
+    with patch(
+        "earthquake_data_layer.fetcher.settings.RAW_DATA_LAYOUT",
+        definitions.RAW_DATA_LAYOUT_TABLE,
+    ), patch("earthquake_data_layer.table.Storage", return_value=storage):
+        mock_fetcher.data = [{"id": "a", "time": 1}]
+        result = mock_fetcher.upload_data()
+        assert result.get("status") == definitions.STATUS_UPLOAD_DATA_SUCCESS
+        assert result["data_key"] == mock_fetcher.table_entry["key"]
+        assert table.commit({"2021-03": mock_fetcher.table_entry}, storage)
+
+        # the new file holds the committed rows and the new ones
+        mock_fetcher.data = [{"id": "b", "time": 2}]
+        mock_fetcher.upload_data()
+        assert mock_fetcher.table_entry["row_count"] == 2
+        assert mock_fetcher.changes["id"].tolist() == ["b"]
+        assert mock_fetcher.table_entry["key"] != result["data_key"]
+
+
+def test_fenced(expected_data, mock_fetcher):
+    # this process lost the lease it fetched the month under
+    mock_fetcher.data = expected_data
+    mock_fetcher.fence = lambda: False
+
+    with patch("earthquake_data_layer.fetcher.add_rows_to_parquet") as mock_upload:
+        result = mock_fetcher.upload_data()
+
+    assert result.get("error") is True
+    assert result.get("status") == definitions.STATUS_UPLOAD_DATA_FAIL
+    mock_upload.assert_not_called()
@@ -1,11 +1,27 @@
 # pylint: disable=redefined-outer-name
+import collections
+import json
 import math
+import threading
+import time
 from unittest.mock import patch
 
 import pytest
 
-from earthquake_data_layer import definitions, settings
-from earthquake_data_layer.helpers import fetch_months_data
+from earthquake_data_layer import definitions, helpers, settings
+from earthquake_data_layer.helpers import (
+    fetch_months_data,
+    generate_raw_data_key_from_date,
+)
+from earthquake_data_layer.leases import Claims
+from earthquake_data_layer.result_cache import query_cache
+
+
+@pytest.fixture(autouse=True)
+def no_retry_delay():
+    # the failed months are fetched again at once
+    with patch.object(settings, "COLLECTION_RETRY_BASE_DELAY", 0):
+        yield
 
 
 @pytest.fixture
@@ -108,7 +124,10 @@ def test_fail(storage, mock_metadata):
     # twice for every batch (one for row and one for metadata)
     expected_num_saves = 2 * math.ceil(len(dates) / settings.COLLECTION_BATCH_SIZE)
 
-    with patch("collect_dataset.Storage", return_value=storage):
+    # a single attempt per month, a failed month is recorded at once
+    with patch("collect_dataset.Storage", return_value=storage), patch.object(
+        settings, "COLLECTION_MONTH_ATTEMPTS", 1
+    ):
         with patch.object(storage, "save_object", return_value=True) as mock_save:
             with patch(
                 "earthquake_data_layer.fetcher.Fetcher.fetch_data",
@@ -126,3 +145,448 @@ def test_fail(storage, mock_metadata):
         ]
         assert all(dates_results)
         assert mock_save.call_count == expected_num_saves
+
+
+def test_unchanged_months_skipped(storage, mock_metadata):
+    rows = [{"id": "a", "updated": 1, "time": 1}, {"id": "b", "updated": 1, "time": 2}]
+
+    def fetch_data(fetcher, **_):
+        fetcher.data = list(rows)
+        fetcher.metadata = {
+            "start_date": fetcher.start_date,
+            "status": definitions.STATUS_PROCESS_SUCCESS,
+            "fingerprint": helpers.data_fingerprint(fetcher.data),
+        }
+        fetcher.metadata.update(fetcher.upload_data())
+        return fetcher.metadata
+
+    with patch(
+        "earthquake_data_layer.fetcher.Fetcher.fetch_data",
+        autospec=True,
+        side_effect=fetch_data,
+    ), patch("earthquake_data_layer.fetcher.release_month"), patch(
+        "earthquake_data_layer.helpers.Storage", return_value=storage
+    ), patch(
+        "earthquake_data_layer.fetcher.Storage", return_value=storage
+    ):
+        fetch_months_data([(2021, 3)], mock_metadata, storage)
+        assert helpers.load_fingerprints(storage) == {
+            "2021-03": helpers.data_fingerprint(rows)
+        }
+
+        # the same events again, nothing is written but the run's row
+        version = query_cache.version
+        with patch.object(
+            storage, "save_object", wraps=storage.save_object
+        ) as mock_save:
+            metadata = fetch_months_data([(2021, 3)], mock_metadata, storage)
+        assert [call.args[1] for call in mock_save.call_args_list] == [
+            definitions.BATCH_METADATA_KEY,
+            definitions.COLLECTION_METADATA_KEY,
+        ]
+        assert metadata["details"]["2021"]["3"] == definitions.STATUS_PIPELINE_SUCCESS
+        # cached query results are still current
+        assert query_cache.version == version
+
+        # a revised event is written
+        rows[0] = {"id": "a", "updated": 2, "time": 1}
+        with patch.object(
+            storage, "save_object", wraps=storage.save_object
+        ) as mock_save:
+            fetch_months_data([(2021, 3)], mock_metadata, storage)
+        assert generate_raw_data_key_from_date(2021, 3) in [
+            call.args[1] for call in mock_save.call_args_list
+        ]
+        assert query_cache.version > version
+
+
+def test_progress_recorded(storage, mock_metadata):
+    statuses = {
+        3: {"status": definitions.STATUS_UPLOAD_DATA_SUCCESS},
+        4: {"status": definitions.STATUS_UPLOAD_DATA_FAIL},
+    }
+
+    def fetch_data(self, **kwargs):
+        return statuses[int(self.month)]
+
+    with patch("earthquake_data_layer.helpers.Storage", return_value=storage):
+        with patch(
+            "earthquake_data_layer.fetcher.Fetcher.fetch_data",
+            autospec=True,
+            side_effect=fetch_data,
+        ):
+            metadata = fetch_months_data([(2021, 3), (2021, 4)], mock_metadata, storage)
+
+    assert metadata["progress"] == {
+        "2021-03": definitions.STATUS_UPLOAD_DATA_SUCCESS,
+        "2021-04": definitions.STATUS_UPLOAD_DATA_FAIL,
+    }
+
+
+def test_slow_month_holds_one_worker(storage, mock_metadata):
+    release = threading.Event()
+    checkpoints = list()
+
+    def fetch_data(self, **kwargs):
+        if int(self.month) == 1:
+            # the other months finish and are checkpointed while the first one is stuck
+            assert release.wait(5)
+        return {"status": definitions.STATUS_UPLOAD_DATA_SUCCESS}
+
+    def add_rows_to_parquet(rows, *args, **kwargs):
+        checkpoints.append(len(rows))
+        if len(rows) == 3:
+            release.set()
+        return True
+
+    with patch.object(settings, "COLLECTION_WORKERS", 2), patch.object(
+        settings, "COLLECTION_BATCH_SIZE", 1
+    ), patch(
+        "earthquake_data_layer.fetcher.Fetcher.fetch_data",
+        autospec=True,
+        side_effect=fetch_data,
+    ), patch(
+        "earthquake_data_layer.helpers.add_rows_to_parquet",
+        side_effect=add_rows_to_parquet,
+    ):
+        metadata = fetch_months_data(
+            [(2021, month) for month in range(1, 5)], mock_metadata, storage
+        )
+
+    # a checkpoint per month, the first month is the last one
+    assert checkpoints == [1, 2, 3, 4]
+    assert metadata["status"] == definitions.STATUS_COLLECTION_METADATA_COMPLETE
+
+
+def test_checkpoint_while_months_in_flight(storage, mock_metadata):
+    checkpointed = threading.Event()
+    checkpoints = list()
+
+    def fetch_data(self, **kwargs):
+        if int(self.month) == 2:
+            # February is still running when the time for a checkpoint is up
+            assert checkpointed.wait(5)
+        return {"status": definitions.STATUS_UPLOAD_DATA_SUCCESS}
+
+    def add_rows_to_parquet(rows, *args, **kwargs):
+        checkpoints.append(len(rows))
+        checkpointed.set()
+        return True
+
+    with patch.object(settings, "COLLECTION_WORKERS", 2), patch.object(
+        settings, "COLLECTION_CHECKPOINT_SECONDS", 0.1
+    ), patch(
+        "earthquake_data_layer.fetcher.Fetcher.fetch_data",
+        autospec=True,
+        side_effect=fetch_data,
+    ), patch(
+        "earthquake_data_layer.helpers.add_rows_to_parquet",
+        side_effect=add_rows_to_parquet,
+    ):
+        metadata = fetch_months_data([(2021, 1), (2021, 2)], mock_metadata, storage)
+
+    # January was checkpointed on time, not when February finished
+    assert checkpoints == [1, 2]
+    assert metadata["status"] == definitions.STATUS_COLLECTION_METADATA_COMPLETE
+
+
+def test_merge_metadata():
+    stored = {
+        "status": definitions.STATUS_COLLECTION_METADATA_INCOMPLETE,
+        "details": {
+            "2021": {
+                "3": definitions.STATUS_PIPELINE_SUCCESS,
+                "4": definitions.STATUS_PIPELINE_FAIL,
+            }
+        },
+        "change_sets": [1, 2],
+    }
+    metadata = {
+        "status": definitions.STATUS_COLLECTION_METADATA_INCOMPLETE,
+        "details": {
+            2021: {3: definitions.STATUS_PIPELINE_FAIL},
+            2022: {1: definitions.STATUS_PIPELINE_SUCCESS},
+        },
+        "change_sets": [3],
+    }
+
+    merged = helpers.merge_metadata(metadata, stored)
+    # a month succeeded if it succeeded in either
+    assert merged["details"] == {
+        "2021": {
+            "3": definitions.STATUS_PIPELINE_SUCCESS,
+            "4": definitions.STATUS_PIPELINE_FAIL,
+        },
+        "2022": {"1": definitions.STATUS_PIPELINE_SUCCESS},
+    }
+    assert merged["change_sets"] == [1, 2, 3]
+    assert merged["status"] == definitions.STATUS_COLLECTION_METADATA_INCOMPLETE
+
+    stored["status"] = definitions.STATUS_COLLECTION_METADATA_COMPLETE
+    merged = helpers.merge_metadata(metadata, stored)
+    assert merged["status"] == definitions.STATUS_COLLECTION_METADATA_COMPLETE
+
+
+def test_save_merged_metadata(storage):
+    key = "test/metadata.json"
+    first = {"details": {"2021": {"3": definitions.STATUS_PIPELINE_SUCCESS}}}
+    second = {"details": {"2021": {"4": definitions.STATUS_PIPELINE_SUCCESS}}}
+
+    assert helpers.save_merged_metadata(first, storage, key) == first
+    merged = helpers.save_merged_metadata(second, storage, key)
+    assert merged["details"]["2021"] == {
+        "3": definitions.STATUS_PIPELINE_SUCCESS,
+        "4": definitions.STATUS_PIPELINE_SUCCESS,
+    }
+    assert json.loads(storage.load_object(key).read().decode("utf-8")) == merged
+    assert helpers.saved_metadata(storage, key) == merged
+    assert helpers.unsaved_months([(2021, 3), (2021, 5)], merged) == [(2021, 5)]
+
+
+def test_checkpoint_keyed_like_merged_metadata(storage):
+    # the metadata was merged with the one saved by another process, its months are keyed by strings
+    metadata = {"details": {"2021": {"3": definitions.STATUS_PIPELINE_SUCCESS}}}
+
+    with patch("earthquake_data_layer.helpers.publish_batch", return_value=None):
+        helpers.checkpoint_months(
+            [((2021, 3), None, {"status": definitions.STATUS_UPLOAD_DATA_FAIL})],
+            metadata,
+            list(),
+            "run",
+            storage,
+            runs_key=None,
+            metadata_key=None,
+        )
+
+    assert metadata["details"]["2021"] == {"3": definitions.STATUS_PIPELINE_FAIL}
+    assert json.loads(json.dumps(metadata)) == metadata
+
+
+def test_checkpoint_not_published_without_claim(storage):
+    claims = Claims(prefix="test/claims", ttl=60, storage=storage, owner="a")
+    metadata = {"details": dict()}
+
+    with patch.object(claims, "claim", return_value=False), patch.object(
+        settings, "COLLECTION_PUBLISH_TIMEOUT", 0
+    ), patch("earthquake_data_layer.helpers.publish_batch") as mock_publish:
+        assert not helpers.checkpoint_months(
+            [((2021, 3), None, {"status": definitions.STATUS_UPLOAD_DATA_SUCCESS})],
+            metadata,
+            list(),
+            "run",
+            storage,
+            claims=claims,
+        )
+
+    mock_publish.assert_not_called()
+    assert metadata["details"]["2021"] == {"3": definitions.STATUS_PIPELINE_FAIL}
+
+
+@pytest.mark.usefixtures("conditional_writes")
+def test_months_claimed_by_another_process(storage, mock_metadata):
+    claims = Claims(prefix="test/claims", ttl=60, storage=storage, owner="a")
+    other = Claims(prefix="test/claims", ttl=60, storage=storage, owner="b")
+    # another process is fetching March
+    assert other.claim("2021-03")
+    fetched = list()
+
+    def fetch_data(self, **kwargs):
+        fetched.append(int(self.month))
+        return {"status": definitions.STATUS_UPLOAD_DATA_SUCCESS}
+
+    def sleep(_):
+        # the other process saves March while this one waits
+        helpers.save_merged_metadata(
+            {"details": {"2021": {"3": definitions.STATUS_PIPELINE_SUCCESS}}},
+            storage,
+            definitions.COLLECTION_METADATA_KEY,
+        )
+        other.close()
+
+    with patch(
+        "earthquake_data_layer.fetcher.Fetcher.fetch_data",
+        autospec=True,
+        side_effect=fetch_data,
+    ), patch(
+        "earthquake_data_layer.helpers.add_rows_to_parquet", return_value=True
+    ), patch(
+        "earthquake_data_layer.helpers.time.sleep", side_effect=sleep
+    ) as mock_sleep:
+        metadata = fetch_months_data(
+            [(2021, 3), (2021, 4)], mock_metadata, storage, claims=claims
+        )
+    claims.close()
+
+    # March was left to the other process
+    assert fetched == [4]
+    mock_sleep.assert_called_once_with(settings.COLLECTION_CLAIM_POLL_INTERVAL)
+    assert metadata["status"] == definitions.STATUS_COLLECTION_METADATA_COMPLETE
+    assert metadata["details"]["2021"] == {
+        "3": definitions.STATUS_PIPELINE_SUCCESS,
+        "4": definitions.STATUS_PIPELINE_SUCCESS,
+    }
+    # the claims were released
+    assert other.claim("2021-04")
+    other.close()
+
+
+@pytest.mark.usefixtures("conditional_writes")
+def test_expired_claim_fetched(storage, mock_metadata):
+    claims = Claims(prefix="test/claims", ttl=60, storage=storage, owner="a")
+    other = Claims(prefix="test/claims", ttl=60, storage=storage, owner="b")
+    assert other.claim("2021-03")
+    fetched = list()
+
+    def fetch_data(self, **kwargs):
+        fetched.append(int(self.month))
+        return {"status": definitions.STATUS_UPLOAD_DATA_SUCCESS}
+
+    def sleep(_):
+        # the other process died, its claim expired
+        lease = other.leases.pop("2021-03")
+        record, _ = lease.load()
+        record["expires_at"] = 0
+        storage.save_object(json.dumps(record).encode("utf-8"), lease.key)
+
+    with patch(
+        "earthquake_data_layer.fetcher.Fetcher.fetch_data",
+        autospec=True,
+        side_effect=fetch_data,
+    ), patch(
+        "earthquake_data_layer.helpers.add_rows_to_parquet", return_value=True
+    ), patch(
+        "earthquake_data_layer.helpers.time.sleep", side_effect=sleep
+    ):
+        metadata = fetch_months_data([(2021, 3)], mock_metadata, storage, claims=claims)
+    claims.close()
+    other.close()
+
+    assert fetched == [3]
+    assert metadata["status"] == definitions.STATUS_COLLECTION_METADATA_COMPLETE
+
+
+@pytest.mark.usefixtures("conditional_writes")
+def test_lost_claim_not_published(storage, mock_metadata):
+    claims = Claims(prefix="test/claims", ttl=60, storage=storage, owner="a")
+    fences = list()
+
+    def fetch_data(self, **kwargs):
+        fences.append(self.fence())
+        # the claim expired while March was fetched, another process claims it
+        claims.leases["2021-03"].expires_at = 0.0
+        return {"status": definitions.STATUS_UPLOAD_DATA_SUCCESS}
+
+    def sleep(_):
+        helpers.save_merged_metadata(
+            {"details": {"2021": {"3": definitions.STATUS_PIPELINE_SUCCESS}}},
+            storage,
+            definitions.COLLECTION_METADATA_KEY,
+        )
+
+    with patch(
+        "earthquake_data_layer.fetcher.Fetcher.fetch_data",
+        autospec=True,
+        side_effect=fetch_data,
+    ), patch(
+        "earthquake_data_layer.helpers.checkpoint_months"
+    ) as mock_checkpoint, patch(
+        "earthquake_data_layer.helpers.time.sleep", side_effect=sleep
+    ):
+        metadata = fetch_months_data([(2021, 3)], mock_metadata, storage, claims=claims)
+    claims.close()
+
+    assert fences == [True]
+    # March is published by the process that claimed it
+    mock_checkpoint.assert_not_called()
+    assert metadata["status"] == definitions.STATUS_COLLECTION_METADATA_COMPLETE
+
+
+def test_stopped_when_fence_lost(storage, mock_metadata):
+    leading = threading.Event()
+    leading.set()
+    fences = list()
+
+    def fetch_data(self, **kwargs):
+        fences.append(self.fence())
+        # the leader lost its lease during the fetch
+        leading.clear()
+        return {"status": definitions.STATUS_UPLOAD_DATA_SUCCESS}
+
+    with patch.object(settings, "COLLECTION_WORKERS", 1), patch(
+        "earthquake_data_layer.fetcher.Fetcher.fetch_data",
+        autospec=True,
+        side_effect=fetch_data,
+    ), patch("earthquake_data_layer.helpers.checkpoint_months") as mock_checkpoint:
+        metadata = fetch_months_data(
+            [(2021, 3), (2021, 4)],
+            mock_metadata,
+            storage,
+            fence=leading.is_set,
+        )
+
+    # nothing is published and no other month is started
+    assert fences == [True]
+    mock_checkpoint.assert_not_called()
+    assert metadata["status"] == definitions.STATUS_COLLECTION_METADATA_INCOMPLETE
+
+
+def test_failed_month_retried(storage, mock_metadata):
+    attempts = collections.Counter()
+
+    def fetch_data(self, **kwargs):
+        month = int(self.month)
+        attempts[month] += 1
+        # March fails once, April every time
+        if month == 4 or attempts[month] == 1 and month == 3:
+            return {"status": definitions.STATUS_UPLOAD_DATA_FAIL}
+        return {"status": definitions.STATUS_UPLOAD_DATA_SUCCESS}
+
+    with patch.object(settings, "COLLECTION_MONTH_ATTEMPTS", 3), patch(
+        "earthquake_data_layer.fetcher.Fetcher.fetch_data",
+        autospec=True,
+        side_effect=fetch_data,
+    ), patch(
+        "earthquake_data_layer.helpers.add_rows_to_parquet", return_value=True
+    ) as mock_save_rows:
+        metadata = fetch_months_data(
+            [(2021, month) for month in range(2, 5)], mock_metadata, storage
+        )
+
+    assert attempts == {2: 1, 3: 2, 4: 3}
+    assert metadata["details"]["2021"] == {
+        "2": definitions.STATUS_PIPELINE_SUCCESS,
+        "3": definitions.STATUS_PIPELINE_SUCCESS,
+        "4": definitions.STATUS_PIPELINE_FAIL,
+    }
+    assert metadata["status"] == definitions.STATUS_COLLECTION_METADATA_INCOMPLETE
+    # only the last attempt of a month is recorded
+    assert len(mock_save_rows.call_args.args[0]) == 3
+
+
+def test_retry_backoff(storage, mock_metadata):
+    attempted_at = list()
+
+    def fetch_data(self, **kwargs):
+        attempted_at.append(time.monotonic())
+        if len(attempted_at) == 1:
+            return {"status": definitions.STATUS_UPLOAD_DATA_FAIL}
+        return {"status": definitions.STATUS_UPLOAD_DATA_SUCCESS}
+
+    with patch.object(settings, "COLLECTION_RETRY_BASE_DELAY", 0.2), patch(
+        "earthquake_data_layer.fetcher.Fetcher.fetch_data",
+        autospec=True,
+        side_effect=fetch_data,
+    ), patch("earthquake_data_layer.helpers.add_rows_to_parquet", return_value=True):
+        metadata = fetch_months_data([(2021, 3)], mock_metadata, storage)
+
+    # the first retry waits between half the base delay and the base delay
+    assert 0.1 <= attempted_at[1] - attempted_at[0] < 0.5
+    assert metadata["status"] == definitions.STATUS_COLLECTION_METADATA_COMPLETE
+
+
+def test_retry_delay():
+    with patch.object(settings, "COLLECTION_RETRY_BASE_DELAY", 10), patch.object(
+        settings, "COLLECTION_RETRY_MAX_DELAY", 60
+    ):
+        for attempt, delay in [(1, 10), (2, 20), (3, 40), (4, 60), (10, 60)]:
+            assert delay / 2 <= helpers.retry_delay(attempt) <= delay
@@ -0,0 +1,32 @@
+from unittest.mock import patch
+
+from earthquake_data_layer import definitions
+from earthquake_data_layer.helpers import generate_raw_data_key_from_date
+
+
+def test_monthly_layout():
+    assert (
+        generate_raw_data_key_from_date(
+            2021, 3, layout=definitions.RAW_DATA_LAYOUT_MONTHLY
+        )
+        == "data/raw_data/2021/2021_03_raw_data.parquet"
+    )
+
+
+def test_hive_layout():
+    assert (
+        generate_raw_data_key_from_date(
+            2021, 3, layout=definitions.RAW_DATA_LAYOUT_HIVE
+        )
+        == "data/raw_data/year=2021/month=03/part-0.parquet"
+    )
+
+
+def test_default_layout_from_settings():
+    with patch(
+        "earthquake_data_layer.helpers.settings.RAW_DATA_LAYOUT",
+        definitions.RAW_DATA_LAYOUT_HIVE,
+    ):
+        assert generate_raw_data_key_from_date("2021", "03").startswith(
+            "data/raw_data/year=2021/month=03/"
+        )
@@ -0,0 +1,110 @@
+# pylint: disable=redefined-outer-name
+import datetime
+from unittest.mock import patch
+
+import pytest
+
+from earthquake_data_layer import definitions, helpers
+
+
+@pytest.fixture
+def runs(storage):
+    rows = [
+        {
+            "start_date": f"2020-{str(month).zfill(2)}-01",
+            "execution_date": datetime.datetime(2021, 1, 1),
+            "status": definitions.STATUS_UPLOAD_DATA_SUCCESS,
+            "count": 10,
+        }
+        for month in range(1, 5)
+    ]
+    # a failed run doesn't replace the last successful one
+    rows.append(
+        {
+            "start_date": "2020-01-01",
+            "execution_date": datetime.datetime(2021, 2, 1),
+            "status": definitions.STATUS_UPLOAD_DATA_FAIL,
+        }
+    )
+    assert helpers.add_rows_to_parquet(
+        rows, definitions.BATCH_METADATA_KEY, storage=storage
+    )
+    return rows
+
+
+def test_load_last_runs(storage, runs):
+    last_runs = helpers.load_last_runs(storage)
+    assert sorted(last_runs) == ["2020-01", "2020-02", "2020-03", "2020-04"]
+    assert last_runs["2020-01"]["count"] == 10
+
+
+def test_probe_months(storage, runs):
+    counts = {
+        # (start date, updated after): count
+        ("2020-01-01", None): 10,
+        ("2020-01-01", "2021-01-01T00:00:00"): 0,
+        ("2020-02-01", None): 11,
+        ("2020-03-01", None): 10,
+        ("2020-03-01", "2021-01-01T00:00:00"): 2,
+    }
+
+    def probe_count(fetcher, updated_after=None, **_):
+        return counts.get((fetcher.start_date, updated_after))
+
+    months = [(2020, month) for month in range(1, 7)]
+    probed = dict()
+    with patch(
+        "earthquake_data_layer.fetcher.Fetcher.probe_count",
+        autospec=True,
+        side_effect=probe_count,
+    ):
+        months_to_fetch = helpers.probe_months(
+            months, storage, today=datetime.date(2020, 7, 15), counts=probed
+        )
+
+    # 2020-01 didn't change, 2020-02 has a new event, 2020-03 revised events, 2020-04 couldn't be probed,
+    # 2020-05 was never fetched and 2020-06 is recent
+    assert months_to_fetch == [(2020, month) for month in range(2, 7)]
+    # the counts are kept for scheduling the months
+    assert probed == {(2020, 1): 10, (2020, 2): 11, (2020, 3): 10}
+
+
+def test_fingerprints_of_another_layout_ignored():
+    last_runs = {
+        "2020-01": {"fingerprint": "a"},
+        "2020-02": {"fingerprint": "b", "layout": definitions.RAW_DATA_LAYOUT_HIVE},
+        "2020-03": {"fingerprint": "c", "layout": definitions.RAW_DATA_LAYOUT_MONTHLY},
+    }
+
+    with patch(
+        "earthquake_data_layer.settings.RAW_DATA_LAYOUT",
+        definitions.RAW_DATA_LAYOUT_MONTHLY,
+    ):
+        assert helpers.load_fingerprints(last_runs=last_runs) == {
+            "2020-01": "a",
+            "2020-03": "c",
+        }
+
+
+def test_recent_months_from_current_date(storage):
+    today = datetime.date.today()
+    rows = [
+        {
+            "start_date": f"{today.year}-{str(today.month).zfill(2)}-01",
+            "execution_date": datetime.datetime(2020, 1, 1),
+            "status": definitions.STATUS_UPLOAD_DATA_SUCCESS,
+            "count": 10,
+        }
+    ]
+    assert helpers.add_rows_to_parquet(
+        rows, definitions.BATCH_METADATA_KEY, storage=storage
+    )
+
+    # the service started long ago, the current month is still recent
+    with patch(
+        "earthquake_data_layer.fetcher.Fetcher.probe_count", return_value=10
+    ) as mock_probe, patch.object(definitions, "TODAY", datetime.datetime(2020, 1, 15)):
+        months_to_fetch = helpers.probe_months([(today.year, today.month)], storage)
+
+    assert months_to_fetch == [(today.year, today.month)]
+    mock_probe.assert_not_called()
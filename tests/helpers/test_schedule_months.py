@@ -0,0 +1,68 @@
+from unittest.mock import patch
+
+from earthquake_data_layer import definitions, helpers, settings
+
+
+def test_schedule_months():
+    last_runs = {
+        "2020-01": {"count": 10},
+        "2020-02": {"count": 500},
+        "2020-03": {"count": float("nan")},
+        "2020-04": {"count": 10},
+    }
+    # the counts probed in this run replace the counts of the last runs
+    counts = {(2020, 1): 1000, (2020, 3): 50, (2021, 1): 7}
+
+    with patch("earthquake_data_layer.fetcher.Fetcher.probe_count") as mock_probe:
+        months = helpers.schedule_months(
+            [(2020, month) for month in range(1, 7)], last_runs, counts
+        )
+
+    mock_probe.assert_not_called()
+    # heaviest first, the months of an unknown cost with the heaviest and newest first, the same cost in the given
+    # order
+    assert months == [(2020, 6), (2020, 5), (2020, 1), (2020, 2), (2020, 3), (2020, 4)]
+
+
+def test_new_collection_newest_first():
+    months = [(year, month) for year in range(2019, 2021) for month in range(1, 13)]
+
+    with patch("earthquake_data_layer.fetcher.Fetcher.probe_count") as mock_probe:
+        scheduled = helpers.schedule_months(months, dict())
+
+    mock_probe.assert_not_called()
+    assert scheduled == months[::-1]
+
+
+def test_heavy_months_fetched_first(storage):
+    rows = [
+        {
+            "start_date": f"2020-{str(month).zfill(2)}-01",
+            "status": definitions.STATUS_UPLOAD_DATA_SUCCESS,
+            "count": count,
+        }
+        for month, count in [(1, 5), (2, 40000), (3, 0), (4, 900)]
+    ]
+    assert helpers.add_rows_to_parquet(
+        rows, definitions.BATCH_METADATA_KEY, storage=storage
+    )
+    fetched = list()
+
+    def fetch_data(fetcher, **_):
+        fetched.append(int(fetcher.month))
+        return {"status": definitions.STATUS_UPLOAD_DATA_SUCCESS}
+
+    with patch.object(settings, "COLLECTION_WORKERS", 1), patch(
+        "earthquake_data_layer.fetcher.Fetcher.fetch_data",
+        autospec=True,
+        side_effect=fetch_data,
+    ), patch("earthquake_data_layer.fetcher.Fetcher.probe_count") as mock_probe:
+        metadata = helpers.fetch_months_data(
+            [(2020, month) for month in range(1, 5)],
+            storage=storage,
+            metadata_key=None,
+        )
+
+    mock_probe.assert_not_called()
+    assert fetched == [2, 4, 1, 3]
+    assert metadata["status"] == definitions.STATUS_COLLECTION_METADATA_COMPLETE
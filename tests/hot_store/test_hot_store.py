@@ -0,0 +1,119 @@
+# pylint: disable=redefined-outer-name
+import datetime
+from unittest.mock import patch
+
+import pytest
+
+from earthquake_data_layer import definitions, reader
+from earthquake_data_layer.helpers import (
+    add_rows_to_parquet,
+    generate_raw_data_key_from_date,
+)
+from earthquake_data_layer.hot_store import HotStore, hot_months
+from earthquake_data_layer.spatial import cell_id
+
+TODAY = datetime.date(2021, 3, 15)
+
+
+def make_event(event_id, date, longitude, latitude, mag):
+    return {
+        "id": event_id,
+        "mag": mag,
+        "time": reader.to_epoch_ms(date) + 1000,
+        "longitude": longitude,
+        "latitude": latitude,
+        "cell": cell_id(latitude, longitude),
+    }
+
+
+@pytest.fixture
+def uploaded_months(storage):
+    for month in (1, 2, 3):
+        events = [
+            make_event(f"jp{month}_{day}", f"2021-0{month}-{day:02d}", 142.0, 38.0, 4.0)
+            for day in range(1, 11)
+        ]
+        events += [
+            make_event(
+                f"cl{month}_{day}", f"2021-0{month}-{day:02d}", -71.0, -33.0, 6.0
+            )
+            for day in range(1, 11)
+        ]
+        assert add_rows_to_parquet(
+            events,
+            generate_raw_data_key_from_date(2021, month),
+            storage=storage,
+            sort_by=definitions.RAW_DATA_SORT_COLUMNS,
+            row_group_size=5,
+        )
+
+
+def test_hot_months():
+    assert hot_months(2, TODAY) == [(2021, 3), (2021, 2), (2021, 1)]
+
+
+def test_query(storage, uploaded_months):
+    store = HotStore(months=1, memory_budget=1024 * 1024)
+    assert store.refresh(storage, TODAY)
+    assert store.state.months == ["2021-02", "2021-03"]
+
+    times = store.state.arrays["time"]
+    assert (times[:-1] <= times[1:]).all()
+
+    time_range = reader.time_range_of("2021-02-05", "2021-03-02")
+    result = store.query(time_range, bbox=(140.0, 30.0, 150.0, 40.0))
+    assert result.column("id").to_pylist() == [f"jp2_{day}" for day in range(5, 11)] + [
+        "jp3_1",
+        "jp3_2",
+    ]
+
+    result = store.query(time_range, mag_range=(5.0, 7.0), columns=["id"])
+    assert result.column_names == ["id"]
+    assert len(result) == 8
+
+    # the same answer as the bucket
+    expected = reader.read_events(
+        "2021-02-05", "2021-03-02", mag_range=(5.0, 7.0), storage=storage
+    )
+    assert sorted(result.column("id").to_pylist()) == sorted(expected["id"])
+
+
+def test_query_outside_loaded_months(storage, uploaded_months):
+    store = HotStore(months=1, memory_budget=1024 * 1024)
+    assert store.query(reader.time_range_of("2021-03-01", "2021-03-02")) is None
+
+    assert store.refresh(storage, TODAY)
+    assert store.query(reader.time_range_of("2021-01-31", "2021-03-02")) is None
+    # past the newest loaded month, e.g. the month changed since the refresh
+    assert store.query(reader.time_range_of("2021-03-01", "2021-04-02")) is None
+    assert store.query(reader.time_range_of("2021-03-01", "2021-03-31")) is not None
+
+
+def test_refresh_loads_current_month(storage, uploaded_months):
+    store = HotStore(months=1, memory_budget=1024 * 1024)
+    assert store.refresh(storage)
+    today = datetime.date.today()
+    assert store.state.months[-1] == f"{today.year}-{today.month:02d}"
+
+
+def test_memory_budget(storage, uploaded_months):
+    one_month = HotStore(months=0, memory_budget=1024 * 1024)
+    assert one_month.refresh(storage, TODAY)
+
+    # room for a single month, the older ones are dropped
+    store = HotStore(months=2, memory_budget=one_month.state.nbytes + 1)
+    assert store.refresh(storage, TODAY)
+    assert store.state.months == ["2021-03"]
+    assert store.query(reader.time_range_of("2021-02-01", "2021-03-31")) is None
+
+
+def test_failed_refresh_keeps_state(storage, uploaded_months):
+    store = HotStore(months=1, memory_budget=1024 * 1024)
+    assert store.refresh(storage, TODAY)
+    state = store.state
+
+    with patch(
+        "earthquake_data_layer.hot_store.scan_events", side_effect=Exception("error")
+    ):
+        assert not store.refresh(storage, TODAY)
+    assert store.state is state
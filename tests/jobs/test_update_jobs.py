@@ -0,0 +1,113 @@
+# pylint: disable=redefined-outer-name
+import threading
+from unittest.mock import patch
+
+import pytest
+
+from earthquake_data_layer import definitions
+from earthquake_data_layer.jobs import UpdateJobQueue
+
+
+@pytest.fixture
+def queue():
+    return UpdateJobQueue(max_workers=1, jobs_kept=2)
+
+
+@pytest.fixture
+def release():
+    return threading.Event()
+
+
+@pytest.fixture
+def blocking_update(release):
+    """an update that fetched one of its two months and waits to be released"""
+    started = threading.Event()
+
+    def update_dataset(last_year, last_month, metadata, fence):
+        metadata["progress"] = {
+            "2021-03": definitions.STATUS_UPLOAD_DATA_SUCCESS,
+            "2021-02": definitions.STATUS_MONTH_PENDING,
+        }
+        started.set()
+        release.wait(5)
+        metadata["progress"]["2021-02"] = definitions.STATUS_UPLOAD_DATA_SUCCESS
+        metadata["status"] = definitions.STATUS_COLLECTION_METADATA_COMPLETE
+        return metadata
+
+    with patch("update_dataset.update_dataset", side_effect=update_dataset), patch(
+        "earthquake_data_layer.hot_store.hot_store"
+    ) as mock_store:
+        yield started, mock_store
+
+
+def wait_for(queue, job_id):
+    queue.executor.submit(lambda: None).result(5)
+    return queue.get(job_id)
+
+
+def test_progress_reported(queue, release, blocking_update):
+    started, mock_store = blocking_update
+
+    job = queue.submit(2021, 3)
+    assert started.wait(5)
+
+    report = job.report()
+    assert report["status"] == definitions.JOB_STATUS_RUNNING
+    assert report["completed_months"] == 1
+    assert report["total_months"] == 2
+    assert "result" not in report
+
+    release.set()
+    job = wait_for(queue, job.job_id)
+    report = job.report()
+    assert report["status"] == definitions.JOB_STATUS_SUCCEEDED
+    assert report["completed_months"] == 2
+    assert report["result"]["status"] == definitions.STATUS_COLLECTION_METADATA_COMPLETE
+    mock_store.refresh.assert_called_once()
+
+
+def test_same_date_not_submitted_twice(queue, release, blocking_update):
+    started, _ = blocking_update
+
+    job = queue.submit(2021, 3)
+    assert started.wait(5)
+    assert queue.submit(2021, 3) is job
+    # another date waits for the worker
+    other = queue.submit(2021, 4)
+    assert other is not job
+    assert other.status == definitions.JOB_STATUS_QUEUED
+
+    release.set()
+    wait_for(queue, other.job_id)
+    assert queue.submit(2021, 3) is not job
+
+
+def test_failed_job(queue):
+    with patch(
+        "update_dataset.update_dataset",
+        side_effect=RuntimeError("Some error"),
+    ):
+        job = queue.submit(2021, 3)
+        job = wait_for(queue, job.job_id)
+
+    report = job.report()
+    assert report["status"] == definitions.JOB_STATUS_FAILED
+    assert report["error"] == "RuntimeError: Some error"
+    assert report["finished_at"] is not None
+
+
+def test_old_jobs_dropped(queue):
+    with patch("update_dataset.update_dataset"), patch(
+        "earthquake_data_layer.hot_store.hot_store"
+    ):
+        job_ids = list()
+        for month in range(1, 5):
+            job_ids.append(queue.submit(2021, month).job_id)
+            wait_for(queue, job_ids[-1])
+
+    assert [queue.get(job_id) is not None for job_id in job_ids] == [
+        False,
+        False,
+        True,
+        True,
+    ]
@@ -0,0 +1,190 @@
+import json
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
+from earthquake_data_layer.exceptions import ClaimTimeoutError
+from earthquake_data_layer.leases import Claims, LeaderElection, Lease
+
+KEY = "leases/test.json"
+
+pytestmark = pytest.mark.usefixtures("conditional_writes")
+
+
+def test_acquire_and_renew(storage):
+    lease = Lease(KEY, "a", ttl=60, storage=storage)
+    other = Lease(KEY, "b", ttl=60, storage=storage)
+
+    assert lease.acquire()
+    assert lease.held
+    assert not other.acquire()
+    assert not other.held
+
+    # the owner renews its lease
+    acquired_at = lease.load()[0]["acquired_at"]
+    assert lease.acquire()
+    record, _ = lease.load()
+    assert record["owner"] == "a"
+    assert record["acquired_at"] == acquired_at
+
+
+def test_expired_lease_taken(storage):
+    lease = Lease(KEY, "a", ttl=60, storage=storage)
+    other = Lease(KEY, "b", ttl=60, storage=storage)
+    assert lease.acquire()
+
+    # a wasn't renewed in time
+    record, _ = lease.load()
+    record["expires_at"] = time.time() - 1
+    storage.save_object(json.dumps(record).encode("utf-8"), KEY)
+
+    assert other.acquire()
+    assert not lease.acquire()
+    assert not lease.held
+    assert lease.load()[0]["owner"] == "b"
+
+
+def test_release(storage):
+    lease = Lease(KEY, "a", ttl=60, storage=storage)
+    other = Lease(KEY, "b", ttl=60, storage=storage)
+    assert lease.acquire()
+
+    # only the owner releases the lease
+    assert not other.release()
+    assert lease.release()
+    assert not lease.held
+    assert other.acquire()
+
+
+def test_refused_without_conditional_writes(storage):
+    lease = Lease(KEY, "a", ttl=60, storage=storage)
+    with patch(
+        "earthquake_data_layer.storage.Storage.enforces_conditional_writes",
+        return_value=False,
+    ):
+        assert not lease.acquire()
+        assert not LeaderElection(
+            KEY, storage=storage, owner="a", enabled=True
+        ).try_to_lead()
+    assert lease.load() == (None, None)
+
+
+def test_leader_election(storage):
+    leader = LeaderElection(KEY, ttl=0.3, storage=storage, owner="a", enabled=True)
+    follower = LeaderElection(KEY, ttl=0.3, storage=storage, owner="b", enabled=True)
+
+    assert leader.try_to_lead()
+    assert not follower.try_to_lead()
+
+    # the heartbeat keeps the lease past its ttl
+    time.sleep(0.6)
+    assert leader.is_leader
+    assert not follower.try_to_lead()
+
+    leader.resign()
+    assert not leader.is_leader
+    assert follower.try_to_lead()
+    follower.resign()
+
+
+def test_single_writer_leads(storage):
+    election = LeaderElection(KEY, storage=storage, owner="a", enabled=False)
+    with patch(
+        "earthquake_data_layer.storage.Storage.enforces_conditional_writes",
+        return_value=False,
+    ) as mock_probe:
+        assert election.try_to_lead()
+        assert election.is_leader
+        election.resign()
+        assert election.is_leader
+
+    # neither a lease nor the probe is written
+    mock_probe.assert_not_called()
+    assert storage.list_objects(prefix="leases") == []
+
+
+def test_claims(storage):
+    claims = Claims(prefix="leases/claims", ttl=60, storage=storage, owner="a")
+    other = Claims(prefix="leases/claims", ttl=60, storage=storage, owner="b")
+
+    assert claims.claim("2021-03")
+    assert not other.claim("2021-03")
+    assert other.claim("2021-04")
+
+    claims.release("2021-03")
+    assert other.claim("2021-03")
+
+    # closing releases the claims
+    other.close()
+    assert claims.claim("2021-03")
+    assert claims.claim("2021-04")
+    claims.close()
+
+
+def test_claim_lost(storage):
+    claims = Claims(prefix="leases/claims", ttl=60, storage=storage, owner="a")
+    assert claims.claim("2021-03")
+    assert claims.holds("2021-03")
+    assert not claims.holds("2021-04")
+
+    # the claim expired before it was renewed
+    claims.leases["2021-03"].expires_at = 0.0
+    assert not claims.holds("2021-03")
+    claims.close()
+
+
+def test_claims_renewed(storage):
+    claims = Claims(prefix="leases/claims", ttl=0.3, storage=storage, owner="a")
+    other = Claims(prefix="leases/claims", ttl=0.3, storage=storage, owner="b")
+    assert claims.claim("2021-03")
+
+    # the heartbeat keeps the claim past its ttl
+    time.sleep(0.6)
+    assert not other.claim("2021-03")
+
+    # the claims of a process that stopped renewing them expire
+    claims.stopped.set()
+    claims.heartbeat.join()
+    time.sleep(0.4)
+    assert other.claim("2021-03")
+    other.close()
+
+
+def test_hold(storage):
+    claims = Claims(prefix="leases/claims", ttl=60, storage=storage, owner="a")
+    other = Claims(prefix="leases/claims", ttl=60, storage=storage, owner="b")
+    assert claims.claim("publish")
+
+    held = threading.Event()
+
+    def hold():
+        with other.hold("publish", retry_interval=0.05):
+            held.set()
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    # waits for the claim to be released
+    assert not held.wait(0.3)
+    claims.release("publish")
+    thread.join(5)
+    assert held.is_set()
+
+    # released after the block
+    assert claims.claim("publish")
+    claims.close()
+    other.close()
+
+
+def test_hold_timeout(storage):
+    claims = Claims(prefix="leases/claims", ttl=60, storage=storage, owner="a")
+    other = Claims(prefix="leases/claims", ttl=60, storage=storage, owner="b")
+    assert other.claim("publish")
+
+    # the holder died, its claim outlives the wait
+    with pytest.raises(ClaimTimeoutError):
+        with claims.hold("publish", retry_interval=0.01, timeout=0.05):
+            pass
+    assert not claims.holds("publish")
+    other.close()
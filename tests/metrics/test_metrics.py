@@ -0,0 +1,98 @@
+# pylint: disable=unused-import,redefined-outer-name
+from unittest.mock import patch
+
+import pytest
+
+from earthquake_data_layer import metrics
+from earthquake_data_layer.metrics import Counter, Gauge, Histogram, Registry
+from tests.fetcher.conftest import (
+    data_point_1,
+    data_point_2,
+    first_response_content,
+    last_response_content,
+    mock_end_date,
+    mock_fetcher,
+    mock_response_data,
+    mock_start_date,
+)
+from tests.utils import MockApiResponse
+
+
+def test_render():
+    registry = Registry()
+    counter = registry.register(Counter("test_total", "A counter.", ("kind",)))
+    gauge = registry.register(Gauge("test_depth", "A gauge."))
+    histogram = registry.register(
+        Histogram("test_seconds", "A histogram.", buckets=(0.1, 1.0))
+    )
+
+    counter.inc(kind='a"b')
+    counter.inc(2, kind='a"b')
+    gauge.inc(3)
+    gauge.dec()
+    for value in (0.05, 0.1, 0.5, 5.0):
+        histogram.observe(value)
+
+    assert registry.render() == (
+        "# HELP test_total A counter.\n"
+        "# TYPE test_total counter\n"
+        'test_total{kind="a\\"b"} 3.0\n'
+        "# HELP test_depth A gauge.\n"
+        "# TYPE test_depth gauge\n"
+        "test_depth 2.0\n"
+        "# HELP test_seconds A histogram.\n"
+        "# TYPE test_seconds histogram\n"
+        'test_seconds_bucket{le="0.1"} 2\n'
+        'test_seconds_bucket{le="1.0"} 3\n'
+        'test_seconds_bucket{le="+Inf"} 4\n'
+        "test_seconds_sum 5.65\n"
+        "test_seconds_count 4\n"
+    )
+
+
+def test_labels_validated():
+    counter = Counter("test_total", "A counter.", ("kind",))
+    with pytest.raises(ValueError):
+        counter.inc(other="a")
+
+    registry = Registry()
+    registry.register(counter)
+    with pytest.raises(ValueError):
+        registry.register(Counter("test_total", "Again."))
+
+
+def test_metric_is_abstract():
+    with pytest.raises(TypeError):
+        metrics.Metric("test_total", "A metric.")
+
+
+def test_fetch_instrumented(
+    mock_fetcher, first_response_content, last_response_content
+):
+    stages = ("query_api", "process", "upload_data", "archive_responses")
+    before = {stage: metrics.FETCH_STAGE_SECONDS.count(stage=stage) for stage in stages}
+    requests_before = metrics.API_REQUEST_SECONDS.count(endpoint="query")
+
+    with patch("earthquake_data_layer.fetcher.requests.get") as mock_response, patch(
+        "earthquake_data_layer.fetcher.add_rows_to_parquet", return_value=True
+    ), patch("earthquake_data_layer.fetcher.write_archive", return_value="key"):
+        mock_response.side_effect = [
+            MockApiResponse(content=first_response_content),
+            MockApiResponse(content=last_response_content),
+        ]
+        mock_fetcher.fetch_data()
+
+    for stage in stages:
+        assert metrics.FETCH_STAGE_SECONDS.count(stage=stage) == before[stage] + 1
+    assert metrics.API_REQUEST_SECONDS.count(endpoint="query") == requests_before + 2
+
+
+def test_storage_bytes_counted(storage):
+    uploaded = metrics.STORAGE_UPLOADED_BYTES.value()
+    downloaded = metrics.STORAGE_DOWNLOADED_BYTES.value()
+
+    assert storage.save_object(b"12345", "data/test_metrics")
+    assert storage.load_object("data/test_metrics").read() == b"12345"
+
+    assert metrics.STORAGE_UPLOADED_BYTES.value() == uploaded + 5
+    assert metrics.STORAGE_DOWNLOADED_BYTES.value() == downloaded + 5
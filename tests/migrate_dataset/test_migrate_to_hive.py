@@ -0,0 +1,33 @@
+# pylint: disable=redefined-outer-name
+import pandas as pd
+
+from earthquake_data_layer import catalog, definitions, helpers
+from migrate_dataset import migrate_to_hive
+
+
+def test_migrate(storage):
+    for month in (1, 2):
+        key = helpers.generate_raw_data_key_from_date(
+            2020, month, layout=definitions.RAW_DATA_LAYOUT_MONTHLY
+        )
+        df = pd.DataFrame(
+            {"id": ["b", "a"], "latitude": [10.0, -10.0], "longitude": [5.0, 5.0]}
+        )
+        assert helpers.upload_df(df, key, storage)
+
+    result = migrate_to_hive(storage, remove_old=True)
+
+    assert len(result["migrated"]) == 2
+    assert not result["failed"]
+    assert storage.list_objects(prefix="data/raw_data/2020/") == []
+
+    new_key = helpers.generate_raw_data_key_from_date(
+        2020, 1, layout=definitions.RAW_DATA_LAYOUT_HIVE
+    )
+    migrated = pd.read_parquet(storage.load_object(new_key))
+    # sorted by the computed spatial cell
+    assert list(migrated["id"]) == ["a", "b"]
+    assert migrated["cell"].notna().all()
+
+    summary = catalog.load_dataset_summary(storage)
+    assert summary.num_rows == 4
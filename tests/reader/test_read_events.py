@@ -0,0 +1,157 @@
+# pylint: disable=redefined-outer-name
+import io
+from unittest.mock import patch
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from earthquake_data_layer import definitions, reader
+from earthquake_data_layer.catalog import update_dataset_summary
+from earthquake_data_layer.helpers import (
+    add_rows_to_parquet,
+    generate_raw_data_key_from_date,
+)
+from earthquake_data_layer.schema import RAW_DATA_SCHEMA
+from tests.utils import make_event
+
+
+@pytest.fixture
+def events():
+    # two clusters: japan and chile
+    japan = [make_event(f"jp{i}", i + 1, 142.0 + i / 10, 38.0) for i in range(10)]
+    chile = [make_event(f"cl{i}", i + 1, -71.0 - i / 10, -33.0) for i in range(10)]
+    return chile + japan
+
+
+@pytest.fixture
+def uploaded_events(storage, events):
+    key = generate_raw_data_key_from_date(2021, 3)
+    assert add_rows_to_parquet(
+        events,
+        key,
+        storage=storage,
+        sort_by=definitions.RAW_DATA_SORT_COLUMNS,
+        row_group_size=5,
+    )
+    return key
+
+
+def test_rows_sorted_by_cell(storage, uploaded_events):
+    table = pq.read_table(storage.load_object(uploaded_events))
+    cells = table.column("cell").to_pylist()
+    assert cells == sorted(cells)
+
+
+def test_bbox_and_time(storage, uploaded_events):
+    result = reader.read_events(
+        "2021-03-03",
+        "2021-03-05",
+        bbox=(140.0, 30.0, 150.0, 40.0),
+        columns=["id", "mag"],
+        storage=storage,
+    )
+
+    assert sorted(result["id"]) == ["jp2", "jp3", "jp4"]
+    assert list(result.columns) == ["id", "mag"]
+
+
+def test_row_groups_skipped(storage, uploaded_events):
+    source = storage.load_object(uploaded_events)
+    data = source.read()
+    read_row_groups = pq.ParquetFile.read_row_groups
+
+    with patch.object(
+        pq.ParquetFile, "read_row_groups", autospec=True, side_effect=read_row_groups
+    ) as mock_read:
+        table = reader.read_parquet_filtered(
+            io.BytesIO(data), bbox=(140.0, 30.0, 150.0, 40.0)
+        )
+
+    assert table.num_rows == 10
+    # 4 row groups in the file, the chile ones are never decoded
+    assert pq.ParquetFile(io.BytesIO(data)).metadata.num_row_groups == 4
+    assert len(mock_read.call_args[0][1]) == 2
+
+
+def test_all_row_groups_skipped(storage, uploaded_events):
+    table = reader.read_parquet_filtered(
+        storage.load_object(uploaded_events), bbox=(0.0, 0.0, 10.0, 10.0)
+    )
+    assert table is None
+
+
+def test_filter_mask_on_arrow():
+    table = pa.table(
+        {
+            "time": [1, 2, 3, 4, 5],
+            "longitude": [175.0, -175.0, 0.0, None, 179.0],
+            "latitude": [0.0, 0.0, 0.0, 0.0, 0.0],
+            "mag": [4.0, 5.0, 4.0, 4.0, None],
+        }
+    )
+
+    mask = reader.filter_mask(
+        table, time_range=(1, 5), bbox=(170.0, -10.0, -170.0, 10.0), mag_range=(3, 6)
+    )
+
+    # across the antimeridian, a missing longitude never matches and the last row is out of time
+    assert mask.to_pylist() == [True, True, False, False, False]
+    assert reader.filter_mask(table) is None
+
+
+def test_missing_months(storage, uploaded_events):
+    result = reader.read_events("2021-01-01", "2021-04-30", storage=storage)
+    assert len(result) == 20
+
+
+def test_months_in_range():
+    assert reader.months_in_range("2020-11-15", "2021-02-01") == [
+        (2020, 11),
+        (2020, 12),
+        (2021, 1),
+        (2021, 2),
+    ]
+
+
+def test_hive_layout_planned_from_summary(storage, events):
+    with patch(
+        "earthquake_data_layer.helpers.settings.RAW_DATA_LAYOUT",
+        definitions.RAW_DATA_LAYOUT_HIVE,
+    ):
+        key = generate_raw_data_key_from_date(2021, 3)
+        metadata_collector = list()
+        assert add_rows_to_parquet(
+            events,
+            key,
+            storage=storage,
+            sort_by=definitions.RAW_DATA_SORT_COLUMNS,
+            row_group_size=5,
+            schema=RAW_DATA_SCHEMA,
+            metadata_collector=metadata_collector,
+        )
+        assert update_dataset_summary({key: metadata_collector[0]}, storage)
+
+        months = reader.months_in_range("2021-02-01", "2021-03-31")
+        time_range = (
+            reader.to_epoch_ms("2021-02-01"),
+            reader.to_epoch_ms("2021-04-01"),
+        )
+        plan = reader.plan_scan(months, time_range, (140.0, 30.0, 150.0, 40.0), storage)
+        assert plan == [(key, [2, 3])]
+
+        # the bucket is not listed for planning, only the planned file is loaded
+        with patch.object(
+            storage, "list_objects", wraps=storage.list_objects
+        ) as mock_list:
+            result = reader.read_events(
+                "2021-02-01",
+                "2021-03-31",
+                bbox=(140.0, 30.0, 150.0, 40.0),
+                storage=storage,
+            )
+        assert len(result) == 10
+        assert {call.args[1] for call in mock_list.call_args_list} == {
+            definitions.DATASET_METADATA_KEY,
+            key,
+        }
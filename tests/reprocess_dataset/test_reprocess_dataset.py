@@ -0,0 +1,69 @@
+# pylint: disable=redefined-outer-name
+from unittest.mock import patch
+
+import pandas as pd
+import pytest
+
+from earthquake_data_layer import archive, changelog, definitions, helpers
+from reprocess_dataset import reprocess_dataset
+
+
+def make_response(*event_ids):
+    return {
+        "metadata": {"status": 200, "count": len(event_ids)},
+        "features": [
+            {
+                "id": event_id,
+                "properties": {"mag": 4.0, "time": 1, "updated": 1},
+                "geometry": {"type": "Point", "coordinates": [142.0, 38.0, 10.0]},
+            }
+            for event_id in event_ids
+        ],
+    }
+
+
+@pytest.fixture
+def archived(storage):
+    archive.write_archive([make_response("a", "b")], 2021, 3, storage)
+    archive.write_archive([make_response("c")], 2021, 4, storage)
+
+    # the stored march has a stale row and lacks the columns added since
+    key = helpers.generate_raw_data_key_from_date(2021, 3)
+    helpers.upload_df(pd.DataFrame([{"id": "stale", "mag": 1.0}]), key, storage)
+
+
+def test_reprocess(storage, archived):
+    with patch("earthquake_data_layer.helpers.Storage", return_value=storage), patch(
+        "earthquake_data_layer.fetcher.release_month"
+    ), patch(
+        "earthquake_data_layer.fetcher.requests.get",
+        side_effect=AssertionError("the API was queried"),
+    ):
+        summary = reprocess_dataset(processes=1, storage=storage)
+
+    assert summary["reprocessed"] == ["2021-03", "2021-04"]
+    assert not summary["failed"]
+
+    march = pd.read_parquet(
+        storage.load_object(helpers.generate_raw_data_key_from_date(2021, 3))
+    )
+    assert sorted(march["id"]) == ["a", "b"]
+    assert march["cell"].notna().all()
+
+    # the rebuild is published like a collection
+    _, changes = changelog.load_change_sets(storage=storage)[0]
+    assert dict(zip(changes["id"], changes["change"]))["stale"] == (
+        definitions.CHANGE_DELETE
+    )
+
+
+def test_missing_archive(storage, archived):
+    with patch("earthquake_data_layer.helpers.Storage", return_value=storage), patch(
+        "earthquake_data_layer.fetcher.release_month"
+    ):
+        summary = reprocess_dataset(
+            [(2021, 4), (2021, 5)], processes=1, storage=storage
+        )
+
+    assert summary["reprocessed"] == ["2021-04"]
+    assert summary["failed"] == ["2021-05"]
@@ -0,0 +1,99 @@
+from unittest.mock import patch
+
+import pytest
+
+from earthquake_data_layer import definitions
+from earthquake_data_layer.result_cache import CachedResult, ResultCache, etag_matches
+
+
+def test_key_normalized():
+    cache = ResultCache()
+    assert cache.key("/events", 0, {"a": 4.5, "b": None}) == cache.key(
+        "/events", 0, {"b": None, "a": 4.50}
+    )
+    assert cache.key("/events", 0, {"a": 4.5}) != cache.key("/events", 1, {"a": 4.5})
+    assert cache.key("/events", 0, {"a": 4.5}) != cache.key("/aggregate", 0, {"a": 4.5})
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        (None, False),
+        ('"abc"', True),
+        ('W/"abc"', True),
+        ('"xyz", "abc"', True),
+        ("*", True),
+        ('"xyz"', False),
+    ],
+)
+def test_etag_matches(header, expected):
+    assert etag_matches('"abc"', header) is expected
+
+
+def test_lru_eviction():
+    cache = ResultCache(max_bytes=10, max_entry_bytes=10)
+    assert cache.put("a", 0, CachedResult(b"1234", "text/plain"))
+    assert cache.put("b", 0, CachedResult(b"1234", "text/plain"))
+    # a is now the most recently used
+    assert cache.get("a")
+    assert cache.put("c", 0, CachedResult(b"1234", "text/plain"))
+
+    assert cache.get("b") is None
+    assert cache.get("a") and cache.get("c")
+    assert cache.nbytes == 8
+
+
+def test_put_rejected():
+    cache = ResultCache(max_bytes=10, max_entry_bytes=5)
+    assert not cache.put("a", 0, CachedResult(b"123456", "text/plain"))
+
+    cache.bump_version()
+    # computed before the version changed
+    assert not cache.put("a", 0, CachedResult(b"1234", "text/plain"))
+    assert cache.put("a", 1, CachedResult(b"1234", "text/plain"))
+
+
+def test_bump_version_empties():
+    cache = ResultCache()
+    assert cache.put("a", 0, CachedResult(b"1234", "text/plain"))
+    cache.bump_version()
+    assert cache.get("a") is None
+    assert cache.nbytes == 0
+
+
+def test_tee():
+    cache = ResultCache(max_bytes=10, max_entry_bytes=5)
+    assert list(cache.tee("a", 0, "text/plain", iter([b"12", b"34"]))) == [
+        b"12",
+        b"34",
+    ]
+    assert cache.get("a").body == b"1234"
+
+    # too large, streamed but not cached
+    assert len(list(cache.tee("b", 0, "text/plain", iter([b"123", b"456"])))) == 2
+    assert cache.get("b") is None
+
+
+def test_revalidated_from_storage(storage):
+    cache = ResultCache(revalidate_interval=0)
+    cache.revalidate(storage)
+    assert cache.put("a", cache.version, CachedResult(b"1234", "text/plain"))
+
+    cache.revalidate(storage)
+    assert cache.get("a")
+
+    # another process committed a snapshot
+    assert storage.save_object(b"{}", definitions.TABLE_POINTER_KEY)
+    cache.revalidate(storage)
+    assert cache.get("a") is None
+
+
+def test_revalidate_interval(storage):
+    cache = ResultCache(revalidate_interval=60)
+    with patch(
+        "earthquake_data_layer.result_cache.dataset_version", return_value="v1"
+    ) as mock_version:
+        cache.revalidate(storage)
+        cache.revalidate(storage)
+    mock_version.assert_called_once()
+    assert cache.dataset_version == "v1"
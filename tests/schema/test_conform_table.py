@@ -0,0 +1,19 @@
+import pandas as pd
+
+from earthquake_data_layer.schema import RAW_DATA_SCHEMA, conform_table
+
+
+def test_conform():
+    df = pd.DataFrame.from_records(
+        [
+            {"id": "a", "mag": 4.2, "time": 1, "tz": None, "unknown": "x"},
+            {"id": "b", "mag": None, "time": 2, "tz": 60},
+        ]
+    )
+    table = conform_table(df)
+
+    assert table.schema == RAW_DATA_SCHEMA
+    assert table.column("tz").to_pylist() == [None, 60]
+    assert table.column("mag").to_pylist() == [4.2, None]
+    assert table.column("depth").null_count == 2
+    assert "unknown" not in table.column_names
@@ -0,0 +1,42 @@
+# pylint: disable=unused-import,redefined-outer-name
+from multiprocessing import shared_memory
+
+import pyarrow as pa
+import pytest
+
+from earthquake_data_layer.fetcher import process_responses
+from earthquake_data_layer.shared_tables import share_table, take_table
+from earthquake_data_layer.stages import FetchStages
+from tests.fetcher.conftest import (
+    data_point_2,
+    last_response_content,
+    mock_response_data,
+)
+
+
+def test_round_trip():
+    table = pa.table({"id": ["a", None, "c"], "mag": [1.5, 2.0, None]})
+
+    shared = share_table(table)
+    assert take_table(shared).equals(table)
+
+    # the block is freed once the table is taken
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=shared.name)
+
+
+def test_empty_table():
+    assert take_table(share_table(pa.table({}))).num_rows == 0
+
+
+def test_from_worker_process(last_response_content):
+    stages = FetchStages(process_workers=1)
+    try:
+        shared, count = stages.run_in_process(
+            process_responses, [last_response_content]
+        )
+    finally:
+        stages.shutdown()
+
+    assert count == last_response_content["metadata"]["count"]
+    assert take_table(shared).column("id").to_pylist() == [1]
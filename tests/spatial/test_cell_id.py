@@ -0,0 +1,41 @@
+from earthquake_data_layer.spatial import bbox_contains, bbox_intersects, cell_id
+
+
+def test_missing_coordinates():
+    assert cell_id(None, 10.0) is None
+    assert cell_id(10.0, None) is None
+
+
+def test_corners():
+    bits = 4
+    assert cell_id(-90.0, -180.0, bits=bits) == 0
+    assert cell_id(90.0, 180.0, bits=bits) == (1 << (2 * bits)) - 1
+
+
+def test_parent_is_prefix():
+    latitude, longitude = 38.3, 142.37
+    assert cell_id(latitude, longitude, bits=16) >> 2 * 6 == cell_id(
+        latitude, longitude, bits=10
+    )
+
+
+def test_nearby_points_share_a_cell():
+    assert cell_id(38.30, 142.37, bits=8) == cell_id(38.31, 142.38, bits=8)
+    assert cell_id(38.3, 142.37, bits=8) != cell_id(-38.3, -142.37, bits=8)
+
+
+def test_bbox():
+    bbox = (10.0, -5.0, 20.0, 5.0)
+    assert bbox_contains(bbox, 15.0, 0.0)
+    assert not bbox_contains(bbox, 25.0, 0.0)
+    assert bbox_intersects(bbox, 19.0, 4.0, 30.0, 30.0)
+    assert not bbox_intersects(bbox, 21.0, -5.0, 30.0, 5.0)
+
+
+def test_bbox_antimeridian():
+    bbox = (170.0, -10.0, -170.0, 10.0)
+    assert bbox_contains(bbox, 175.0, 0.0)
+    assert bbox_contains(bbox, -175.0, 0.0)
+    assert not bbox_contains(bbox, 0.0, 0.0)
+    assert bbox_intersects(bbox, -179.0, 0.0, -175.0, 1.0)
+    assert not bbox_intersects(bbox, -160.0, 0.0, 160.0, 1.0)
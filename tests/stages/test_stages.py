@@ -0,0 +1,84 @@
+import concurrent.futures
+import os
+import threading
+import time
+
+from earthquake_data_layer import metrics, stages
+from earthquake_data_layer.stages import FetchStages, Stage
+
+
+def processes_inline() -> bool:
+    return stages.fetch_stages.runs_inline
+
+
+def test_stage_concurrency():
+    stage = Stage("test", concurrency=2)
+    lock = threading.Lock()
+    running = list()
+    max_running = list()
+
+    def work():
+        with stage.slot():
+            with lock:
+                running.append(1)
+                max_running.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.pop()
+
+    threads = [threading.Thread(target=work) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert max(max_running) == 2
+    assert metrics.STAGE_QUEUE_DEPTH.value(stage="test") == 0
+    assert metrics.STAGE_IN_PROGRESS.value(stage="test") == 0
+
+
+def test_queue_depth():
+    stage = Stage("test_depth", concurrency=1)
+    release = threading.Event()
+    started = threading.Event()
+
+    def hold():
+        with stage.slot():
+            started.set()
+            release.wait(5)
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    assert started.wait(5)
+    waiter = threading.Thread(target=hold)
+    waiter.start()
+
+    deadline = time.monotonic() + 5
+    while metrics.STAGE_QUEUE_DEPTH.value(stage="test_depth") != 1:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert metrics.STAGE_IN_PROGRESS.value(stage="test_depth") == 1
+
+    release.set()
+    holder.join()
+    waiter.join()
+    assert metrics.STAGE_QUEUE_DEPTH.value(stage="test_depth") == 0
+
+
+def test_run_in_process():
+    fetch_stages = FetchStages(process_workers=1)
+    try:
+        assert fetch_stages.run_in_process(os.getpid) != os.getpid()
+        # the pool's workers process in themselves
+        assert fetch_stages.run_in_process(processes_inline)
+    finally:
+        fetch_stages.shutdown()
+
+    # without process workers the function runs in the calling thread
+    assert FetchStages(process_workers=0).run_in_process(os.getpid) == os.getpid()
+
+
+def test_child_process_uses_its_pool():
+    # e.g. a uvicorn worker, it has a parent process but isn't a worker of a pool
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+        assert not executor.submit(processes_inline).result()
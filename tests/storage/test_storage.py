@@ -2,7 +2,12 @@
 
 import os
 import tempfile
+from unittest.mock import patch
 
+import pytest
+from botocore.exceptions import ClientError
+
+from earthquake_data_layer import Storage, settings
 from tests.conftest import aws_credentials, storage, test_bucket
 
 
@@ -84,3 +89,88 @@ def test_loading_existing_and_nonexistent_objects(storage, test_bucket):
         storage.load_object("nonexistent-file", bucket_name=test_bucket)
     except FileNotFoundError:
         assert True
+
+
+def test_conditional_save(storage, test_bucket):
+    key = "pointer.json"
+
+    # creating requires the object not to exist
+    assert storage.save_object_conditional(b"v1", key, if_none_match=True)
+    assert not storage.save_object_conditional(b"v1", key, if_none_match=True)
+
+    content, etag = storage.load_object_with_etag(key)
+    assert content == b"v1"
+
+    # replacing requires the object to be unchanged since it was loaded
+    assert storage.save_object_conditional(b"v2", key, if_match=etag)
+    assert not storage.save_object_conditional(b"v3", key, if_match=etag)
+    assert storage.load_object_with_etag(key)[0] == b"v2"
+
+    assert storage.load_object_with_etag("nonexistent-file") == (None, None)
+
+
+def test_conditional_remove(storage, test_bucket):
+    assert storage.save_object(b"v1", "month.parquet")
+    etag = storage.object_etag("month.parquet")
+    assert storage.save_object(b"v2", "month.parquet")
+
+    # the object was rewritten since its ETag was read
+    assert not storage.remove_object_conditional("month.parquet", etag)
+    assert storage.remove_object_conditional(
+        "month.parquet", storage.object_etag("month.parquet")
+    )
+    assert storage.object_etag("month.parquet") is None
+
+
+def test_conditional_save_refused_when_shared(storage, test_bucket):
+    # moto doesn't enforce the conditions, the lock only orders the writers of this process
+    with patch.object(settings, "LEADER_ELECTION", True):
+        assert not storage.save_object_conditional(b"v1", "pointer.json")
+    assert storage.load_object_with_etag("pointer.json") == (None, None)
+
+    assert storage.save_object_conditional(b"v1", "pointer.json")
+
+
+def test_ranged_reads(storage, test_bucket):
+    content = bytes(range(256)) * 64
+    storage.client.put_object(Bucket=test_bucket, Key="ranged.bin", Body=content)
+
+    with storage.open_object("ranged.bin", buffer_size=1024) as file:
+        file.seek(-10, os.SEEK_END)
+        assert file.read() == content[-10:]
+        file.seek(5000)
+        assert file.read(100) == content[5000:5100]
+        assert file.tell() == 5100
+
+    # only the buffers around the read bytes were downloaded
+    with patch.object(
+        storage.client, "get_object", wraps=storage.client.get_object
+    ) as mock_get, storage.open_object("ranged.bin", buffer_size=1024) as file:
+        file.seek(5000)
+        file.read(100)
+    assert mock_get.call_args.kwargs["Range"] == "bytes=5000-6023"
+
+    with pytest.raises(FileNotFoundError):
+        storage.open_object("nonexistent-file")
+
+
+def test_conditional_writes_probe(storage, test_bucket):
+    # moto accepts the conditions without enforcing them
+    probed = Storage(client=storage.client, bucket_name=test_bucket)
+    assert not probed.enforces_conditional_writes()
+
+    put_object = storage.client.put_object
+
+    def enforcing_put_object(**kwargs):
+        if "IfMatch" in kwargs or "IfNoneMatch" in kwargs:
+            raise ClientError({"Error": {"Code": "PreconditionFailed"}}, "PutObject")
+        return put_object(**kwargs)
+
+    probed = Storage(client=storage.client, bucket_name=test_bucket)
+    with patch.object(
+        storage.client, "put_object", side_effect=enforcing_put_object
+    ) as mock_put:
+        assert probed.enforces_conditional_writes()
+        # the result is kept
+        assert probed.enforces_conditional_writes()
+    assert mock_put.call_count == 3
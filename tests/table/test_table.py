@@ -0,0 +1,115 @@
+# pylint: disable=redefined-outer-name
+from unittest.mock import patch
+
+import pandas as pd
+import pytest
+
+from earthquake_data_layer import definitions, reader, table
+from earthquake_data_layer.schema import conform_table
+from earthquake_data_layer.spatial import cell_id
+
+
+def make_table(event_ids, day=1):
+    return conform_table(
+        pd.DataFrame(
+            [
+                {
+                    "id": event_id,
+                    "time": reader.to_epoch_ms(f"2021-03-{str(day).zfill(2)}"),
+                    "longitude": 142.0,
+                    "latitude": 38.0,
+                    "cell": cell_id(38.0, 142.0),
+                }
+                for event_id in event_ids
+            ]
+        )
+    )
+
+
+@pytest.fixture
+def entry(storage):
+    return table.write_data_file(make_table(["a", "b"]), 2021, storage)
+
+
+def test_data_files_are_content_addressed(storage, entry):
+    assert entry["key"].startswith(f"{definitions.TABLE_DATA_PREFIX}/2021/")
+    assert entry["row_count"] == 2
+    assert entry["stats"]["latitude"] == [38.0, 38.0]
+
+    # the same content is written once, to the same key, without listing the bucket
+    with patch.object(
+        storage, "save_object", wraps=storage.save_object
+    ) as mock_save, patch.object(storage, "list_objects") as mock_list:
+        assert table.write_data_file(make_table(["a", "b"]), 2021, storage) == entry
+    mock_save.assert_not_called()
+    mock_list.assert_not_called()
+
+    assert table.write_data_file(make_table(["a", "c"]), 2021, storage)["key"] != (
+        entry["key"]
+    )
+
+
+def test_commit(storage, entry):
+    assert table.load_snapshot(storage)["files"] == {}
+    # the empty manifest isn't shared
+    table.load_snapshot(storage)["files"]["2021-01"] = entry
+    assert table.EMPTY_MANIFEST["files"] == {}
+
+    manifest = table.commit({"2021-03": entry}, storage)
+    assert manifest["snapshot_id"] == 1
+    assert table.load_snapshot(storage) == manifest
+
+    other = table.write_data_file(make_table(["c"], day=2), 2021, storage)
+    manifest = table.commit({"2021-04": other}, storage, removed=["2021-03"])
+    assert manifest["snapshot_id"] == 2
+    assert manifest["parent_id"] == 1
+    assert table.load_snapshot(storage)["files"] == {"2021-04": other}
+
+
+def test_concurrent_commit_is_retried(storage, entry):
+    other = table.write_data_file(make_table(["c"], day=2), 2021, storage)
+    load_pointer = table.load_pointer
+    interrupted = list()
+
+    def commit_in_between(*args, **kwargs):
+        pointer = load_pointer(*args, **kwargs)
+        # another writer commits after this writer read the pointer, once
+        if not interrupted:
+            interrupted.append(True)
+            assert table.commit({"2021-04": other}, storage)
+        return pointer
+
+    with patch.object(table, "load_pointer", side_effect=commit_in_between):
+        manifest = table.commit({"2021-03": entry}, storage)
+
+    # the commit was applied on top of the other writer's snapshot
+    assert manifest["snapshot_id"] == 2
+    assert manifest["files"] == {"2021-03": entry, "2021-04": other}
+    assert (
+        len(storage.list_objects(prefix=f"{definitions.TABLE_MANIFESTS_PREFIX}/")) == 2
+    )
+
+
+def test_commit_gives_up(storage, entry):
+    with patch.object(storage, "save_object_conditional", return_value=False), patch(
+        "earthquake_data_layer.table.settings.TABLE_COMMIT_RETRIES", 3
+    ):
+        assert table.commit({"2021-03": entry}, storage) is None
+
+    assert table.load_snapshot(storage)["files"] == {}
+    assert not storage.list_objects(prefix=f"{definitions.TABLE_MANIFESTS_PREFIX}/")
+
+
+def test_read_events(storage, entry):
+    table.commit({"2021-03": entry}, storage)
+
+    with patch(
+        "earthquake_data_layer.reader.settings.RAW_DATA_LAYOUT",
+        definitions.RAW_DATA_LAYOUT_TABLE,
+    ):
+        result = reader.read_events("2021-03-01", "2021-03-31", storage=storage)
+        assert sorted(result["id"]) == ["a", "b"]
+
+        assert reader.read_events(
+            "2021-03-01", "2021-03-31", bbox=(0.0, 0.0, 10.0, 10.0), storage=storage
+        ).empty
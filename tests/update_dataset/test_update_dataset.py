@@ -21,6 +21,9 @@ def test_complete(successful_run):
     with patch(
         "earthquake_data_layer.helpers.fetch_months_data",
         return_value=successful_run,
+    ), patch(
+        "earthquake_data_layer.helpers.probe_months",
+        side_effect=lambda months, counts: months,
     ):
         result = update_dataset(2020, 1)
 
@@ -32,7 +35,42 @@ def test_incomplete(unsuccessful_run):
     with patch(
         "earthquake_data_layer.helpers.fetch_months_data",
         return_value=unsuccessful_run,
+    ), patch(
+        "earthquake_data_layer.helpers.probe_months",
+        side_effect=lambda months, counts: months,
     ):
         result = update_dataset(2020, 1)
 
         assert result.get("status") == definitions.STATUS_COLLECTION_METADATA_INCOMPLETE
+
+
+def test_probed_months_skipped(successful_run):
+    with patch(
+        "earthquake_data_layer.helpers.fetch_months_data",
+        return_value=successful_run,
+    ) as mock_fetch, patch(
+        "earthquake_data_layer.helpers.probe_months",
+        side_effect=lambda months, counts: months[:2],
+    ):
+        update_dataset(2020, 1)
+
+    assert mock_fetch.call_args.args[0] == [(2020, 1), (2019, 12)]
+    assert len(mock_fetch.call_args.args[1]["skipped_months"]) == 10
+    assert "2019-11" in mock_fetch.call_args.args[1]["skipped_months"]
+
+
+def test_metadata_filled_in_place(successful_run):
+    metadata = dict()
+    with patch(
+        "earthquake_data_layer.helpers.fetch_months_data",
+        side_effect=lambda months, metadata, metadata_key, fence, counts: metadata,
+    ), patch(
+        "earthquake_data_layer.helpers.probe_months",
+        side_effect=lambda months, counts: months[:2],
+    ):
+        result = update_dataset(2020, 1, metadata=metadata)
+
+    assert result is metadata
+    assert len(metadata["progress"]) == 12
+    assert metadata["progress"]["2020-01"] == definitions.STATUS_MONTH_PENDING
+    assert metadata["progress"]["2019-11"] == definitions.STATUS_MONTH_SKIPPED
@@ -1,5 +1,8 @@
 from dataclasses import dataclass
 
+from earthquake_data_layer import reader
+from earthquake_data_layer.spatial import cell_id
+
 
 @dataclass
 class MockApiResponse:
@@ -7,3 +10,14 @@ class MockApiResponse:
 
     def json(self):
         return self.content
+
+
+def make_event(event_id, day, longitude, latitude, mag=4.0):
+    return {
+        "id": event_id,
+        "mag": mag,
+        "time": reader.to_epoch_ms(f"2021-03-{str(day).zfill(2)}") + 1000,
+        "longitude": longitude,
+        "latitude": latitude,
+        "cell": cell_id(latitude, longitude),
+    }
@@ -1,13 +1,23 @@
 import datetime
 from copy import deepcopy
+from typing import Callable, Optional
 
 from dateutil.relativedelta import relativedelta
 
-from earthquake_data_layer import definitions, helpers
+from earthquake_data_layer import definitions, features, helpers
 
 
-def update_dataset(last_year: int, last_month: int):
-    """collects the data from the 12 months prior to the provided year and month"""
+def update_dataset(
+    last_year: int,
+    last_month: int,
+    metadata: Optional[dict] = None,
+    fence: Optional[Callable[[], bool]] = None,
+):
+    """
+    collects the data from the 12 months prior to the provided year and month.
+    when a metadata dict is passed it is filled in place, so the caller can follow the run's progress.
+    with a fence (e.g. the leader lease) the run stops writing once the fence returns False.
+    """
 
     last_date = datetime.date(last_year, last_month, 1)
     current_month = deepcopy(last_date)
@@ -18,13 +28,46 @@ def update_dataset(last_year: int, last_month: int):
 
     first_date = datetime.date(months[-1][0], months[-1][1], 1)
 
-    metadata = {
-        "status": definitions.STATUS_COLLECTION_METADATA_INCOMPLETE,
-        "details": {},
-        "first_date": first_date,
-        "last_date": last_date,
-    }
+    if metadata is None:
+        metadata = dict()
+    metadata.update(
+        {
+            "status": definitions.STATUS_COLLECTION_METADATA_INCOMPLETE,
+            "details": {},
+            "first_date": first_date,
+            "last_date": last_date,
+            "progress": {
+                helpers.month_label(year, month): definitions.STATUS_MONTH_PENDING
+                for year, month in months
+            },
+        }
+    )
 
-    metadata = helpers.fetch_months_data(months, metadata, metadata_key=None)
+    # only fetch the months that may have changed
+    # the counts of the probed months order the fetches
+    counts = dict()
+    months_to_fetch = helpers.probe_months(months, counts=counts)
+    metadata["skipped_months"] = [
+        helpers.month_label(year, month)
+        for year, month in months
+        if (year, month) not in months_to_fetch
+    ]
+    for label in metadata["skipped_months"]:
+        metadata["progress"][label] = definitions.STATUS_MONTH_SKIPPED
+
+    metadata = helpers.fetch_months_data(
+        months_to_fetch, metadata, metadata_key=None, fence=fence, counts=counts
+    )
+
+    # update the feature tensors with the months that were written
+    updated_months = [
+        (int(year), int(month))
+        for year, year_months in metadata.get("details", {}).items()
+        for month, status in year_months.items()
+        if status == definitions.STATUS_PIPELINE_SUCCESS
+    ]
+    # quiet months are not rewritten, without change sets nothing changed
+    if updated_months and metadata.get("change_sets") and (fence is None or fence()):
+        features.build_feature_tensors(updated_months)
 
     return metadata